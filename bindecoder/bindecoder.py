@@ -3,6 +3,10 @@
 ############################################################################################################################################
 
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+import glob
 import io
 import json
 import math
@@ -11,9 +15,19 @@ import re
 import sys
 import time
 
-from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO,Iterator
 
+from . import bindecoder_cache as BC
+from . import bindecoder_columnar as BCOL
 from . import bindecoder_fields as BF
+from . import bindecoder_index as BX
+from . import bindecoder_input as BI
+from . import bindecoder_output as BO
+from . import bindecoder_plan as BP
+from . import bindecoder_profile as BPR
+from . import bindecoder_progress as BPG
+from . import bindecoder_values as BV
+from .bindecoder_input import InputDataErrorException
 
 MIN_PYTHON = (3,7)
 assert sys.version_info >= MIN_PYTHON, f"requires Python {'.'.join([str(n) for n in MIN_PYTHON])} or newer"
@@ -24,9 +38,11 @@ FILE_OFFSET_WIDTH = 8
 INITIAL_INDENT = 2          # how many spaces between file offset column and data
 INDENT_STEP = 4             # per level
 
+BULK_READ_SIZE = 64*1024    # max number of bytes read at once when many fixed-size array elements are unpacked in bulk
 
-class InputDataErrorException(ValueError):
-    pass
+PARALLEL_MIN_ELEMENTS = 16*1024         # smaller arrays are not worth starting worker processes
+PARALLEL_CHUNKS_PER_JOB = 8             # more chunks than workers balance the load
+PARALLEL_MAX_CHUNK_ELEMENTS = 64*1024   # limits the size of text produced by a worker at once
 
 
 def process_default_values(defaults: dict):
@@ -140,32 +156,84 @@ def load_json_with_comments(stream, comment_delimiter:str = "//") -> dict:
 
 class BindecoderCore:
 
-    def process(self, input_stream: BinaryIO, output_stream: TextIO, dataset: BF.StructFieldDef):
+    def __init__(self, output_buffer_size: int = BO.DEFAULT_BUFFER_SIZE, jobs: int = 1, selection: BP.FieldSelection = None):
+        self.output_buffer_size = output_buffer_size
+        self.jobs = jobs                    # the number of worker processes decoding large arrays in parallel; 1: no parallel decoding
+        self.selection = selection          # fields to present; None: all of them
+        self.parallel_ops = {}              # id(op) -> index in root block ops of top-level arrays that may be decoded in parallel
+        self.namespace = {}                 # the namespace of values decoded by the last (or current) process() call
+        self.scanner = None                 # BX.OffsetScanner skipping fields excluded from presentation (if selection is given)
+        self.input_offset = 0
+        self.records = 0                    # the number of elements of top-level arrays of structures and unions presented so far
+        self.record_ops = frozenset()       # id(op) of top-level ops, i.e. the ones which elements are counted as records
+
+    def process(self, input_stream: Union[BinaryIO,BI.InputSource], output_stream: TextIO, dataset: BF.StructFieldDef):
+        if not isinstance(input_stream, BI.InputSource):
+            input_stream = BI.StreamInput(input_stream)
         self.input_stream = input_stream
-        self.output_stream = output_stream
-        self.nesting_level = 0
+        self.output_stream = BO.BufferedOutput(output_stream, self.output_buffer_size)
         self.input_offset = 0
-        self.field_label_width = 1
-        self.trivial_field_suffix = ""
-        self.dump_structure_fields(dataset)
+        self.records = 0
+        plan = self.compile_plan(dataset, self.selection)
+        self.record_ops = frozenset(id(op) for op in plan.root.ops)
+        self.dataset = dataset
+        self.parallel_ops = self.find_parallel_ops(plan) if (self.jobs > 1) else {}
+        need_names = self.parallel_ops or (self.selection is not None)
+        self.referenced_names = BF.referenced_names(dataset) if need_names else frozenset()
+        self.scanner = BX.OffsetScanner(input_stream, self.referenced_names) if (self.selection is not None) else None
+        self.namespace = {}
+        try:
+            with BF.NamespaceScope(self.namespace):
+                self.run_block(plan.root)
+        finally:
+            self.output_stream.flush()      # also the data presented before an error was detected
+
+    def process_elements(self, input_stream: Union[BinaryIO,BI.InputSource], output_stream: TextIO, dataset: BF.StructFieldDef,
+                         first: int, last: int = None, field_name: str = None, index: BX.RecordIndex = None):
+        """
+        Presents only elements first..last-1 (up to the end if last is None) of a top-level array of structures or unions
+        (see BX.select_array_op()). Preceding fields and elements are decoded without presenting them, unless the index allows
+        jumping directly to (or close to) the first element.
+        """
+        if not isinstance(input_stream, BI.InputSource):
+            input_stream = BI.StreamInput(input_stream)
+        self.input_stream = input_stream
+        self.output_stream = BO.BufferedOutput(output_stream, self.output_buffer_size)
+        plan = self.compile_plan(dataset, self.selection)
+        op = BX.select_array_op(plan, index.field_name if (index is not None) else field_name)
+        self.namespace = {}
+        with BF.NamespaceScope(self.namespace):
+            scanner = BX.OffsetScanner(input_stream, BF.referenced_names(dataset))
+            self.scanner = scanner
+            field_count = BX.seek_element(scanner, plan, op, first, index)
+            self.input_offset = scanner.input_offset
+            count_digits = self.calculate_num_of_digits_for_value(field_count)
+            if (last is None) or (last > field_count):
+                last = field_count
+            try:
+                for i in range(first, last):
+                    self.dump_array_element(op, i, count_digits)
+            finally:
+                self.output_stream.flush()
 
-    @staticmethod
-    def determine_field_label_width(structure: BF.StructFieldDef) -> int:
+    def progress(self) -> Tuple[int,int]:
+        """
+        Returns the numbers of bytes and records processed so far; called by BPG.ProgressReporter from its own thread.
+        """
+        return self.input_offset, self.records
+
+    def find_parallel_ops(self, plan: BP.DecodePlan) -> Dict[int,int]:
         """
-        Calculates common field width for all non-structural field types according to the field placement specified for the structure.
+        Finds top-level arrays of structures which elements may be decoded by worker processes. Worker processes map the input file
+        on their own, so it must be a (mapped) file.
         """
-        field_label_width = 1   # 1 as field with passed to str.format() is always legal, and has no effect for non-empty strings
-        if structure.placement == BF.StructFieldDef.STRUCT_FIELD_PLACEMENT_ENUM.aligned:
-            for f in structure.fields.values():
-                if (not f.is_structure()) and ((not f.is_union())) and (f.is_count_trivial_one()):
-                    field_label_width = max(len(f.name), field_label_width)
-        return field_label_width
+        if getattr(self.input_stream, "file_name", None) is None:
+            return {}
+        return {id(op): i for i, op in enumerate(plan.root.ops) if (op.opcode == BP.OP_STRUCT) and (op.element_size != 0)}
 
     @staticmethod
-    def determine_trivial_field_suffix(structure: BF.StructFieldDef) -> str:
-        if structure.placement == BF.StructFieldDef.STRUCT_FIELD_PLACEMENT_ENUM.oneline:
-            return ";"
-        return ""
+    def compile_plan(dataset: BF.StructFieldDef, selection: BP.FieldSelection = None) -> BP.DecodePlan:
+        return BP.DecodePlanCompiler(FILE_OFFSET_WIDTH, INITIAL_INDENT, INDENT_STEP, selection).compile(dataset)
 
     @staticmethod
     def calculate_num_of_digits_for_value(value: int) -> int:
@@ -174,75 +242,290 @@ class BindecoderCore:
         return int(math.log(value-1, 10))+1
 
 
-    def dump_line_header(self):
-        """
-        Dumps standard line beginning:  <line break> + <offset value> + <indent>.
-        """
-        self.output_stream.write("\n{:0{}x}{:{}s}"
-                                 .format(self.input_offset, FILE_OFFSET_WIDTH, "", INITIAL_INDENT+(self.nesting_level*INDENT_STEP)))
-
-
-    def dump_structural_field(self, field: BF.StructFieldDef):
+    def dump_structural_field(self, op: BP.DecodeOp, field_count: int):
         """
         Dumps single or array structural field into output stream.
-        Returns the number of bytes fetched from input stream.
         """
-        field_count = field.count
+        write = self.output_stream.write
 
         if field_count>1:
-            self.output_stream.write("{:s} (count == {:d}):".format(field.name, field_count))
+            write("{:s} (count == {:d}):".format(op.name, field_count))
             count_digits = self.calculate_num_of_digits_for_value(field_count)
-            self.nesting_level+=1
-            for i in range(field_count):
-                self.dump_line_header()
-                self.output_stream.write("{:s}[{:{}d}]:".format(field.name, i, count_digits))
-                self.nesting_level+=1
-                self.dump_structure_fields(field)
-                self.nesting_level-=1
-            self.nesting_level-=1
+            start_index = 0
+            if (id(op) in self.parallel_ops) and (field_count >= PARALLEL_MIN_ELEMENTS):
+                start_index = self.dump_structure_array_in_parallel(op, field_count, count_digits)
+            self.dump_structure_elements(op, start_index, field_count, count_digits)
         else:
-            self.output_stream.write("{:s}:".format(field.name))
-            self.nesting_level+=1
-            self.dump_structure_fields(field)
-            self.nesting_level-=1
+            write(op.name + ":")
+            self.run_block(op.block)
 
 
-    def dump_non_structural_field(self, field: BF.NonStructuralTypeFieldDef):
+    def dump_structure_elements(self, op: BP.DecodeOp, first: int, last: int, count_digits: int):
+        """
+        Dumps elements first..last-1 of structure array.
         """
-        Dumps single or array non-structural field into output stream.
-        Returns the number of bytes fetched from input stream.
+        write = self.output_stream.write
+        line_format = op.element_line_format
+        element_block = op.element_block
+        record_step = int(id(op) in self.record_ops)
+        if element_block.single_run is not None:
+            first = self.dump_structure_array_in_bulk(op, first, last, count_digits)
+        for i in range(first, last):
+            write(line_format % self.input_offset)
+            write("{:s}[{:{}d}]:".format(op.name, i, count_digits))
+            self.run_block(element_block)
+            self.records += record_step
+            self.output_stream.commit()
+
+
+    def dump_structure_array_in_parallel(self, op: BP.DecodeOp, field_count: int, count_digits: int) -> int:
+        """
+        Dumps complete elements of structure array using worker processes, each decoding a chunk of subsequent elements.
+        The chunks texts are written in order. The chunks of fixed-size elements are located by arithmetic; otherwise
+        the elements boundaries are found by a fast pre-scan (see BX.OffsetScanner) running while workers decode the chunks found
+        so far. The pre-scan is used for fixed-size elements referring to values stored by preceding elements too, as it provides
+        the chunks with the namespace contents they start with. Returns the number of elements processed; the remaining ones
+        (if there is not enough data for all of them, or the data is invalid) are left for sequential processing, so errors
+        are reported exactly like without workers.
+        """
+        chunk_elements = min(-(-field_count // (self.jobs * PARALLEL_CHUNKS_PER_JOB)), PARALLEL_MAX_CHUNK_ELEMENTS)
+        element_size = op.element_size
+        if (element_size is not None) and (BF.referenced_names(op.field) & BX.block_value_names(op.element_block)):
+            element_size = None
+        start_offset = self.input_offset
+        if element_size is not None:
+            available = self.input_stream.size - self.input_stream.tell()
+            complete = min(field_count, available // element_size)
+            if complete < PARALLEL_MIN_ELEMENTS:
+                return 0
+            chunks = [(first, min(first + chunk_elements, complete), self.input_offset + first * element_size, count_digits, None)
+                      for first in range(0, complete, chunk_elements)]
+        else:
+            scanner = BX.OffsetScanner(self.input_stream, self.referenced_names, self.input_offset)
+            chunks = ((first, last, offset, count_digits, namespace)
+                      for first, last, offset, namespace in scanner.iter_chunks(op, field_count, chunk_elements))
+
+        write = self.output_stream.write
+        commit = self.output_stream.commit
+        pending = collections.deque()
+        worker_args = (self.input_stream.file_name, self.input_stream.start_offset, self.dataset, self.parallel_ops[id(op)],
+                       self.selection)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_parallel_worker,
+                                                    initargs=worker_args) as executor:
+            for chunk in chunks:
+                pending.append((executor.submit(_dump_structure_elements_chunk, chunk), chunk))
+                while pending and (pending[0][0].done() or (len(pending) > 2 * self.jobs)):  # limits texts kept in memory
+                    self.write_chunk_text(*pending.popleft(), element_size)
+            while pending:
+                self.write_chunk_text(*pending.popleft(), element_size)
+
+        if element_size is not None:
+            # decode the last element once more to leave the values it stores (referable by subsequent fields) in the namespace
+            self.input_stream.skip((complete - 1) * element_size)
+            BV.ValueDecoder(self.input_stream).decode_block(op.element_block)
+            self.input_offset = start_offset + complete * element_size
+            return complete
+        self.input_offset = scanner.input_offset       # the scanner stopped at the first element not processed
+        return scanner.complete
+
+    def write_chunk_text(self, future: concurrent.futures.Future, chunk: tuple, element_size: int):
         """
-        field_size = field.size
+        Writes the text of a chunk of top-level array elements decoded by a worker process, and advances the input offset,
+        so the progress of processing (see progress()) is known while the chunks are decoded. The end of a chunk of elements
+        of variable size is not known, so the offset of its beginning is taken.
+        """
+        first, last, input_offset = chunk[:3]
+        self.output_stream.write(future.result())
+        self.output_stream.commit()
+        self.input_offset = input_offset + ((last - first) * element_size if (element_size is not None) else 0)
+        self.records += last - first
+
 
-        if field.is_count_trivial_one():
-            self.output_stream.write("{:{}s} ".format(field.name+":", self.field_label_width+1))
-            field.process_data(self.output_stream, self.input_stream)
-            self.output_stream.write(self.trivial_field_suffix)
-            self.input_offset += field_size
+    def dump_array_element(self, op: BP.DecodeOp, index: int, count_digits: int):
+        """
+        Dumps single element of structure or union array, including its line header.
+        """
+        if op.opcode == BP.OP_STRUCT:
+            self.output_stream.write(op.element_line_format % self.input_offset)
+            self.output_stream.write("{:s}[{:{}d}]:".format(op.name, index, count_digits))
+            self.run_block(op.element_block)
         else:
-            field_count = field.count
-            self.output_stream.write("{:s} (count == {:d})".format(field.name, field_count))
-            if field_count>0:
-                self.output_stream.write(":")
-                count_digits = self.calculate_num_of_digits_for_value(field_count)
-                separator = field.separator
-                wrap_at = field.wrap_at
-                wrap_counter = 0
-                self.nesting_level+=1
-                for i in range(field_count):
-                    if (wrap_counter%wrap_at) == 0:
-                        self.dump_line_header()
-                        if field_count>wrap_at:
-                            self.output_stream.write("{:s}[{:{}d}]: ".format(field.name, i, count_digits))
-                    if (i%wrap_at) != 0:
-                        self.output_stream.write(separator)
-                    field.process_data(self.output_stream, self.input_stream)
-                    self.input_offset += field_size
-                    wrap_counter+=1
-                self.nesting_level-=1
-            elif field_count < 0:
-                raise InputDataErrorException("Field \"{:s}\" count is negative: {:d}".format(field_count))
+            self.dump_union_element(op, index, count_digits)
+        self.output_stream.commit()
+
+
+    def dump_structure_array_in_bulk(self, op: BP.DecodeOp, first: int, last: int, count_digits: int) -> int:
+        """
+        Dumps elements first..last-1 of structure array consisting of fixed-size numeric values only, unpacking many of them at once.
+        Returns the index of the next element to process; it is less than last only if there is not enough data for all of them.
+        """
+        write = self.output_stream.write
+        commit = self.output_stream.commit
+        run = op.element_block.single_run
+        element_size = run.size
+        line_format = op.element_line_format
+        element_line_format = op.element_block.line_format
+        chunk_elements = max(1, BULK_READ_SIZE // element_size)
+
+        i = first
+        while i < last:
+            n = min(last - i, chunk_elements)
+            raw_data = self.input_stream.peek(n * element_size)
+            complete = len(raw_data) // element_size
+            self.input_stream.skip(complete * element_size)
+            for values in self.unpack_elements(run, raw_data, complete):
+                write(line_format % self.input_offset)
+                write("{:s}[{:{}d}]:".format(op.name, i, count_digits))
+                write(element_line_format % self.input_offset)
+                self.dump_value_run_members(run, values)
+                i += 1
+                commit()
+            if id(op) in self.record_ops:
+                self.records += complete
+            if complete < n:
+                break
+        return i
+
+
+    def unpack_elements(self, run: BP.DecodeOp, raw_data: bytes, count: int) -> Iterator[tuple]:
+        """
+        Unpacks the values of count subsequent structure array elements consisting of single run of values.
+        """
+        return run.unpacker.iter_unpack(memoryview(raw_data)[:count * run.size])
+
+
+    def unpack_values(self, field: BF.NumericTypeFieldDef, raw_data: bytes, count: int) -> List[Union[int,float]]:
+        """
+        Unpacks count subsequent elements of numeric values array.
+        """
+        return field.unpack_array(raw_data, count)
+
+
+    def dump_value_run_members(self, run: BP.DecodeOp, values: tuple):
+        """
+        Dumps values unpacked for a run of single numeric values. The line beginning for the first one is expected to be already written.
+        """
+        write = self.output_stream.write
+        line_format = run.line_format
+        offset = self.input_offset
+        first = True
+        for member, value in zip(run.members, values):
+            if first:
+                first = False
+            elif member.joinable:
+                write("  ")
+            else:
+                write(line_format % offset)
+            write(member.label + member.field.formatter(value) + member.suffix)
+            offset += member.size
+        for i, store_value in run.stores:
+            store_value(values[i])
+        self.input_offset += run.size          # the run may end with skipped data of fields excluded from presentation
+
+
+    def dump_value_run(self, run: BP.DecodeOp):
+        raw_data = self.input_stream.peek(run.size)
+        if len(raw_data) == run.size:
+            self.input_stream.skip(run.size)
+            self.dump_value_run_members(run, run.unpacker.unpack(raw_data))
+            return
 
+        # not enough data: process the values one by one, so the end of data is reported exactly where it was detected
+        start_offset = self.input_offset
+        for i, member in enumerate(run.members):
+            if i > 0:
+                if member.joinable:
+                    self.output_stream.write("  ")
+                else:
+                    self.output_stream.write(run.line_format % self.input_offset)
+            self.run_op(member, 1)
+        padding = run.size - (self.input_offset - start_offset)     # data of fields excluded from presentation
+        if padding > 0:
+            if len(self.input_stream.read(padding)) < padding:
+                raise EOFError("unexpected end of data file")
+            self.input_offset += padding
+
+
+    def dump_non_structural_field(self, op: BP.DecodeOp, field_count: int):
+        """
+        Dumps an array of non-structural fields into output stream.
+        """
+        write = self.output_stream.write
+        commit = self.output_stream.commit
+        field = op.field
+        field_size = op.size
+
+        write("{:s} (count == {:d})".format(op.name, field_count))
+        if field_count>0:
+            write(":")
+            count_digits = self.calculate_num_of_digits_for_value(field_count)
+            separator = field.separator
+            wrap_at = field.wrap_at
+            line_format = op.element_line_format
+            start_index = 0
+            if op.bulk_array:
+                start_index = self.dump_numeric_array_in_bulk(op, field_count, count_digits)
+            for i in range(start_index, field_count):
+                if (i%wrap_at) == 0:
+                    commit()
+                    write(line_format % self.input_offset)
+                    if field_count>wrap_at:
+                        write("{:s}[{:{}d}]: ".format(op.name, i, count_digits))
+                else:
+                    write(separator)
+                field.process_data(self.output_stream, self.input_stream)
+                self.input_offset += field_size
+        elif field_count < 0:
+            raise InputDataErrorException("Field \"{:s}\" count is negative: {:d}".format(op.name, field_count))
+
+
+    def dump_numeric_array_in_bulk(self, op: BP.DecodeOp, field_count: int, count_digits: int) -> int:
+        """
+        Dumps elements of numeric values array unpacking many of them at once, and formatting whole (wrapped) lines.
+        Returns the number of elements processed; it is less than field_count only if there is not enough data for all of them.
+        """
+        write = self.output_stream.write
+        commit = self.output_stream.commit
+        field = op.field
+        field_size = op.size
+        format_value = field.formatter
+        separator = field.separator
+        wrap_at = field.wrap_at
+        line_format = op.element_line_format
+        with_index = field_count > wrap_at
+        chunk_elements = max(1, BULK_READ_SIZE // field_size)
+        if chunk_elements > wrap_at:
+            chunk_elements -= chunk_elements % wrap_at      # whole lines in each chunk (unless lines are longer than a chunk)
+
+        i = 0
+        while i < field_count:
+            n = min(field_count - i, chunk_elements)
+            raw_data = self.input_stream.peek(n * field_size)
+            complete = len(raw_data) // field_size
+            if complete == 0:
+                break
+            self.input_stream.skip(complete * field_size)
+            values = self.unpack_values(field, raw_data, complete)
+            j = 0
+            while j < complete:
+                in_line_index = (i + j) % wrap_at
+                if in_line_index == 0:
+                    commit()
+                    write(line_format % (self.input_offset + j * field_size))
+                    if with_index:
+                        write("{:s}[{:{}d}]: ".format(op.name, i + j, count_digits))
+                else:
+                    write(separator)
+                line_end = min(complete, j + wrap_at - in_line_index)
+                write(separator.join(map(format_value, values[j:line_end])))
+                j = line_end
+            if field.is_stored():
+                field.store_value(values[-1])       # the same value stays in the namespace as after decoding elements one by one
+            self.input_offset += complete * field_size
+            i += complete
+            if complete < n:
+                break
+        return i
 
 
     def update_offset_according_to_variant_total_size(self, field: BF.FieldDef, variant: BF.FieldDef, index: int, start_offset: int):
@@ -252,7 +535,7 @@ class BindecoderCore:
 
         remaining = variant.total_size - (self.input_offset - start_offset)
         if remaining >= 0:
-            self.input_stream.seek(remaining, io.SEEK_CUR)
+            self.input_stream.skip(remaining)
             self.input_offset += remaining
             return
 
@@ -264,92 +547,353 @@ class BindecoderCore:
             "Total size ({:d}) specified for field variant {:s} is smaller than the actual number of bytes consumed ({:d})"
             .format(variant.total_size, full_name, self.input_offset - start_offset))
 
-    def dump_union_field(self, field: BF.FieldDef):
-
-        prev_label_width = self.field_label_width
-        self.field_label_width = 1                      # no name alignment for union fields
-
-        field_count = field.count       # store locally for optimization, since it may be dynamically calculated
-
-        self.output_stream.write("{:s}".format(field.name))
+    def choose_variant(self, field: BF.UnionFieldDef, index: int) -> BF.FieldDef:
+        variant = field.choose_variant(self.input_stream)
+        if variant is None:
+            full_name = field.name if index is None else "{:s}[{:d}]".format(field.name, index)
+            raise InputDataErrorException("No variant of union {:s} triggered at offset 0x{:x}".format(full_name, self.input_offset))
+        return variant
+
+    def dump_variant(self, variant_op: BP.DecodeOp):
+        variant = variant_op.field
+        if variant.data_offset > 0:
+            self.input_stream.skip(variant.data_offset)
+            self.input_offset += variant.data_offset
+        field_count = variant_op.static_count
+        if field_count is None:
+            field_count = variant.count
+        self.run_op(variant_op, field_count)
+
+    def dump_union_field(self, op: BP.DecodeOp, field_count: int):
+        write = self.output_stream.write
+        field = op.field
+
+        write(op.name)
 
         if field_count>1:
-            self.output_stream.write(" (count == {:d}):".format(field_count))
+            write(" (count == {:d}):".format(field_count))
             count_digits = self.calculate_num_of_digits_for_value(field_count)
-            self.nesting_level+=1
-
+            record_step = int(id(op) in self.record_ops)
             for i in range(field_count):
-                start_offset = self.input_offset
-                variant = field.choose_variant(self.input_stream)
-                self.dump_line_header()
-                self.output_stream.write("{:s}[{:{}d}].".format(field.name, i, count_digits))
-                if variant.data_offset > 0:
-                    self.input_stream.seek(variant.data_offset,1)
-                    self.input_offset += variant.data_offset
-                self.dump_field(variant)
-                self.update_offset_according_to_variant_total_size(field, variant, i, start_offset)
-            self.nesting_level-=1
+                self.dump_union_element(op, i, count_digits)
+                self.records += record_step
+                self.output_stream.commit()
         else:
             start_offset = self.input_offset
-            self.output_stream.write(".")           # a separator before variant name
-            variant = field.choose_variant(self.input_stream)
-            if variant.data_offset > 0:
-                self.input_stream.seek(variant.data_offset,1)
-                self.input_offset += variant.data_offset
-            self.dump_field(variant)
+            write(".")           # a separator before variant name
+            variant = self.choose_variant(field, None)
+            self.dump_variant(op.variant_ops[variant.name])
             self.update_offset_according_to_variant_total_size(field, variant, None, start_offset)
 
-        self.field_label_width = prev_label_width   # restore name alignment for enclosing structure
+    def dump_union_element(self, op: BP.DecodeOp, index: int, count_digits: int):
+        field = op.field
+        start_offset = self.input_offset
+        variant = self.choose_variant(field, index)
+        self.output_stream.write(op.element_line_format % self.input_offset)
+        self.output_stream.write("{:s}[{:{}d}].".format(op.name, index, count_digits))
+        self.dump_variant(op.element_variant_ops[variant.name])
+        self.update_offset_according_to_variant_total_size(field, variant, index, start_offset)
 
 
-    def dump_field(self, field: BF.FieldDef):
+    def dump_skipped_bytes(self, field_count: int):
+        self.input_stream.skip(field_count)
+        self.output_stream.write("-------- skipped {:d} bytes".format(field_count))
+        self.input_offset += field_count
 
-        if field.is_union():
-            self.dump_union_field(field)
-        elif field.is_structure():
-            self.dump_structural_field(field)
-        else:
-            self.dump_non_structural_field(field)
 
+    def skip_hidden_fields(self, op: BP.DecodeOp):
+        """
+        Skips fields excluded from presentation; only the values referred to by other fields are decoded (see BX.OffsetScanner).
+        """
+        scanner = self.scanner
+        scanner.input_offset = self.input_offset
+        scanner.skip_fields(op)
+        self.input_offset = scanner.input_offset
 
-    def dump_structure_fields(self, structure: BF.StructFieldDef):
 
-        prev_label_width = self.field_label_width
-        prev_trivial_field_suffix = self.trivial_field_suffix
+    def run_op(self, op: BP.DecodeOp, field_count: int):
+        """
+        Executes single decode plan instruction. The line header (if any) is expected to be already written.
+        """
+        opcode = op.opcode
+        if opcode == BP.OP_VALUE:
+            write = self.output_stream.write
+            write(op.label)
+            op.field.process_data(self.output_stream, self.input_stream)
+            write(op.suffix)
+            self.input_offset += op.size
+        elif opcode == BP.OP_VALUE_RUN:
+            self.dump_value_run(op)
+        elif opcode == BP.OP_ARRAY:
+            self.dump_non_structural_field(op, field_count)
+        elif opcode == BP.OP_STRUCT:
+            self.dump_structural_field(op, field_count)
+        elif opcode == BP.OP_UNION:
+            self.dump_union_field(op, field_count)
+        else:
+            self.dump_skipped_bytes(field_count)
+
 
-        self.field_label_width = self.determine_field_label_width(structure)
-        self.trivial_field_suffix = self.determine_trivial_field_suffix(structure)
+    def run_block(self, block: BP.DecodeBlock):
+        """
+        Executes decode plan instructions for all fields of a structure.
+        """
+        write = self.output_stream.write
+        line_format = block.line_format
 
         need_new_line = True            # we need or does not need a new line before next field depending on a couple of conditions
 
-        for f in structure.fields.values():
+        for op in block.ops:
 
-            field_count = f.count       # NOTE: this is property that may be calculated by compiled code chunk, so take it once
+            field_count = op.static_count
+            if field_count is None:
+                field_count = op.field.count    # NOTE: this is property that may be calculated by compiled code chunk, so take it once
 
-            if isinstance(f, BF.SkipFieldDef):
-                self.input_stream.seek(field_count, io.SEEK_CUR)
-                self.dump_line_header()
-                self.output_stream.write("-------- skipped {:d} bytes".format(field_count))
-                self.input_offset += field_count
+            if op.opcode == BP.OP_SKIP:
+                write(line_format % self.input_offset)
+                self.dump_skipped_bytes(field_count)
                 need_new_line = True
                 continue
 
-            # if one-line field placement is set then do not start a new line for subsequent field if it is a simple, single value
-            if (need_new_line or
-                (not f.is_count_trivial_one()) or
-                f.is_structure() or
-                f.is_union() or
-                (structure.placement != BF.StructFieldDef.STRUCT_FIELD_PLACEMENT_ENUM.oneline)):
-                self.dump_line_header()
+            if op.opcode == BP.OP_HIDDEN:
+                self.skip_hidden_fields(op)
+                continue
+
+            # in one-line mode only add a horizontal field separator for subsequent simple, single values
+            if need_new_line or (not op.joinable):
+                write(line_format % self.input_offset)
             else:
-                self.output_stream.write("  ")                      # in one-line mode only add a horizontal field separator
+                write("  ")
 
-            need_new_line = (field_count > 1) or f.is_structure() or f.is_union()
+            need_new_line = op.breaks_line or (field_count > 1)
 
-            self.dump_field(f)
+            self.run_op(op, field_count)
 
-        self.trivial_field_suffix = prev_trivial_field_suffix
-        self.field_label_width = prev_label_width
+
+_parallel_worker_state = None      # (input file, start offset, compiled plan, array op, referenced names) of a worker process
+
+
+def _init_parallel_worker(file_name: str, start_offset: int, dataset: BF.StructFieldDef, op_index: int,
+                          selection: BP.FieldSelection = None):
+    """
+    Prepares a worker process for decoding chunks of top-level array: decodes the fields preceding the array, so the values they
+    store (e.g. referred to by string lengths) are available in the namespace.
+    """
+    global _parallel_worker_state
+    f = open(file_name, "rb")
+    plan = BindecoderCore.compile_plan(dataset, selection)
+    op = plan.root.ops[op_index]
+    with BI.MappedInput(f, start_offset) as input_source:
+        BX.decode_prefix(BV.ValueDecoder(input_source), plan.root, op)
+    names = BF.referenced_names(dataset) if (selection is not None) else None
+    _parallel_worker_state = (f, start_offset, plan, op, names)
+
+
+def _dump_structure_elements_chunk(chunk: Tuple[int,int,int,int,Union[dict,None]]) -> str:
+    first, last, input_offset, count_digits, namespace = chunk
+    f, start_offset, plan, op, names = _parallel_worker_state
+    if namespace is not None:       # values stored before the first element of the chunk (e.g. by preceding elements)
+        op.field.namespace.clear()
+        op.field.namespace.update(namespace)
+    output = io.StringIO()
+    core = BindecoderCore()
+    with BI.MappedInput(f, start_offset + input_offset) as input_source:
+        core.input_stream = input_source
+        core.output_stream = BO.BufferedOutput(output, sys.maxsize)
+        core.input_offset = input_offset
+        if names is not None:
+            core.scanner = BX.OffsetScanner(input_source, names, input_offset)
+        core.dump_structure_elements(op, first, last, count_digits)
+        core.output_stream.flush()
+    return output.getvalue()
+
+
+class ProfilingCore(BindecoderCore):
+    """
+    Presents data like BindecoderCore, gathering per field statistics at the same time (see BPR.FieldProfile): the number of values
+    and bytes, the time spent in reading, decoding and formatting them, and union variants hit rates. The instrumentation is limited
+    to this class, so normal presentation does not pay for it. Worker processes are not used.
+    """
+
+    def __init__(self, output_buffer_size: int = BO.DEFAULT_BUFFER_SIZE, selection: BP.FieldSelection = None):
+        super().__init__(output_buffer_size, jobs=1, selection=selection)
+        self.profile = BPR.Profile()
+
+    def process(self, input_stream: Union[BinaryIO,BI.InputSource], output_stream: TextIO, dataset: BF.StructFieldDef):
+        if not isinstance(input_stream, BI.InputSource):
+            input_stream = BI.StreamInput(input_stream)
+        start = time.perf_counter()
+        try:
+            super().process(BPR.TimedInput(input_stream, self.profile), output_stream, dataset)
+        finally:
+            self.profile.root.total_time += time.perf_counter() - start
+
+    def compile_plan(self, dataset: BF.StructFieldDef, selection: BP.FieldSelection = None) -> BP.DecodePlan:
+        plan = BindecoderCore.compile_plan(dataset, selection)
+        self.profile.add_block(plan.root)
+        return plan
+
+    def enter_field(self, op: BP.DecodeOp) -> tuple:
+        """Makes the statistics of given op field the current one; returns the state to be passed to leave_field()."""
+        profile = self.profile
+        state = (profile.entry(op), profile.current, self.input_offset, time.perf_counter())
+        profile.current = state[0]
+        return state
+
+    def leave_field(self, state: tuple, count: int):
+        entry, parent, start_offset, start = state
+        elapsed = time.perf_counter() - start
+        self.profile.current = parent
+        entry.calls += 1
+        entry.count += count
+        entry.bytes += self.input_offset - start_offset
+        entry.total_time += elapsed
+        parent.child_time += elapsed
+
+    def run_op(self, op: BP.DecodeOp, field_count: int):
+        state = self.enter_field(op)
+        try:
+            if op.opcode == BP.OP_VALUE:
+                self.dump_value(op)
+            else:
+                super().run_op(op, field_count)
+        finally:
+            self.leave_field(state, field_count)
+
+    def dump_value(self, op: BP.DecodeOp):
+        """
+        Dumps single value like BindecoderCore.run_op(), but decoding and formatting it separately.
+        """
+        field = op.field
+        write = self.output_stream.write
+        write(op.label)
+        raw_data = self.input_stream.read(op.size)
+        if len(raw_data) < op.size:
+            raise EOFError("unexpected end of data file")
+        start = time.perf_counter()
+        value = field.decode(raw_data)
+        self.profile.current.decode_time += time.perf_counter() - start
+        write(field.format_value(value))
+        write(op.suffix)
+        self.input_offset += op.size
+
+    def dump_value_run(self, run: BP.DecodeOp):
+        raw_data = self.input_stream.peek(run.size)
+        if len(raw_data) < run.size:
+            super().dump_value_run(run)
+            return
+        self.input_stream.skip(run.size)
+        start = time.perf_counter()
+        values = run.unpacker.unpack(raw_data)
+        self.profile.current.decode_time += time.perf_counter() - start
+        self.dump_value_run_members(run, values)
+
+    def dump_structure_array_in_bulk(self, op: BP.DecodeOp, first: int, last: int, count_digits: int) -> int:
+        state = self.enter_field(op.element_block.single_run)
+        next_index = first
+        try:
+            next_index = super().dump_structure_array_in_bulk(op, first, last, count_digits)
+        finally:
+            self.leave_field(state, next_index - first)
+        return next_index
+
+    def unpack_elements(self, run: BP.DecodeOp, raw_data: bytes, count: int) -> Iterator[tuple]:
+        start = time.perf_counter()
+        elements = list(super().unpack_elements(run, raw_data, count))
+        self.profile.current.decode_time += time.perf_counter() - start
+        return iter(elements)
+
+    def unpack_values(self, field: BF.NumericTypeFieldDef, raw_data: bytes, count: int) -> List[Union[int,float]]:
+        start = time.perf_counter()
+        values = super().unpack_values(field, raw_data, count)
+        self.profile.current.decode_time += time.perf_counter() - start
+        return values
+
+    def choose_variant(self, field: BF.UnionFieldDef, index: int) -> BF.FieldDef:
+        entry = self.profile.current
+        read_time = entry.read_time
+        start = time.perf_counter()
+        variant = super().choose_variant(field, index)
+        entry.trigger_time += (time.perf_counter() - start) - (entry.read_time - read_time)     # peeked data is read time
+        entry.choices += 1
+        entry.variant_hits[variant.name] = entry.variant_hits.get(variant.name, 0) + 1
+        return variant
+
+    def skip_hidden_fields(self, op: BP.DecodeOp):
+        state = self.enter_field(op)
+        try:
+            super().skip_hidden_fields(op)
+        finally:
+            self.leave_field(state, 1)
+
+
+class NdjsonCore:
+    """
+    Presents decoded data as NDJSON (newline delimited JSON): one object per record (see BV.ValueDecoder.iter_records()),
+    i.e. per top-level field or array element, written as soon as it is decoded. Objects have the following keys:
+    "source" (optional), "offset", "field", "index" (only if the field is split into elements or lines) and "value"
+    (see BV.ValueDecoder for value types).
+    Timestamps are presented as ISO 8601 strings. NaN and infinite floats are presented as NaN and Infinity like json module does.
+    """
+
+    def __init__(self, output_buffer_size: int = BO.DEFAULT_BUFFER_SIZE, source: str = None, selection: BP.FieldSelection = None):
+        self.output_buffer_size = output_buffer_size
+        self.source = source                # if set, each object starts with "source" key (the input file path; see batch mode)
+        self.selection = selection          # fields to present; None: all of them
+        self.encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False, separators=(",",":"), default=BV.json_default)
+        self.decoder = None
+        self.records = 0                    # the number of objects written so far
+
+    def process(self, input_stream: Union[BinaryIO,BI.InputSource], output_stream: TextIO, dataset: BF.StructFieldDef):
+        plan = BindecoderCore.compile_plan(dataset, self.selection)
+        self.decoder = BV.ValueDecoder(input_stream, timestamps_as_datetime=True)
+        if self.selection is not None:
+            self.decoder.scanner = BX.OffsetScanner(self.decoder.input_stream, BF.referenced_names(dataset))
+        self.output_stream = BO.BufferedOutput(output_stream, self.output_buffer_size)
+        write = self.output_stream.write
+        commit = self.output_stream.commit
+        encode = self.encoder.encode
+        self.namespace = {}
+        self.records = 0
+        try:
+            with BF.NamespaceScope(self.namespace):
+                for record in self.decoder.iter_records(plan.root):
+                    if record.index is None:
+                        obj = {"offset":record.offset, "field":record.name, "value":record.value}
+                    else:
+                        obj = {"offset":record.offset, "field":record.name, "index":record.index, "value":record.value}
+                    if self.source is not None:
+                        obj = {"source":self.source, **obj}
+                    write(encode(obj))
+                    write("\n")
+                    self.records += 1
+                    commit()
+        finally:
+            self.output_stream.flush()      # also the records decoded before an error was detected
+
+    def progress(self) -> Tuple[int,int]:
+        return (self.decoder.input_offset if (self.decoder is not None) else 0), self.records
+
+
+class ColumnarExportCore:
+    """
+    Exports elements of an array of structures into a columnar file (Parquet, Arrow IPC or CSV; see BCOL.ColumnarExporter)
+    instead of presenting them. Nothing but the number of exported rows is written to the output stream.
+    """
+
+    def __init__(self, file_name: str, field_name: str = None):
+        self.exporter = BCOL.ColumnarExporter(file_name, field_name)
+
+    def process(self, input_stream: Union[BinaryIO,BI.InputSource], output_stream: TextIO, dataset: BF.StructFieldDef):
+        plan = BindecoderCore.compile_plan(dataset)
+        try:
+            self.exporter.process(input_stream, plan)
+        finally:
+            output_stream.write("{:d} rows exported to \"{:s}\"\n".format(self.exporter.num_of_rows, self.exporter.file_name))
+
+    def progress(self) -> Tuple[int,int]:
+        decoder = self.exporter.decoder
+        return (decoder.input_offset if (decoder is not None) else 0), self.exporter.num_of_rows
 
 
 # This is the contents of standard common configuration file loaded automatically before format specification file provided by client.
@@ -464,6 +1008,241 @@ def range_checker(range_min: int, range_max: int):
     return checker
 
 
+def element_range(astr: str) -> Tuple[int,Union[int,None]]:
+    try:
+        return BX.parse_range(astr)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected A:B, A: or A, where 0 <= A <= B") from None
+
+
+def create_root_structure(cfg_data: dict, fmt: dict, struct_name: str, use_config_typedefs: bool) -> BF.StructFieldDef:
+    """
+    Applies default values, creates all type definitions from config and format data (both loaded from json), and returns
+    the structure selected as root of the processed data: the one named struct_name or the default dataset from format file.
+    """
+    if "DEFAULTS" in cfg_data:
+        process_default_values(cfg_data["DEFAULTS"])
+
+    if "DEFAULTS" in fmt:
+        process_default_values(fmt["DEFAULTS"])
+
+    # NOTE: base types creation and processing type definitions after default values from format file were applied,
+    # ensures that all - predefined and user-defined default values are applied to all defined fields;
+
+    BF.create_base_types()
+
+    default_structures = {}
+    if use_config_typedefs:
+        if "TYPEDEFS" in cfg_data:
+            BF.create_fields(name="default_typedefs", add_fields_as_top_level_definitions=True,
+                             structure_field_defs=cfg_data["TYPEDEFS"], fields=default_structures)
+
+    user_defined_structures = {}
+    if "TYPEDEFS" in fmt:
+        BF.create_fields(name="user_typedefs", add_fields_as_top_level_definitions=True,
+                         structure_field_defs=fmt["TYPEDEFS"], fields=user_defined_structures)
+
+    if struct_name is not None:
+        root_struct = user_defined_structures.get(struct_name, default_structures.get(struct_name))
+        if root_struct is None:
+            raise InputDataErrorException("Selected structure \"{!s}\" definition not found".format(struct_name))
+        if not root_struct.is_structure():
+            raise InputDataErrorException("Selected data structure \"{!s}\" is actually not a structure (invalid type)".format(struct_name))
+    else:
+        # structure name not specified, default dataset will be used
+        field_defs = {k:v for k,v in fmt.items() if k not in RESERVED_FORMAT_FILE_KEYS}
+        if len(field_defs) == 0:
+            raise InputDataErrorException("Structure not specified and there is no default dataset in format file")
+        selected_fields = {}
+        BF.create_fields(name="default_dataset", add_fields_as_top_level_definitions=False,
+                         structure_field_defs=field_defs, fields=selected_fields)
+        root_struct = BF.StructFieldDef("default_dataset")                              # create dynamic fake root struct default placement
+        root_struct.fields = selected_fields
+
+    BF.mark_stored_fields(root_struct)
+    return root_struct
+
+
+def get_input_size(args: argparse.Namespace, f: BinaryIO) -> Union[int,None]:
+    """
+    Returns the size of input data (from the input offset up to the end of the file), or None if it is not known (e.g. pipe).
+    """
+    return max(os.fstat(f.fileno()).st_size - args.input_offset, 0) if os.path.isfile(args.input_file) else None
+
+
+def create_progress_reporter(args: argparse.Namespace, core: Any, input_size: int) -> BPG.ProgressReporter:
+    json_stream = None
+    status_file = None
+    if args.progress_json == "-":
+        json_stream = sys.stderr
+    elif args.progress_json is not None:
+        status_file = args.progress_json
+    return BPG.ProgressReporter(core.progress, input_size, text_stream=sys.stderr if args.progress else None,
+                                json_stream=json_stream, status_file=status_file, interval=args.progress_interval)
+
+
+def process_indexed_array(args: argparse.Namespace, root_struct: BF.StructFieldDef):
+    if (args.index is None) and (args.input_file == BI.STDIN_FILE_NAME) and args.build_index:
+        raise InputDataErrorException("Index file of the standard input must be given with --index")
+    index_file = args.index if (args.index is not None) else args.input_file + BX.INDEX_FILE_EXTENSION
+
+    with BI.open_file(args.input_file) as f, BI.open_input(f, args.input_offset) as input_source:
+        input_size = get_input_size(args, f)
+        if args.build_index:
+            plan = BindecoderCore.compile_plan(root_struct)
+            try:
+                index = BX.build_index(input_source, plan, args.index_field, args.index_stride, args.input_offset, input_size)
+            except EOFError:
+                # the index of incomplete array would not be usable anyway (its element count would not match the array count)
+                sys.stderr.write("NOTE: index file \"{:s}\" not written\n".format(index_file))
+                sys.stdout.write("\nWARNING: Unexpected end of input data.\n")
+                return
+            index.save(index_file)
+            sys.stdout.write("index of {:d} elements of field \"{:s}\" written to \"{:s}\"\n"
+                             .format(index.count, index.field_name, index_file))
+            return
+
+        index = None
+        if os.path.isfile(index_file):
+            index = BX.RecordIndex.load(index_file)
+            index.check_input(args.input_offset, input_size)
+            if (args.index_field is not None) and (args.index_field != index.field_name):
+                raise InputDataErrorException("Index file \"{:s}\" indexes field \"{:s}\", not \"{:s}\""
+                                              .format(index_file, index.field_name, args.index_field))
+        elif args.index is not None:
+            raise InputDataErrorException("Index file \"{:s}\" not found".format(index_file))
+        else:
+            sys.stderr.write("NOTE: no index file \"{:s}\"; preceding elements will be decoded\n".format(index_file))
+
+        first, last = (args.element, args.element + 1) if (args.element is not None) else args.range
+        try:
+            BindecoderCore(output_buffer_size=args.output_buffer_size, selection=args.fields).process_elements(
+                input_stream=input_source, output_stream=sys.stdout, dataset=root_struct, first=first, last=last,
+                field_name=args.index_field, index=index)
+        except EOFError:
+            sys.stdout.write("\nWARNING: Unexpected end of input data.\n")
+        else:
+            sys.stdout.write("\nSUCCESS\n")
+
+
+def expand_batch_inputs(patterns: List[str], list_file_name: str = None) -> List[str]:
+    """
+    Returns the list of input files matching given glob patterns (recursive "**" allowed) and listed in the list file
+    (one path per line; "-" means the standard input). Each file is listed once, in the order of patterns.
+    """
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if (len(matches) == 0) and (not glob.has_magic(pattern)):
+            matches = [pattern]         # let the missing file be reported like any other input error
+        paths.extend(m for m in matches if not os.path.isdir(m))
+    if list_file_name is not None:
+        with (sys.stdin if (list_file_name == "-") else open(list_file_name)) as f:
+            paths.extend(line.strip() for line in f if line.strip())
+    return list(dict.fromkeys(paths))
+
+
+def batch_output_paths(paths: List[str], output_dir: str, extension: str) -> List[str]:
+    """
+    Returns output file paths mirroring the input files directory structure (relative to their common directory) in output_dir.
+    """
+    if len(paths) == 0:
+        return []
+    common_dir = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+    return [os.path.join(output_dir, os.path.relpath(os.path.abspath(p), common_dir) + extension) for p in paths]
+
+
+_batch_worker_state = None      # (dataset, settings) of a worker process
+
+
+def _init_batch_worker(dataset: BF.StructFieldDef, settings: dict):
+    global _batch_worker_state
+    _batch_worker_state = (dataset, settings)
+
+
+def _decode_batch_file(task: Tuple[str,Union[str,None]]) -> Tuple[str,str,Union[str,None]]:
+    return decode_batch_file(*_batch_worker_state, *task)
+
+
+def decode_batch_file(dataset: BF.StructFieldDef, settings: dict, input_path: str, output_path: str = None
+                      ) -> Tuple[str,str,Union[str,None]]:
+    """
+    Decodes single input file of a batch. The result is written to the output file, or returned (if output_path is None).
+    Returns (input path, status, result text or None). Errors do not stop the batch; they are reported in the status.
+    """
+    text_output = settings["output_format"] == "text"
+    if text_output:
+        core = BindecoderCore(output_buffer_size=settings["output_buffer_size"], selection=settings.get("selection"))
+    else:
+        core = NdjsonCore(output_buffer_size=settings["output_buffer_size"], source=input_path, selection=settings.get("selection"))
+    status = "SUCCESS"
+    try:
+        with open(input_path, "rb") as f, BI.open_input(f, settings["input_offset"]) as input_source:
+            if output_path is not None:
+                os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+                output_stream = open(output_path, "w")
+            else:
+                output_stream = io.StringIO()
+            with output_stream:
+                try:
+                    core.process(input_stream=input_source, output_stream=output_stream, dataset=dataset)
+                except EOFError:
+                    status = "WARNING: Unexpected end of input data."
+                except (InputDataErrorException, BF.FieldDefinitionException, BF.DefaultValueException) as e:
+                    status = "ERROR: {}: {}".format(type(e), str(e))
+                if text_output:
+                    output_stream.write("\n{:s}\n".format(status))
+                text = output_stream.getvalue() if (output_path is None) else None
+    except OSError as e:
+        return input_path, "ERROR: {}: {}".format(type(e), str(e)), None
+    return input_path, status, text
+
+
+def process_batch(args: argparse.Namespace, root_struct: BF.StructFieldDef) -> bool:
+    """
+    Decodes all the batch input files with common field definitions, using a pool of worker processes if requested.
+    Each result is written to its own file in the output directory, or (NDJSON only) to the standard output.
+    Returns False if decoding of any file failed.
+    """
+    input_paths = expand_batch_inputs(args.batch or [], args.batch_list)
+    if args.output_dir is not None:
+        extension = ".txt" if (args.output_format == "text") else ".ndjson"
+        output_paths = batch_output_paths(input_paths, args.output_dir, extension)
+    elif args.output_format == "ndjson":
+        output_paths = [None] * len(input_paths)            # a combined stream
+    else:
+        raise InputDataErrorException("Text output of batch mode requires --output-dir")
+
+    settings = {"output_format": args.output_format, "output_buffer_size": args.output_buffer_size, "input_offset": args.input_offset,
+                "selection": args.fields}
+    tasks = list(zip(input_paths, output_paths))
+    jobs = min(args.jobs or os.cpu_count() or 1, max(len(tasks), 1))
+    if jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                                                          initargs=(root_struct, settings))
+        results = executor.map(_decode_batch_file, tasks, chunksize=max(1, min(64, len(tasks) // (jobs * 4))))
+    else:
+        executor = None
+        results = (decode_batch_file(root_struct, settings, *task) for task in tasks)
+
+    num_of_failures = 0
+    num_of_warnings = 0
+    try:
+        for input_path, status, text in results:
+            if text is not None:
+                sys.stdout.write(text)
+            if status.startswith("ERROR"):
+                num_of_failures += 1
+            elif status != "SUCCESS":
+                num_of_warnings += 1
+            sys.stderr.write("{:s}: {:s}\n".format(input_path, status))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    sys.stderr.write("{:d} files processed: {:d} incomplete, {:d} failed\n".format(len(tasks), num_of_warnings, num_of_failures))
+    return num_of_failures == 0
+
+
 def true_main():
     program_file_name = os.path.basename(__file__)
     program_path = os.path.dirname(os.path.abspath(__file__))
@@ -481,10 +1260,68 @@ def true_main():
     parser.add_argument("--struct","-st", type=str, default=None,
                         help="structure name to start from instead of top-level dataset")
     parser.add_argument("--format","-f", help="json file containing format specification")
-    parser.add_argument("input_file", nargs='?', help="binary input file to process")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="do not use cached field definitions; always build them from configuration and format files")
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="directory where field definitions built from configuration and format files are cached; "
+                             "default: $XDG_CACHE_HOME/bindecoder or ~/.cache/bindecoder")
+    parser.add_argument("--output-format", choices=["text","ndjson"], default="text",
+                        help="output format: human friendly text (default), or NDJSON - one JSON object per top-level field "
+                             "or array element; in the latter case the final status is written to the standard error")
+    parser.add_argument("--output-buffer-size", type=range_checker(1,1024*1024*1024), default=BO.DEFAULT_BUFFER_SIZE,
+                        help="number of characters collected before they are written to the standard output")
+    parser.add_argument("--fields", type=BP.FieldSelection.parse, default=None, metavar="PATTERNS",
+                        help="present only given fields: comma separated dotted paths (e.g. header.num_of_records,points.x) "
+                             "that may contain wildcards (*, ?, [...]); other fields are skipped without formatting")
+    parser.add_argument("--profile", action="store_true",
+                        help="gather per field statistics (values count, bytes, time of reading, decoding and formatting, union "
+                             "variants hit rates) and write them sorted by time to the standard error at the end; text output only")
+    parser.add_argument("--profile-json", type=str, default=None, metavar="FILE",
+                        help="like --profile, but write the statistics into given json file")
+    parser.add_argument("--progress", action="store_true",
+                        help="report the progress (bytes and records processed, throughput, ETA) on the standard error")
+    parser.add_argument("--progress-json", type=str, default=None, metavar="FILE",
+                        help="report the progress as json: status lines written to the standard error (\"-\") or status file "
+                             "replaced with every report")
+    parser.add_argument("--progress-interval", type=float, default=BPG.DEFAULT_INTERVAL, metavar="SECONDS",
+                        help="time between subsequent progress reports; default: {:g} s".format(BPG.DEFAULT_INTERVAL))
+    parser.add_argument("--jobs", "-j", type=range_checker(0,1024), default=1,
+                        help="number of worker processes decoding large top-level arrays of structures in parallel; "
+                             "0: as many as CPUs; default: 1 (no worker processes)")
+    parser.add_argument("--export", type=str, default=None, metavar="FILE",
+                        help="export elements of top-level array of structures into a columnar file instead of presenting data; "
+                             "the format is chosen by the file extension: .parquet, .arrow/.feather (both require pyarrow) or .csv")
+    parser.add_argument("--export-field", type=str, default=None,
+                        help="top-level structure field to export; default: the first top-level array of structures")
+    parser.add_argument("--build-index", action="store_true",
+                        help="build an index of top-level array elements (see --index-field) and save it in the index file "
+                             "instead of presenting data")
+    parser.add_argument("--index", type=str, default=None, metavar="FILE",
+                        help="index file used by --build-index, --element and --range; default: input file name + \"{:s}\""
+                             .format(BX.INDEX_FILE_EXTENSION))
+    parser.add_argument("--index-field", type=str, default=None,
+                        help="top-level array of structures or unions to index; default: the first one")
+    parser.add_argument("--index-stride", type=range_checker(1,1024*1024*1024), default=1,
+                        help="index only every n-th element; smaller index file, but more elements decoded to reach the requested one")
+    element_group = parser.add_mutually_exclusive_group()
+    element_group.add_argument("--element", type=range_checker(0,sys.maxsize), default=None,
+                               help="present only given element of indexed array; the index is used if it exists")
+    element_group.add_argument("--range", type=element_range, default=None, metavar="A:B",
+                               help="present only elements A..B-1 of indexed array; the index is used if it exists")
+    parser.add_argument("--batch", nargs="+", default=None, metavar="PATTERN",
+                        help="batch mode: decode all the files matching given glob patterns (\"**\" matches any subdirectories) "
+                             "with the same format, using --jobs worker processes")
+    parser.add_argument("--batch-list", type=str, default=None, metavar="FILE",
+                        help="batch mode: decode all the files listed (one per line) in given file; \"-\" means the standard input")
+    parser.add_argument("--output-dir", type=str, default=None,
+                        help="batch mode: directory for output files, one per input file (\".txt\" or \".ndjson\" extension "
+                             "appended); default for NDJSON: a single stream (to the standard output) with \"source\" keys")
+    parser.add_argument("input_file", nargs='?',
+                        help="binary input file to process; \"{:s}\" means the standard input (it may be a pipe, like any other "
+                             "non-seekable file)".format(BI.STDIN_FILE_NAME))
 
     args = parser.parse_args()
-    cfg_data = None
+    cfg_text = None
 
     if args.recreate_config:
         sys.stderr.write("re-creating config file \"{!s}\"\n".format(config_full_path))
@@ -499,71 +1336,92 @@ def true_main():
             sys.stderr.write("warning: config file \"{!s}\" not found; continuing using defaults\n".format(config_full_path))
         else:
             with open(config_full_path,"r") as f:
-                cfg_data = load_json_with_comments(f)
+                cfg_text = f.read()
 
-    if cfg_data is None:
-        cfg_data = load_json_with_comments(io.StringIO(STANDARD_CONFIG))    # use default config values
-
-    if "DEFAULTS" in cfg_data:
-        process_default_values(cfg_data["DEFAULTS"])
+    if cfg_text is None:
+        cfg_text = STANDARD_CONFIG      # use default config values
 
     if args.format is not None:
         with open(args.format) as f:
-            fmt = load_json_with_comments(f, comment_delimiter = "//")
+            fmt_text = f.read()
     else:
         sys.stderr.write("NOTE: no format definition file specified; only predefined structures may be used\n")
-        fmt = {}
-
-    if "DEFAULTS" in fmt:
-        process_default_values(fmt["DEFAULTS"])
-
-    # NOTE: base types creation and processing type definitions after default values from format file were applied,
-    # ensures that all - predefined and user-defined default values are applied to all defined fields;
-
-    BF.create_base_types()
-
-    default_structures = {}
-    if not args.skip_config:
-        if "TYPEDEFS" in cfg_data:
-            BF.create_fields(name="default_typedefs", add_fields_as_top_level_definitions=True,
-                             structure_field_defs=cfg_data["TYPEDEFS"], fields=default_structures)
-
-    user_defined_structures = {}
-    if "TYPEDEFS" in fmt:
-        BF.create_fields(name="user_typedefs", add_fields_as_top_level_definitions=True,
-                         structure_field_defs=fmt["TYPEDEFS"], fields=user_defined_structures)
-
-    if args.struct is not None:
-        root_struct = user_defined_structures.get(args.struct, default_structures.get(args.struct))
-        if root_struct is None:
-            raise InputDataErrorException("Selected structure \"{!s}\" definition not found".format(args.struct))
-        if not root_struct.is_structure():
-            raise InputDataErrorException("Selected data structure \"{!s}\" is actually not a structure (invalid type)".format(args.struct))
-    else:
-        # structure name not specified, default dataset will be used
-        field_defs = {k:v for k,v in fmt.items() if k not in RESERVED_FORMAT_FILE_KEYS}
-        if len(field_defs) == 0:
-            raise InputDataErrorException("Structure not specified and there is no default dataset in format file")
-        selected_fields = {}
-        BF.create_fields(name="default_dataset", add_fields_as_top_level_definitions=False,
-                         structure_field_defs=field_defs, fields=selected_fields)
-        root_struct = BF.StructFieldDef("default_dataset")                              # create dynamic fake root struct default placement
-        root_struct.fields = selected_fields
-
-    if args.input_file is None:
+        fmt_text = None
+
+    # the definitions depend only on the texts of both files and the options below, so they may be taken from the cache
+    root_struct = None
+    cache = None
+    if not args.no_cache:
+        cache = BC.FormatCache(args.cache_dir)
+        cache_key = cache.make_key(cfg_text, fmt_text or "", str(args.struct), str(args.skip_config))
+        root_struct = cache.load(cache_key)
+
+    if root_struct is None:
+        cfg_data = load_json_with_comments(io.StringIO(cfg_text))
+        fmt = load_json_with_comments(io.StringIO(fmt_text), comment_delimiter = "//") if (fmt_text is not None) else {}
+        root_struct = create_root_structure(cfg_data, fmt, args.struct, use_config_typedefs=not args.skip_config)
+        if cache is not None:
+            cache.store(cache_key, root_struct)
+
+    if (args.fields is not None) and (args.build_index or (args.export is not None)):
+        parser.error("--fields cannot be used with --build-index or --export")
+
+    profile = args.profile or (args.profile_json is not None)
+    if profile and ((args.output_format != "text") or (args.export is not None) or (args.jobs != 1) or args.build_index or
+                    (args.element is not None) or (args.range is not None) or (args.batch is not None) or (args.batch_list is not None)):
+        parser.error("--profile and --profile-json may be used only for text presentation of a single file, without --jobs")
+
+    progress = args.progress or (args.progress_json is not None)
+    if progress and (args.build_index or (args.element is not None) or (args.range is not None) or (args.batch is not None) or
+                     (args.batch_list is not None)):
+        parser.error("--progress and --progress-json cannot be used in batch mode or with --build-index, --element or --range")
+    if args.progress_interval <= 0:
+        parser.error("--progress-interval must be positive")
+    if (args.progress_json is not None) and (args.progress_json != "-"):
+        status_dir = os.path.dirname(os.path.abspath(args.progress_json))
+        if not os.access(status_dir, os.W_OK):      # the status file is replaced with a temporary one created in the same directory
+            parser.error("--progress-json status file \"{:s}\" cannot be written: directory \"{:s}\" does not exist or is not "
+                         "writable".format(args.progress_json, status_dir))
+
+    if (args.batch is not None) or (args.batch_list is not None):
+        if args.input_file is not None:
+            parser.error("input_file cannot be given in batch mode")
+        if not process_batch(args, root_struct):
+            sys.exit(1)
+    elif args.input_file is None:
         sys.stderr.write("NOTE: No input file, skipping data processing\n")
+    elif args.build_index or (args.element is not None) or (args.range is not None):
+        process_indexed_array(args, root_struct)
     else:
-        with open(args.input_file,"rb") as f:
-            if args.input_offset > 0:
-                f.seek(args.input_offset)
-
+        if args.export is not None:
+            core = ColumnarExportCore(args.export, args.export_field)
+            status_stream = sys.stdout
+        elif args.output_format == "ndjson":
+            core = NdjsonCore(output_buffer_size=args.output_buffer_size, selection=args.fields)
+            status_stream = sys.stderr          # keep the output parseable
+        elif profile:
+            core = ProfilingCore(output_buffer_size=args.output_buffer_size, selection=args.fields)
+            status_stream = sys.stdout
+        else:
+            core = BindecoderCore(output_buffer_size=args.output_buffer_size, jobs=args.jobs or os.cpu_count() or 1,
+                                  selection=args.fields)
+            status_stream = sys.stdout
+        with BI.open_file(args.input_file) as f, BI.open_input(f, args.input_offset) as input_source:
+            reporter = create_progress_reporter(args, core, get_input_size(args, f)) if progress else contextlib.nullcontext()
             try:
-                core = BindecoderCore()
-                core.process(input_stream=f, output_stream=sys.stdout, dataset=root_struct)
+                with reporter:
+                    core.process(input_stream=input_source, output_stream=sys.stdout, dataset=root_struct)
             except EOFError:
-                sys.stdout.write("\nWARNING: Unexpected end of input data.\n")
+                status_stream.write("\nWARNING: Unexpected end of input data.\n")
             else:
-                sys.stdout.write("\nSUCCESS\n")
+                status_stream.write("\nSUCCESS\n")
+        if profile:
+            sys.stdout.flush()
+            if args.profile_json is not None:
+                with open(args.profile_json, "w") as f:
+                    json.dump(core.profile.to_dict(), f, indent=2)
+            if args.profile:
+                core.profile.write_report(sys.stderr)
 
 
 def main():
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import collections.abc
+import io
+import json
+import os
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO,Iterator
+
+from . import bindecoder as BD
+from . import bindecoder_fields as BF
+from . import bindecoder_index as BX
+from . import bindecoder_input as BI
+from . import bindecoder_plan as BP
+from . import bindecoder_values as BV
+from .bindecoder_input import InputDataErrorException
+
+RECORD_DICT = "dict"         # record types yielded by iter_records()
+RECORD_TUPLE = "tuple"
+RECORD_OBJECT = "object"
+
+CHECKPOINT_INTERVAL = 64    # every n-th element of variable-size elements array keeps a copy of the namespace (see ArrayView)
+
+# Library API. Usage:
+#     root = decode("list_of_lists.bin", "test_structures_format.json", root="list_of_lists")
+#     root.lists[3].eyecatcher        # only the fields needed to locate and decode this value are read
+#     for record in iter_records("list_of_lists.bin", "test_structures_format.json", "lists", root="list_of_lists"): ...
+#
+# NOTE: the namespace of decoded values (see BF.FieldDef.namespace) is common for all the views of the data returned by decode();
+# it is restored from a copy taken when a view was created whenever the view data is accessed, so views may be used in any order.
+# The views of different decode() results may be used concurrently (e.g. from many threads); the views of the same one may not.
+
+
+def load_format(format: Union[str,dict,BF.StructFieldDef], root: str = None, config: Union[str,dict] = None) -> BF.StructFieldDef:
+    """
+    Returns the root structure definition built from the format (a json file path, or its contents already loaded)
+    and the configuration (a json file path, its contents, or None for the standard configuration). The root is the structure
+    named root, or the default dataset from the format. Already built definitions are returned as they are.
+    The definitions are built in a private registry (see BF.DefinitionScope), so any number of formats may be loaded and used
+    in the same process.
+    """
+    if isinstance(format, BF.StructFieldDef):
+        return format
+    if config is None:
+        config = BD.load_json_with_comments(io.StringIO(BD.STANDARD_CONFIG))
+    elif not isinstance(config, dict):
+        with open(config) as f:
+            config = BD.load_json_with_comments(f)
+    if not isinstance(format, dict):
+        with open(format) as f:
+            format = BD.load_json_with_comments(f, comment_delimiter = "//")
+    with BF.DefinitionScope():
+        return BD.create_root_structure(config, format, root, use_config_typedefs=True)
+
+
+def decode(source: Union[str,os.PathLike,bytes,bytearray,memoryview,BinaryIO], format: Union[str,dict,BF.StructFieldDef],
+           root: str = None, config: Union[str,dict] = None, input_offset: int = 0, timestamps_as_datetime: bool = False
+           ) -> "StructView":
+    """
+    Returns a lazily decoded view of the root structure (see load_format()) of the data in given file (a path or a file object
+    opened in binary mode) or buffer. Nothing is decoded until a field is accessed; see StructView and ArrayView.
+    Values are presented like by BV.ValueDecoder: numbers, strings, seconds (or datetime objects) for timestamps, and dicts
+    for unions.
+    """
+    dataset = load_format(format, root, config)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        input_source = BI.StreamInput(io.BytesIO(source))
+        input_source.seek(input_offset)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            input_source = BI.open_input(f, input_offset)       # the mapping stays valid when the file is closed
+            if isinstance(input_source, BI.StreamInput):
+                input_source = BI.StreamInput(io.BytesIO(f.read()))
+    else:
+        input_source = BI.open_input(source, input_offset)
+    if isinstance(input_source, BI.PipeInput):      # views go back and forth, so the data of non-seekable streams is kept in memory
+        input_source = BI.StreamInput(io.BytesIO(input_source.read_remaining()))
+    plan = BD.BindecoderCore.compile_plan(dataset)
+    context = DecodeContext(input_source, dataset, timestamps_as_datetime)
+    return StructView(context, plan.root, 0, {})
+
+
+def iter_records(source: Union[str,os.PathLike,bytes,bytearray,memoryview,BinaryIO], format: Union[str,dict,BF.StructFieldDef],
+                 array_path: str = None, root: str = None, config: Union[str,dict] = None, input_offset: int = 0,
+                 record_type: str = RECORD_DICT, timestamps_as_datetime: bool = False) -> Iterator[Any]:
+    """
+    Yields elements of an array of structures or unions one by one, decoded while the iteration proceeds; the data following
+    the yielded element is not read until the next one is requested, so the memory usage does not depend on the array size,
+    and the iteration may be stopped at any time (e.g. with itertools.islice()) without reading the rest of the input.
+    The array is given by its dotted path in the root structure (see load_format()), e.g. "lists" or "header.entries" (through
+    single structures); by default the first top-level array of structures or unions is used. Preceding fields are only scanned
+    for the values the array depends on (e.g. its count).
+    Structure elements are yielded as record_type: RECORD_DICT (dict like from BV.ValueDecoder), RECORD_TUPLE (values in field
+    order) or RECORD_OBJECT (an instance of a __slots__ class created for the structure, see record_class()); nested values are
+    the same as from BV.ValueDecoder. Union elements are always yielded as dicts (variant name -> value).
+    """
+    if record_type not in (RECORD_DICT, RECORD_TUPLE, RECORD_OBJECT):
+        raise ValueError("Unknown record type \"{!s}\"".format(record_type))
+    dataset = load_format(format, root, config)
+    plan = BD.BindecoderCore.compile_plan(dataset)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from _iter_records(BI.open_input(f, input_offset), dataset, plan, array_path, record_type, timestamps_as_datetime)
+        return
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        input_source = BI.StreamInput(io.BytesIO(source))
+        input_source.seek(input_offset)
+    else:
+        input_source = BI.open_input(source, input_offset)
+    yield from _iter_records(input_source, dataset, plan, array_path, record_type, timestamps_as_datetime)
+
+
+def _iter_records(input_source: BI.InputSource, dataset: BF.StructFieldDef, plan: BP.DecodePlan, array_path: str,
+                  record_type: str, timestamps_as_datetime: bool) -> Iterator[Any]:
+    # NOTE: the namespace scope is entered for each element separately, so that it does not leak to the code using the records
+    scope = BF.NamespaceScope()
+    with input_source:
+        with scope:
+            scanner = BX.OffsetScanner(input_source, BF.referenced_names(dataset))
+            op, field_count = _seek_array(scanner, plan, array_path)
+        decoder = BV.ValueDecoder(input_source, timestamps_as_datetime)
+        decoder.input_offset = scanner.input_offset
+        if op.opcode == BP.OP_UNION:
+            if field_count <= 1:
+                with scope:
+                    value = decoder.decode_union(op.field, op.variant_ops, None)
+                yield value
+                return
+            for i in range(field_count):
+                with scope:
+                    value = decoder.decode_union(op.field, op.element_variant_ops, i)
+                yield value
+            return
+
+        block = op.element_block if (field_count > 1) else op.block     # like in presentation, a single structure is decoded once
+        decode_block = decoder.decode_block
+        if record_type == RECORD_TUPLE:
+            make_record = lambda values: tuple(values.values())
+        elif record_type == RECORD_OBJECT:
+            record = record_class(block)
+            make_record = lambda values: record(*values.values())
+        else:
+            make_record = None
+        for i in range(max(field_count, 1)):
+            with scope:
+                values = decode_block(block)
+            yield values if (make_record is None) else make_record(values)
+
+
+def _seek_array(scanner: BX.OffsetScanner, plan: BP.DecodePlan, array_path: str) -> Tuple[BP.DecodeOp,int]:
+    """
+    Scans the fields preceding the array (see iter_records()), and returns its op and count.
+    """
+    if array_path is None:
+        op = BX.select_array_op(plan)
+        return op, BX.decode_prefix(scanner, plan.root, op)
+    block = plan.root
+    names = array_path.split(".")
+    for depth, name in enumerate(names):
+        op = next((op for op in block.ops if (op.opcode in (BP.OP_STRUCT, BP.OP_UNION)) and (op.name == name)), None)
+        if op is None:
+            raise InputDataErrorException("Field \"{:s}\" is not a structure or union field"
+                                          .format(".".join(names[:depth+1])))
+        field_count = BX.decode_prefix(scanner, block, op)
+        if depth == len(names) - 1:
+            return op, field_count
+        if (op.opcode != BP.OP_STRUCT) or (field_count > 1):
+            raise InputDataErrorException("Field \"{:s}\" is not a single structure".format(".".join(names[:depth+1])))
+        block = op.block
+
+
+class RecordObject:
+    """
+    Base of the record classes created by record_class(): fields are kept in __slots__, in the structure field order.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def _asdict(self) -> Dict[str,Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other) -> bool:
+        return (type(self) is type(other)) and (self._asdict() == other._asdict())
+
+    def __repr__(self) -> str:
+        return "{:s}({:s})".format(type(self).__name__, ", ".join("{:s}={!r}".format(k, v) for k, v in self._asdict().items()))
+
+
+def record_class(block: BP.DecodeBlock) -> type:
+    """
+    Creates RecordObject subclass with the fields of the structure (skipped fields are not included).
+    """
+    names = []
+    for op in block.ops:
+        for op in (op.members if (op.opcode == BP.OP_VALUE_RUN) else [op]):
+            if op.opcode != BP.OP_SKIP:
+                if not op.name.isidentifier():
+                    raise InputDataErrorException("Field name \"{:s}\" of structure \"{:s}\" may not be a record attribute"
+                                                  .format(op.name, block.structure.name))
+                names.append(op.name)
+    return type(block.structure.name, (RecordObject,), {"__slots__": tuple(names)})
+
+
+class DecodeContext:
+    """
+    The data shared by all the views of decoded data: the input, and decoders positioned on demand.
+    """
+    __slots__ = ("input_source", "namespace", "scope", "scanner", "decoder")
+
+    def __init__(self, input_source: BI.InputSource, dataset: BF.StructFieldDef, timestamps_as_datetime: bool):
+        self.input_source = input_source
+        self.namespace = {}
+        self.scope = BF.NamespaceScope(self.namespace)     # entered whenever the data is accessed
+        self.scanner = BX.OffsetScanner(input_source, BF.referenced_names(dataset))
+        self.decoder = BV.ValueDecoder(input_source, timestamps_as_datetime)
+
+    def restore(self, namespace: Union[dict,None]):
+        if namespace is not None:
+            self.namespace.clear()
+            self.namespace.update(namespace)
+
+    def decoder_at(self, offset: int, namespace: Union[dict,None]) -> BV.ValueDecoder:
+        self.restore(namespace)
+        self.scanner.seek(offset)
+        self.decoder.input_offset = offset
+        return self.decoder
+
+    def read_value(self, op: BP.DecodeOp, offset: int, namespace: Union[dict,None]) -> Any:
+        decoder = self.decoder_at(offset, namespace)
+        return decoder.decoder_of(op.field)(decoder.read(op.size))
+
+    def view(self, op: BP.DecodeOp, offset: int, field_count: int, namespace: dict) -> Any:
+        """
+        Returns the value of the field: a view for arrays and structures, decoded value for other fields.
+        """
+        if op.opcode == BP.OP_VALUE:
+            return self.read_value(op, offset, namespace)
+        if (op.opcode == BP.OP_ARRAY) or (field_count > 1):
+            return ArrayView(self, op, offset, field_count, namespace)
+        if op.opcode == BP.OP_STRUCT:
+            return StructView(self, op.block, offset, namespace)
+        return self.decoder_at(offset, namespace).decode_union(op.field, op.variant_ops, None)
+
+
+def _needs_namespace(op: BP.DecodeOp) -> bool:
+    """Whether decoding the field later requires the namespace contents (e.g. string length) from the time it was located."""
+    return (op.opcode in (BP.OP_STRUCT, BP.OP_UNION)) or isinstance(op.field, BF.CharacterFieldDef)
+
+
+class StructView:
+    """
+    Lazily decoded structure. Fields are accessible as attributes (view.name) or items (view["name"]); the ones named like
+    StructView methods only as items. Fields are located on demand, up to the one accessed (decoding only the values their
+    sizes depend on); a field value is decoded each time it is accessed.
+    """
+    __slots__ = ("_context", "_block", "_offset", "_fields", "_next", "_next_offset", "_next_namespace")
+
+    def __init__(self, context: DecodeContext, block: BP.DecodeBlock, offset: int, namespace: dict):
+        self._context = context
+        self._block = block
+        self._offset = offset
+        self._fields = {}                   # located fields: name -> (op, offset, count, namespace or None)
+        self._next = 0                      # the index of the first op not located yet; None if all are located
+        self._next_offset = offset
+        self._next_namespace = namespace    # the namespace contents when the next op starts
+
+    def _locate(self, name: str = None) -> Dict[str,Tuple[BP.DecodeOp,int,int,Union[dict,None]]]:
+        """
+        Locates the fields up to the one of given name (all of them if None).
+        """
+        fields = self._fields
+        if (self._next is None) or ((name is not None) and (name in fields)):
+            return fields
+        with self._context.scope:
+            self._scan(name)
+        return fields
+
+    def _scan(self, name: Union[str,None]):
+        fields = self._fields
+        context = self._context
+        scanner = context.scanner
+        context.restore(self._next_namespace)
+        scanner.seek(self._next_offset)
+        ops = self._block.ops
+        i = self._next
+        while i < len(ops):
+            op = ops[i]
+            offset = scanner.input_offset
+            if op.opcode == BP.OP_VALUE_RUN:
+                for member in op.members:
+                    fields[member.name] = (member, offset, 1, None)
+                    offset += member.size
+                scanner.scan_value_run(op)
+            else:
+                field_count = scanner.field_count(op)
+                if op.opcode == BP.OP_SKIP:
+                    scanner.skip(field_count)
+                else:
+                    namespace = context.namespace.copy() if _needs_namespace(op) else None
+                    fields[op.name] = (op, offset, field_count, namespace)
+                    if op.name == name:         # stop before scanning the field itself; it may be large
+                        break
+                    scanner.decode_op(op, field_count)
+            i += 1
+            if (name is not None) and (name in fields):
+                break
+        if i == len(ops):
+            self._next = None
+        else:
+            self._next = i
+            self._next_offset = scanner.input_offset
+            self._next_namespace = context.namespace.copy()
+
+    def __getitem__(self, name: str) -> Any:
+        op, offset, field_count, namespace = self._locate(name)[name]
+        with self._context.scope:
+            return self._context.view(op, offset, field_count, namespace)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError("structure has no field \"{:s}\"".format(name)) from None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._locate()
+
+    def __iter__(self):
+        return iter(self._locate())
+
+    def __len__(self) -> int:
+        return len(self._locate())
+
+    def keys(self):
+        return self._locate().keys()
+
+    def offset(self, name: str = None) -> int:
+        """Returns the offset of the structure, or of its field."""
+        return self._offset if (name is None) else self._locate()[name][1]
+
+    def to_dict(self) -> Dict[str,Any]:
+        """Decodes the whole structure."""
+        return {name: materialize(self[name]) for name in self._locate()}
+
+    def __repr__(self) -> str:
+        return "<StructView {:s} at 0x{:x}>".format(self._block.structure.name, self._offset)
+
+
+class ArrayView(collections.abc.Sequence):
+    """
+    Lazily decoded array of values, structures or unions. Elements are decoded when accessed. Fixed-size elements are located
+    by arithmetic; variable-size ones by scanning the preceding elements (once; their offsets are remembered).
+    """
+    __slots__ = ("_context", "_op", "_offset", "_count", "_namespace", "_element_size", "_offsets", "_checkpoints")
+
+    def __init__(self, context: DecodeContext, op: BP.DecodeOp, offset: int, field_count: int, namespace: Union[dict,None]):
+        if field_count < 0:
+            raise InputDataErrorException("Field \"{:s}\" count is negative: {:d}".format(op.name, field_count))
+        self._context = context
+        self._op = op
+        self._offset = offset
+        self._count = field_count
+        self._namespace = namespace
+        self._element_size = op.size if (op.opcode == BP.OP_ARRAY) else op.element_size
+        self._offsets = [offset]            # known elements offsets (variable-size elements)
+        self._checkpoints = {0: namespace}  # element index -> the namespace contents when the element starts (every n-th one)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: Union[int,slice]) -> Any:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not (0 <= index < self._count):
+            raise IndexError("array index out of range")
+
+        op = self._op
+        context = self._context
+        if self._element_size is not None:
+            offset = self._offset + index * self._element_size
+            if op.opcode == BP.OP_ARRAY:
+                with context.scope:
+                    return context.read_value(op, offset, self._namespace)
+            return StructView(context, op.element_block, offset, self._namespace)
+
+        with context.scope:
+            offset, namespace = self._locate(index)
+            if op.opcode == BP.OP_STRUCT:
+                return StructView(context, op.element_block, offset, namespace)
+            return context.decoder_at(offset, namespace).decode_union(op.field, op.element_variant_ops, index)
+
+    def _rewind(self, index: int):
+        """Positions the scanner at the beginning of already located element, with the namespace restored."""
+        checkpoint = index - (index % CHECKPOINT_INTERVAL)
+        scanner = self._context.scanner
+        self._context.restore(self._checkpoints[checkpoint])
+        scanner.seek(self._offsets[checkpoint])
+        for i in range(checkpoint, index):
+            scanner.scan_element(self._op, i)
+
+    def _locate(self, index: int) -> Tuple[int,dict]:
+        offsets = self._offsets
+        scanner = self._context.scanner
+        i = len(offsets) - 1
+        self._rewind(min(index, i))
+        while i < index:
+            scanner.scan_element(self._op, i)
+            i += 1
+            offsets.append(scanner.input_offset)
+            if (i % CHECKPOINT_INTERVAL) == 0:
+                self._checkpoints[i] = self._context.namespace.copy()
+        return offsets[index], self._context.namespace.copy()
+
+    def to_list(self) -> List[Any]:
+        """Decodes the whole array."""
+        return [materialize(v) for v in self]
+
+    def __repr__(self) -> str:
+        return "<ArrayView {:s} (count == {:d}) at 0x{:x}>".format(self._op.name, self._count, self._offset)
+
+
+def materialize(value: Any) -> Any:
+    """
+    Decodes the whole view (recursively), returning plain Python values; other values are returned as they are.
+    """
+    if isinstance(value, StructView):
+        return value.to_dict()
+    if isinstance(value, ArrayView):
+        return value.to_list()
+    return value
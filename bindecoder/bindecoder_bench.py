@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO,Callable
+
+from . import bindecoder as BD
+from . import bindecoder_api as BAPI
+from . import bindecoder_fields as BF
+from . import bindecoder_input as BI
+
+try:
+    import resource
+except ImportError:         # not available on Windows; peak RSS is not reported then
+    resource = None
+
+MIN_PYTHON = (3,7)
+assert sys.version_info >= MIN_PYTHON, f"requires Python {'.'.join([str(n) for n in MIN_PYTHON])} or newer"
+
+# Benchmark of the decoder: synthetic data files of the same shapes as the ones from generate_test_bin_files.py, but with any
+# number of records, are decoded and presented as text; the results are reported as json and may be compared with saved ones.
+# Usage:
+#     python3 -m bindecoder.bindecoder_bench --records 1000000 --output baseline.json
+#     python3 -m bindecoder.bindecoder_bench --records 1000000 --baseline baseline.json      # exit status 1 on regression
+
+RESULTS_VERSION = 1
+MIN_RECORDS = 10**3
+MAX_RECORDS = 10**8
+DEFAULT_RECORDS = 10**5
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 10.0        # percent of records/s below the baseline still not considered a regression
+GENERATE_CHUNK_RECORDS = 64*1024
+RANDOM_SEED = 1666470973        # the same data files for the same number of records
+BASE_TIMESTAMP = 1666470973
+
+# The shapes of test structures (test_structures_format.json), with 32-bit counts allowing any number of records
+BENCH_FORMAT = \
+    {
+        "DEFAULTS": {"default_endian":"little"},
+
+        "TYPEDEFS":
+        {
+            "bench_points":
+            {
+                "fields":
+                {
+                    "eyecatcher":    {"base":"char", "size":10},
+                    "num_of_points": {"base":"uint", "size":4, "format":"{:d}"},
+                    "points":
+                    {
+                        "count":"num_of_points",
+                        "fields":
+                        {
+                            "x": {"base":"uint", "size":2, "format":"0x{:04x}"},
+                            "y": {"base":"uint", "size":2, "format":"0x{:04x}"}
+                        }
+                    },
+                    "footer": {"base":"char", "size":6}
+                }
+            },
+
+            "bench_lists":
+            {
+                "fields":
+                {
+                    "num_of_lists": {"base":"uint", "size":4, "format":"{:d}"},
+                    "lists":
+                    {
+                        "count":"num_of_lists",
+                        "placement":"oneline",
+                        "fields":
+                        {
+                            "length":     {"base":"uint", "size":1, "format":"{:02d}"},
+                            "eyecatcher": {"base":"char", "size":5},
+                            "checksum":   {"base":"uint", "size":2, "format":"0x{:02x}"},
+                            "timestamp":  {"base":"ts", "size":4, "format":"%Y-%m-%d %H:%M:%S"},
+                            "data":       {"base":"uint", "size":1, "count":"length", "wrap_at":6, "format":"{:02x}"}
+                        }
+                    },
+                    "footer": {"base":"char", "size":6}
+                }
+            },
+
+            "_bench_varint":
+            {
+                "base":"union",
+                "variants":
+                {
+                    "VINT8":  {"prefetch_size":1, "trigger":"RAW[0]<0xFD", "base":"uint", "size":1, "format":"{:02x}"},
+                    "VINT16": {"prefetch_size":1, "data_offset":1, "trigger":"RAW[0]==0xFD", "base":"uint", "size":2, "format":"{:04x}"},
+                    "VINT32": {"prefetch_size":1, "data_offset":1, "trigger":"RAW[0]==0xFE", "base":"uint", "size":4, "format":"{:08x}"},
+                    "VINT64": {"prefetch_size":1, "data_offset":1, "trigger":"RAW[0]==0xFF", "base":"uint", "size":8, "format":"{:016x}"}
+                }
+            },
+
+            "bench_varints":
+            {
+                "fields":
+                {
+                    "num_of_values": {"base":"uint", "size":4, "format":"{:d}"},
+                    "values":        {"base":"_bench_varint", "count":"num_of_values"},
+                    "footer":        {"base":"char", "size":6}
+                }
+            },
+
+            "bench_mixed_endian":
+            {
+                "fields":
+                {
+                    "num_of_records": {"base":"uint", "size":4, "format":"{:d}"},
+                    "records":
+                    {
+                        "count":"num_of_records",
+                        "fields":
+                        {
+                            "uint32_le":  {"base":"uint", "size":4, "format":"{:08x}"},
+                            "uint32_be":  {"base":"uint", "size":4, "endian":"big", "format":"{:08x}"},
+                            "int16_le":   {"base":"int",  "size":2, "format":"{:d}"},
+                            "int16_be":   {"base":"int",  "size":2, "endian":"big", "format":"{:d}"},
+                            "float32_be": {"base":"float","size":4, "endian":"big", "format":"{:g}"},
+                            "float64_le": {"base":"float","size":8, "format":"{:g}"},
+                            "uint64_be":  {"base":"uint", "size":8, "endian":"big", "format":"{:016x}"},
+                            "time32_be":  {"base":"ts",   "size":4, "endian":"big"}
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+
+def _generate_chunked(f: BinaryIO, records: int, make_chunk: Callable[[int,int],bytes]):
+    for first in range(0, records, GENERATE_CHUNK_RECORDS):
+        f.write(make_chunk(first, min(records - first, GENERATE_CHUNK_RECORDS)))
+
+
+def generate_points(f: BinaryIO, records: int, rng: random.Random):
+    f.write(b"EYECATCHER" + struct.pack("<I", records))
+    _generate_chunked(f, records, lambda first, n: rng.randbytes(4 * n))
+    f.write(b"FOOTER")
+
+
+def generate_lists(f: BinaryIO, records: int, rng: random.Random):
+    header = struct.Struct("<B5sHI")
+
+    def make_chunk(first: int, n: int) -> bytes:
+        parts = []
+        for i in range(first, first + n):
+            length = rng.randrange(16)
+            parts.append(header.pack(length, b"LIST%c" % (0x41 + i % 26), rng.randrange(0x10000), BASE_TIMESTAMP + i // 4))
+            parts.append(rng.randbytes(length))
+        return b"".join(parts)
+
+    f.write(struct.pack("<I", records))
+    _generate_chunked(f, records, make_chunk)
+    f.write(b"FOOTER")
+
+
+def generate_varints(f: BinaryIO, records: int, rng: random.Random):
+    # mostly 1-byte values, like in real data (e.g. BTC blockchain)
+    encoders = [lambda: bytes([rng.randrange(0xFD)])] * 13 + \
+               [lambda: b"\xFD" + rng.randbytes(2), lambda: b"\xFE" + rng.randbytes(4), lambda: b"\xFF" + rng.randbytes(8)]
+    f.write(struct.pack("<I", records))
+    _generate_chunked(f, records, lambda first, n: b"".join(encoder() for encoder in rng.choices(encoders, k=n)))
+    f.write(b"FOOTER")
+
+
+def generate_mixed_endian(f: BinaryIO, records: int, rng: random.Random):
+    f.write(struct.pack("<I", records))
+    _generate_chunked(f, records, lambda first, n: rng.randbytes(36 * n))
+
+
+class BenchDataset:
+    """
+    Synthetic data file shape: the root structure (see BENCH_FORMAT), its array of records and the function writing the data.
+    """
+    __slots__ = ("name", "root", "array", "generate")
+
+    def __init__(self, name: str, root: str, array: str, generate: Callable[[BinaryIO,int,random.Random],None]):
+        self.name = name
+        self.root = root
+        self.array = array
+        self.generate = generate
+
+    def file_name(self, work_dir: str, records: int) -> str:
+        return os.path.join(work_dir, "{:s}_{:d}.bin".format(self.name, records))
+
+    def create_file(self, work_dir: str, records: int) -> str:
+        """
+        Returns the name of the data file with given number of records, generating it unless it already exists.
+        """
+        file_name = self.file_name(work_dir, records)
+        if not os.path.exists(file_name):
+            temp_name = file_name + ".tmp"
+            with open(temp_name, "wb") as f:
+                self.generate(f, records, random.Random(RANDOM_SEED + records))
+            os.replace(temp_name, file_name)    # no incomplete files are left for reuse if interrupted
+        return file_name
+
+
+DATASETS = {d.name: d for d in [
+    BenchDataset("points", "bench_points", "points", generate_points),                      # fixed-size records
+    BenchDataset("lists", "bench_lists", "lists", generate_lists),                          # nested lists of various lengths
+    BenchDataset("varints", "bench_varints", "values", generate_varints),                   # unions chosen by triggers
+    BenchDataset("mixed_endian", "bench_mixed_endian", "records", generate_mixed_endian),   # big and little endian numbers
+]}
+
+
+class TimedSink:
+    """
+    Text output stream discarding the data (like /dev/null) and measuring the time spent in writing it, encoding included.
+    """
+
+    def __init__(self):
+        self.file = open(os.devnull, "wb")
+        self.write_time = 0.0
+        self.bytes_written = 0
+
+    def write(self, s: str):
+        start = time.perf_counter()
+        data = s.encode("utf-8")
+        self.file.write(data)
+        self.write_time += time.perf_counter() - start
+        self.bytes_written += len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.file.close()
+
+
+def peak_rss_kb() -> Union[int,None]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (peak // 1024) if (sys.platform == "darwin") else peak      # bytes on macOS, kilobytes elsewhere
+
+
+def run_case(dataset_name: str, file_name: str, records: int, repeat: int) -> Dict[str,Any]:
+    """
+    Decodes given data file and returns the results; meant to run in a separate process, so that the peak RSS is the one
+    of this case only. Phases (seconds; decoding phases: the best of repeat runs):
+    - schema_build:   creating field definitions from the configuration and the format,
+    - plan:           compiling the decode plan,
+    - decode:         decoding the records into values only (BAPI.iter_records()),
+    - format:         presenting them as text (the time of a complete text run less decode and write),
+    - write:          writing the text (to /dev/null).
+    Records/s and MB/s are calculated for the complete text run (like in the main program).
+    """
+    dataset = DATASETS[dataset_name]
+    phases = {}
+
+    start = time.perf_counter()
+    root_struct = BAPI.load_format(BENCH_FORMAT, dataset.root)
+    phases["schema_build"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    BD.BindecoderCore.compile_plan(root_struct)
+    phases["plan"] = time.perf_counter() - start
+
+    decode_time = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decoded = sum(1 for _ in BAPI.iter_records(file_name, root_struct, dataset.array, record_type=BAPI.RECORD_TUPLE))
+        elapsed = time.perf_counter() - start
+        decode_time = elapsed if (decode_time is None) else min(decode_time, elapsed)
+    if decoded != records:
+        raise BI.InputDataErrorException("{:d} records decoded from \"{:s}\"; expected: {:d}".format(decoded, file_name, records))
+
+    text_time = None
+    for _ in range(repeat):
+        sink = TimedSink()
+        try:
+            with open(file_name, "rb") as f, BI.open_input(f) as input_source:
+                start = time.perf_counter()
+                BD.BindecoderCore().process(input_stream=input_source, output_stream=sink, dataset=root_struct)
+                elapsed = time.perf_counter() - start
+        finally:
+            sink.close()
+        if (text_time is None) or (elapsed < text_time):
+            text_time, write_time, text_size = elapsed, sink.write_time, sink.bytes_written
+
+    phases["decode"] = decode_time
+    phases["format"] = max(0.0, text_time - decode_time - write_time)
+    phases["write"] = write_time
+
+    input_size = os.path.getsize(file_name)
+    return {
+        "dataset": dataset_name,
+        "records": records,
+        "input_bytes": input_size,
+        "output_bytes": text_size,
+        "seconds": round(text_time, 6),
+        "records_per_s": round(records / text_time, 1),
+        "mb_per_s": round(input_size / 1e6 / text_time, 3),
+        "peak_rss_kb": peak_rss_kb(),
+        "phases": {name: round(seconds, 6) for name, seconds in phases.items()},
+    }
+
+
+def run_benchmark(dataset_names: List[str], record_counts: List[int], work_dir: str, repeat: int = DEFAULT_REPEAT,
+                  log: TextIO = sys.stderr) -> Dict[str,Any]:
+    """
+    Generates the data files (unless they exist in work_dir) and runs the cases one by one, each in a new process.
+    """
+    results = []
+    context = multiprocessing.get_context("spawn")      # a fresh process: no definitions, memory or caches left by other cases
+    for records in record_counts:
+        for name in dataset_names:
+            log.write("{:s} ({:d} records): generating...".format(name, records))
+            log.flush()
+            file_name = DATASETS[name].create_file(work_dir, records)
+            log.write(" decoding...")
+            log.flush()
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_case, name, file_name, records, repeat).result()
+            log.write(" {:.0f} records/s, {:.2f} MB/s\n".format(result["records_per_s"], result["mb_per_s"]))
+            results.append(result)
+    return {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": BF.numpy is not None,
+        "results": results,
+    }
+
+
+def compare_results(report: Dict[str,Any], baseline: Dict[str,Any], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Adds the baseline records/s and the change (in percent) to the results of the cases present in the baseline too, and returns
+    the descriptions of regressions: the cases slower than the baseline by more than tolerance percent.
+    """
+    if baseline.get("version") != RESULTS_VERSION:
+        raise BI.InputDataErrorException("Unsupported version of benchmark results: {!s}".format(baseline.get("version")))
+    baseline_results = {(r["dataset"], r["records"]): r for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        base = baseline_results.get((result["dataset"], result["records"]))
+        if base is None:
+            continue
+        change = (result["records_per_s"] / base["records_per_s"] - 1.0) * 100.0
+        result["baseline_records_per_s"] = base["records_per_s"]
+        result["change_pct"] = round(change, 1)
+        if change < -tolerance:
+            regressions.append("{:s} ({:d} records): {:.0f} records/s; baseline: {:.0f} records/s ({:+.1f}%)".format(
+                result["dataset"], result["records"], result["records_per_s"], base["records_per_s"], change))
+    report["regressions"] = regressions
+    return regressions
+
+
+def true_main() -> int:
+    parser = argparse.ArgumentParser(
+                        prog=os.path.basename(__file__),
+                        description="Benchmarks the decoder with synthetic data files of given numbers of records; "
+                                    "reports the results as json")
+
+    parser.add_argument("--datasets", nargs="+", choices=list(DATASETS), default=list(DATASETS),
+                        help="data file shapes to benchmark; default: all")
+    parser.add_argument("--records", "-n", nargs="+", type=BD.range_checker(MIN_RECORDS, MAX_RECORDS), default=[DEFAULT_RECORDS],
+                        help="numbers of records in data files; default: {:d}".format(DEFAULT_RECORDS))
+    parser.add_argument("--repeat", type=BD.range_checker(1, 100), default=DEFAULT_REPEAT,
+                        help="decode each file that many times and report the best times; default: {:d}".format(DEFAULT_REPEAT))
+    parser.add_argument("--work-dir", default=None,
+                        help="directory for data files, kept and reused by next runs; default: a temporary directory")
+    parser.add_argument("--output", "-o", metavar="FILE", default=None,
+                        help="json file for the results (it may serve as a baseline later); default: the standard output")
+    parser.add_argument("--baseline", metavar="FILE", default=None,
+                        help="json file with saved results to compare with; exit status is 1 if any case is slower by more "
+                             "than the tolerance")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="percent of records/s below the baseline still accepted; default: {:.0f}".format(DEFAULT_TOLERANCE))
+
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    work_dir = args.work_dir if (args.work_dir is not None) else tempfile.mkdtemp(prefix="bindecoder_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        report = run_benchmark(args.datasets, args.records, work_dir, args.repeat)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = compare_results(report, baseline, args.tolerance) if (baseline is not None) else []
+
+    text = json.dumps(report, indent=2) + "\n"
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+    for regression in regressions:
+        sys.stderr.write("REGRESSION: {:s}\n".format(regression))
+    return 1 if regressions else 0
+
+
+def main():
+    try:
+        sys.exit(true_main())
+    except BI.InputDataErrorException as e:
+        sys.stderr.write("{}: {}\n".format(type(e), str(e)))
+        sys.exit(1)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO
+
+CACHE_FORMAT_VERSION = 1
+CACHE_FILE_EXTENSION = ".pickle"
+
+# modules defining the classes of cached objects, and the main program building them (applying default values, assembling the root
+# structure, marking stored fields); a change in any of them invalidates the cache
+_DEFINITION_MODULES = ("bindecoder.py", "bindecoder_fields.py", "bindecoder_expr.py")
+
+
+def default_cache_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "bindecoder")
+
+
+def _program_fingerprint() -> bytes:
+    digest = hashlib.sha256()
+    program_path = os.path.dirname(os.path.abspath(__file__))
+    for module_name in _DEFINITION_MODULES:
+        with open(os.path.join(program_path, module_name), "rb") as f:
+            digest.update(f.read())
+    return digest.digest()
+
+
+class FormatCache:
+    """
+    Persistent cache of field definitions built from configuration and format files (see create_root_structure() in bindecoder.py).
+    Entries are pickled objects stored in separate files named after the key: a content hash of everything the definitions
+    depend on. Thus stale entries are never used; they are simply not found. Any problem with the cache (unreadable, corrupted
+    or incompatible entry, read-only directory) is silently ignored: the definitions are built from scratch then.
+    """
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir if (cache_dir is not None) else default_cache_dir()
+
+    @staticmethod
+    def make_key(*parts: Union[str,bytes]) -> str:
+        """
+        Creates a cache key from given parts (texts of configuration and format files, selected options etc.).
+        Program sources, Python version and machine byte order (the "system" endian) are taken into account too.
+        """
+        digest = hashlib.sha256()
+        digest.update("{:d}|{!s}|{:s}|".format(CACHE_FORMAT_VERSION, sys.version_info[:2], sys.byteorder).encode())
+        digest.update(_program_fingerprint())
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode("utf-8", errors="surrogatepass")
+            digest.update(len(part).to_bytes(8, "little"))      # length prefix keeps ("ab","c") and ("a","bc") apart
+            digest.update(part)
+        return digest.hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + CACHE_FILE_EXTENSION)
+
+    def load(self, key: str) -> Any:
+        """
+        Returns cached object or None if not found or not usable.
+        """
+        try:
+            with open(self.entry_path(key), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:           # corrupted or incompatible entry; it will be overwritten
+            return None
+
+    def store(self, key: str, value: Any) -> bool:
+        """
+        Stores the object in the cache; returns False if it was not possible.
+        """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, self.entry_path(key))     # atomic; concurrent runs never see partially written entries
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except (OSError, pickle.PicklingError, RecursionError, TypeError, AttributeError):
+            return False
+        return True
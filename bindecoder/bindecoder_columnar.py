@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import csv
+import json
+import os
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO,Callable,Optional
+
+from . import bindecoder_fields as BF
+from . import bindecoder_input as BI
+from . import bindecoder_plan as BP
+from . import bindecoder_values as BV
+from .bindecoder_input import InputDataErrorException
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:         # pyarrow is optional; without it only CSV export is available
+    pyarrow = None
+
+EXPORT_BATCH_SIZE = 64*1024     # number of rows collected before they are written as a single record batch (row group)
+
+FORMAT_PARQUET = "parquet"
+FORMAT_ARROW = "arrow"
+FORMAT_CSV = "csv"
+
+_FORMATS_BY_EXTENSION = {".parquet":FORMAT_PARQUET, ".pq":FORMAT_PARQUET, ".arrow":FORMAT_ARROW, ".feather":FORMAT_ARROW,
+                         ".ipc":FORMAT_ARROW, ".csv":FORMAT_CSV}
+
+
+def format_from_file_name(file_name: str) -> str:
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension not in _FORMATS_BY_EXTENSION:
+        raise InputDataErrorException("Unknown export file format \"{:s}\"; known extensions: {:s}"
+                                      .format(extension, ", ".join(_FORMATS_BY_EXTENSION)))
+    return _FORMATS_BY_EXTENSION[extension]
+
+
+class Column:
+    """
+    A single column of exported table: a leaf field of the exported structure (nested structures are flattened, with dotted names).
+    """
+    KIND_VALUE = 0          # single non-structural value
+    KIND_LIST = 1           # an array of non-structural values
+    KIND_JSON = 2           # anything else (unions, arrays of structures); exported as JSON text
+
+    __slots__ = ("name", "path", "field", "kind")
+
+    def __init__(self, name: str, path: Tuple[str,...], field: BF.FieldDef, kind: int):
+        self.name = name
+        self.path = path        # keys leading to the value in the structure decoded by BV.ValueDecoder
+        self.field = field
+        self.kind = kind
+
+    def get(self, row: Dict[str,Any]) -> Any:
+        for key in self.path:
+            row = row[key]
+        return row
+
+
+def create_columns(block: BP.DecodeBlock, prefix: Tuple[str,...] = ()) -> List[Column]:
+    columns = []
+    for op in block.ops:
+        ops = op.members if (op.opcode == BP.OP_VALUE_RUN) else [op]
+        for op in ops:
+            path = prefix + (op.name,)
+            if op.opcode == BP.OP_SKIP:
+                continue
+            if op.opcode == BP.OP_VALUE:
+                columns.append(Column(".".join(path), path, op.field, Column.KIND_VALUE))
+            elif op.opcode == BP.OP_ARRAY:
+                columns.append(Column(".".join(path), path, op.field, Column.KIND_LIST))
+            elif (op.opcode == BP.OP_STRUCT) and (op.static_count == 1):
+                columns.extend(create_columns(op.block, path))
+            else:
+                columns.append(Column(".".join(path), path, op.field, Column.KIND_JSON))
+    return columns
+
+
+def arrow_type(field: BF.FieldDef):
+    """
+    Returns pyarrow type for values of given non-structural field.
+    """
+    if isinstance(field, BF.TimestampTypeFieldDef):
+        return pyarrow.timestamp("us", tz="UTC")
+    if isinstance(field, BF.SignedIntegerFieldDef):
+        return {1:pyarrow.int8(), 2:pyarrow.int16(), 4:pyarrow.int32()}.get(field.size, pyarrow.int64())
+    if isinstance(field, BF.UnsignedIntegerFieldDef):
+        return {1:pyarrow.uint8(), 2:pyarrow.uint16(), 4:pyarrow.uint32()}.get(field.size, pyarrow.uint64())
+    if isinstance(field, BF.FloatFieldDef):
+        return pyarrow.float32() if (field.size == 4) else pyarrow.float64()
+    return pyarrow.string()
+
+
+def is_exportable_as_arrow_integer(field: BF.FieldDef) -> bool:
+    return (not isinstance(field, BF.IntegerTypeFieldDef)) or (field.size <= 8)
+
+
+class _ArrowTableWriter:
+
+    def __init__(self, file_name: str, file_format: str, columns: List[Column]):
+        arrow_fields = []
+        self.converters = []
+        for c in columns:
+            if (c.kind == Column.KIND_JSON) or (not is_exportable_as_arrow_integer(c.field)):
+                arrow_fields.append(pyarrow.field(c.name, pyarrow.string()))
+                self.converters.append(_to_json)
+                continue
+            value_type = arrow_type(c.field)
+            to_value = _to_microseconds if isinstance(c.field, BF.TimestampTypeFieldDef) else None
+            if c.kind == Column.KIND_LIST:
+                arrow_fields.append(pyarrow.field(c.name, pyarrow.list_(value_type)))
+                self.converters.append((lambda values, to_value=to_value: [to_value(v) for v in values]) if to_value else None)
+            else:
+                arrow_fields.append(pyarrow.field(c.name, value_type))
+                self.converters.append(to_value)
+        self.schema = pyarrow.schema(arrow_fields)
+        if file_format == FORMAT_PARQUET:
+            self.writer = pyarrow.parquet.ParquetWriter(file_name, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(file_name, self.schema)
+
+    def write_batch(self, columns_data: List[List[Any]]):
+        arrays = []
+        for data, converter, arrow_field in zip(columns_data, self.converters, self.schema):
+            if converter is not None:
+                data = [converter(v) for v in data]
+            arrays.append(pyarrow.array(data, type=arrow_field.type))
+        self.writer.write_batch(pyarrow.record_batch(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class _CsvTableWriter:
+
+    def __init__(self, file_name: str, columns: List[Column]):
+        self.file = open(file_name, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([c.name for c in columns])
+        self.converters = []
+        for c in columns:
+            if c.kind != Column.KIND_VALUE:
+                self.converters.append(_to_json)
+            elif isinstance(c.field, BF.TimestampTypeFieldDef):
+                self.converters.append(lambda seconds, field=c.field: field.to_datetime(seconds).isoformat())
+            else:
+                self.converters.append(None)
+
+    def write_batch(self, columns_data: List[List[Any]]):
+        converted = [data if (converter is None) else [converter(v) for v in data]
+                     for data, converter in zip(columns_data, self.converters)]
+        self.writer.writerows(zip(*converted))
+
+    def close(self):
+        self.file.close()
+
+
+def _to_microseconds(seconds: float) -> int:
+    return round(seconds * 1000000)
+
+
+def _to_json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",",":"), default=BV.json_default)
+
+
+class ColumnarExporter:
+    """
+    Exports elements of an array of structures (by default the first one at the top level of the root structure) as a table:
+    one row per element, one column per leaf field. Parquet and Arrow IPC files require pyarrow; CSV is always available.
+    Rows are decoded with BV.ValueDecoder and written in batches of EXPORT_BATCH_SIZE rows, so the memory usage does not depend
+    on the number of elements. Other top-level fields are decoded (they may be referred to by the exported ones) but not exported.
+    """
+
+    def __init__(self, file_name: str, field_name: str = None, file_format: str = None, batch_size: int = EXPORT_BATCH_SIZE):
+        self.file_name = file_name
+        self.field_name = field_name
+        self.file_format = file_format if (file_format is not None) else format_from_file_name(file_name)
+        self.batch_size = batch_size
+        self.num_of_rows = 0
+        self.decoder = None                 # BV.ValueDecoder of the current process() call
+        if (self.file_format != FORMAT_CSV) and (pyarrow is None):
+            raise InputDataErrorException("Export to {:s} requires pyarrow package which is not installed; "
+                                          "install it or export to CSV file instead".format(self.file_format))
+
+    def select_op(self, plan: BP.DecodePlan) -> BP.DecodeOp:
+        for op in plan.root.ops:
+            if op.opcode != BP.OP_STRUCT:
+                continue
+            if self.field_name is not None:
+                if op.name == self.field_name:
+                    return op
+            elif (op.static_count is None) or (op.static_count > 1):
+                return op
+        if self.field_name is not None:
+            raise InputDataErrorException("Exported field \"{:s}\" is not a top-level structure field".format(self.field_name))
+        raise InputDataErrorException("There is no top-level array of structures to export")
+
+    def process(self, input_stream: Union[BinaryIO,BI.InputSource], plan: BP.DecodePlan):
+        op = self.select_op(plan)
+        block = op.element_block if (op.element_block is not None) else op.block
+        columns = create_columns(block)
+        if self.file_format == FORMAT_CSV:
+            writer = _CsvTableWriter(self.file_name, columns)
+        else:
+            writer = _ArrowTableWriter(self.file_name, self.file_format, columns)
+
+        decoder = BV.ValueDecoder(input_stream)
+        self.decoder = decoder
+        columns_data = [[] for c in columns]
+        self.num_of_rows = 0
+        try:
+            with BF.NamespaceScope():
+                for record in decoder.iter_records(plan.root):
+                    if record.name != op.name:
+                        continue
+                    for c, data in zip(columns, columns_data):
+                        data.append(c.get(record.value))
+                    if len(columns_data[0]) >= self.batch_size:
+                        writer.write_batch(columns_data)
+                        self.num_of_rows += len(columns_data[0])
+                        columns_data = [[] for c in columns]
+        finally:
+            if (len(columns) > 0) and (len(columns_data[0]) > 0):     # also the rows decoded before an error was detected
+                writer.write_batch(columns_data)
+                self.num_of_rows += len(columns_data[0])
+            writer.close()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import ast
+import builtins
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO,Callable
+
+
+NAMESPACE_ARG = "_namespace_"   # the argument name of lowered expression functions
+
+# Expression tree nodes allowed in lowered expressions: names, constants, subscripts and operators.
+# Anything else (calls, comprehensions, attributes etc.) is evaluated with eval().
+_LOWERABLE_NODES = (ast.Expression, ast.Name, ast.Load, ast.Constant, ast.Subscript, ast.Slice, ast.Tuple,
+                    ast.UnaryOp, ast.unaryop, ast.BinOp, ast.operator, ast.BoolOp, ast.boolop, ast.Compare, ast.cmpop, ast.IfExp)
+
+_BUILTIN_NAMES = frozenset(dir(builtins))     # eval() falls back to builtins for names missing in the namespace; lowered code does not
+
+
+def is_lowerable(tree: ast.Expression) -> bool:
+    for node in ast.walk(tree):
+        if not isinstance(node, _LOWERABLE_NODES):
+            return False
+        if isinstance(node, ast.Name) and ((node.id in _BUILTIN_NAMES) or (node.id == NAMESPACE_ARG)):
+            return False
+    return True
+
+
+class _NameLowering(ast.NodeTransformer):
+    """
+    Replaces all name references with direct namespace lookups: name -> _namespace_["name"]
+    """
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        lookup = ast.Subscript(value=ast.Name(id=NAMESPACE_ARG, ctx=ast.Load()), slice=ast.Constant(value=node.id), ctx=ast.Load())
+        return ast.copy_location(lookup, node)
+
+
+def _raise_name_error(e: KeyError, names: frozenset):
+    if (len(e.args) == 1) and (e.args[0] in names):         # report missing value like eval() does
+        raise NameError("name '{!s}' is not defined".format(e.args[0]), name=e.args[0]) from None
+    raise e
+
+
+_LOWERED_FUNCTION_TEMPLATE = """
+def evaluate({0:s}):
+    try:
+        return None
+    except KeyError as e:
+        _raise_name_error_(e, _names_)
+""".format(NAMESPACE_ARG)
+
+
+def lower(tree: ast.Expression, filename: str, names: frozenset) -> Callable:
+    """
+    Translates an expression tree into a function taking the namespace as the only argument, i.e.: "count*2" into
+    def evaluate(_namespace_): return _namespace_["count"]*2
+    Calling such a function is much cheaper than eval(): no name resolution chain (locals, globals, builtins) is involved.
+    """
+    function = ast.parse(_LOWERED_FUNCTION_TEMPLATE, filename=filename, mode="exec")
+    function.body[0].body[0].body[0].value = _NameLowering().visit(tree).body      # replace "return None" value
+    ast.fix_missing_locations(function)
+    env = {"__builtins__": {}, "_raise_name_error_": _raise_name_error, "_names_": names}
+    exec(compile(function, filename, "exec"), env)
+    return env["evaluate"]
+
+
+class Expression:
+    """
+    Python expression (count, length or union variant trigger) given as a string in format file and evaluated in the namespace
+    of decoded values. It is parsed once, and common expressions (names, constants, subscripts like RAW[0] and operators on them)
+    are translated into plain Python functions with direct namespace lookups; other expressions are evaluated with eval().
+    Use evaluate(namespace) in performance critical code; the object itself is also callable.
+    """
+
+    def __init__(self, source: str, filename: str = "<expression>"):
+        self.source = source
+        self.filename = filename
+        tree = ast.parse(source, filename=filename, mode="eval")     # raises SyntaxError
+        self.code = compile(tree, filename, "eval")
+        self.names = frozenset(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))    # all the names referenced
+        self.is_lowered = is_lowerable(tree)
+        if self.is_lowered:
+            self.evaluate = lower(tree, filename, self.names)
+        else:
+            code = self.code
+            self.evaluate = lambda namespace: eval(code, {}, namespace)
+
+    def depends_only_on_item(self, name: str, index: int) -> bool:
+        """
+        Checks whether the expression refers to nothing but given item of given container (like RAW[0]); constant expressions too.
+        """
+        tree = ast.parse(self.source, filename=self.filename, mode="eval")
+        item_containers = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and (node.value.id == name) and \
+               isinstance(node.slice, ast.Constant) and (type(node.slice.value) is int) and (node.slice.value == index):
+                item_containers.add(node.value)
+        return all((node in item_containers) for node in ast.walk(tree) if isinstance(node, ast.Name))
+
+    def __call__(self, namespace: dict):
+        return self.evaluate(namespace)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Expression) and (self.source == other.source)
+
+    def __hash__(self) -> int:
+        return hash(self.source)
+
+    def __repr__(self) -> str:
+        return "Expression({!r})".format(self.source)
+
+    def __getstate__(self):
+        return (self.source, self.filename)     # functions created at runtime cannot be pickled; they are recreated from the source
+
+    def __setstate__(self, state):
+        self.__init__(*state)
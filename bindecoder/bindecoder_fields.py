@@ -3,14 +3,25 @@
 ############################################################################################################################################
 
 import abc
+import contextvars
 import copy
 import datetime
 import enum
+import functools
 import re
 import struct
 import sys
+import threading
 
-from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO,Iterator,Callable
+
+from . import bindecoder_expr as BE
+from . import bindecoder_input as BI
+
+try:
+    import numpy
+except ImportError:         # numpy is optional; without it arrays of numeric values are unpacked with struct module
+    numpy = None
 
 
 class FieldDefinitionException(ValueError):
@@ -24,38 +35,114 @@ class DefaultValueException(ValueError):
 def raise_field_def_exception(struct_name: str, field_name: str, info: str):
     raise FieldDefinitionException("structure: \"{!s}\", field: \"{!s}\": ".format(struct_name,field_name) + info)
 
+
+def peek_data(input_stream: Union[BinaryIO,BI.InputSource], size: int) -> bytes:
+    """
+    Returns up to size bytes from input stream or input source without moving its position.
+    """
+    if (type(input_stream) is BI.MappedInput) or isinstance(input_stream, BI.InputSource):    # the first check is much cheaper
+        return input_stream.peek(size)
+    data = input_stream.read(size)
+    input_stream.seek(-len(data), 1)
+    return data
+
+# The namespace of decoded values: unsigned integers (referred to by count, length and trigger expressions, see mark_stored_fields())
+# stored by name when decoded, and the data prefetched for union variant triggers. Each decoding session may use its own one
+# (see NamespaceScope); outside of any scope the common default one is used.
+_default_namespace = {}
+_current_namespace = contextvars.ContextVar("bindecoder_namespace", default=_default_namespace)
+
+
+class NamespaceScope:
+    """
+    Makes given namespace (a new, empty one by default) the current namespace of decoded values (see FieldDef.namespace) until
+    the scope is exited. The scope is limited to the current thread (or asyncio task); scopes may be nested. Decoding sessions
+    running in separate scopes share no values, so they may run concurrently. The same scope object may be entered repeatedly.
+    """
+    __slots__ = ("namespace", "_tokens")
+
+    def __init__(self, namespace: dict = None):
+        self.namespace = {} if (namespace is None) else namespace
+        self._tokens = []
+
+    def __enter__(self) -> dict:
+        self._tokens.append(_current_namespace.set(self.namespace))
+        return self.namespace
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_namespace.reset(self._tokens.pop())
+
+
 class FieldDef: pass    # predefinition to suppress complaints about undefined symbol
 
 
 class FieldDef:
+    """
+    Field definitions keep their attributes in __slots__: they are small, and their attributes are read for every decoded value.
+    Structurally identical non-structural definitions (the same type, name and attributes) are shared, see interned().
+    """
+    __slots__ = ("name", "_count",
+                 "prefetch_size", "data_offset", "total_size", "trigger")   # union variant attributes; see UnionFieldDef.create_variants()
+
     _LEGAL_NAME_REGEX = re.compile(r"[A-Za-z_]\w*")
     _FORBIDDEN_NAMES = {"struct","char","float","fts","int","skip","struct","ts","uint","union","DEFAULTS","TYPEDEFS"}
     _MAX_COUNT = 1024*1024*1024*1024    # == 1TB
     _CONFIG_KEYS = {"base","count"}     # allowed clone construction parameters list (**kwargs argument for clone())
                                         # each subclass may add own keys
 
-    __namespace = {}        # dynamically updated container with some values (unsigned integers for now) decoded from input stream that
-                            # may be used during data processing to determine some key values as count or length of some other fields
-                            # NOTE: this is 100% common class attribute, not meant to be replaced locally by any instance
+    # dynamically updated container with some values (unsigned integers for now) decoded from input stream that may be used during
+    # data processing to determine some key values as count or length of some other fields; common for all the field definitions,
+    # but specific to the current decoding session (see NamespaceScope)
+    namespace = property(lambda self: _current_namespace.get())     # make namespace a read-only attribute
+
+    _interned_fields = {}   # intern_key() -> shared field definition; see interned()
 
-    namespace = property(lambda self: self.__namespace)     # make namespace a read-only attribute
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._ALL_SLOTS = tuple(name for c in reversed(cls.__mro__) for name in c.__dict__.get("__slots__", ()))
 
     def __init__(self, name: str):
         self.name = name            # don't verify the name; __init__() is used internally, with hardcoded names only
         self._count = 1
+        self.prefetch_size = 0
+        self.data_offset = 0
+        self.total_size = None
+        self.trigger = None
+
+    def __copy__(self) -> FieldDef:
+        result = object.__new__(type(self))
+        for name in self._ALL_SLOTS:
+            setattr(result, name, getattr(self, name))
+        return result
 
     def __eq__(self, other) -> bool:
         if type(self) != type(other):
             return False
-        self_vars = vars(self)
-        other_vars = vars(other)
-        if set(self_vars.keys()) != set(other_vars.keys()):
-            return False
-        for k,v in self_vars.items():
-            if other_vars[k] != v:
+        for name in self._ALL_SLOTS:
+            if getattr(other, name) != getattr(self, name):
                 return False
         return True
 
+    def intern_key(self) -> Union[tuple,None]:
+        """
+        Returns a hashable key identifying the definition by its contents, or None if the definition may not be shared
+        (structures and unions have members which identity matters).
+        """
+        return None
+
+    def contents_key(self) -> tuple:
+        return (type(self),) + tuple(_intern_key_item(getattr(self, name)) for name in self._ALL_SLOTS)
+
+    def interned(self) -> FieldDef:
+        """
+        Returns the shared definition equal to this one (registering this one if there is none yet). Shared definitions must not
+        be modified; clone() them instead.
+        """
+        key = self.intern_key()
+        if key is None:
+            return self
+        return self._interned_fields.setdefault(key, self)
+
     def is_structure(self):
         return isinstance(self, StructFieldDef)
 
@@ -66,6 +153,10 @@ class FieldDef:
         """Returns information whether it is just single field with count=1 given explicitly and not calculated dynamically."""
         return  (isinstance(self._count, int)) and (self._count == 1)
 
+    def is_count_static(self):
+        """Returns information whether the count is given explicitly (not calculated dynamically)."""
+        return isinstance(self._count, int)
+
     def clone(self, name: str, parent_name: str, field_def: dict[str,Any]) -> FieldDef:
         """
         name:                   the name of the structure owning given fields list (necessary only for error reporting)
@@ -96,7 +187,7 @@ class FieldDef:
             elif isinstance(count,str):
                 count_spec = count
                 try:
-                    count = compile(count_spec, filename=name, mode="eval")
+                    count = BE.Expression(count_spec, filename=name)
                 except:
                     raise_field_def_exception(parent_name, name, "Cannot compile \"count\" expression: \"{:s}\"".format(count_spec))
             else:
@@ -112,10 +203,24 @@ class FieldDef:
         if isinstance(self._count,int):
             return self._count
         else:
-            return eval(self._count,{},self.__namespace)
+            return self._count.evaluate(_current_namespace.get())
 
     count = property(count_getter)
 
+    def is_stored(self) -> bool:
+        """Returns information whether decoded values of the field are stored in the namespace."""
+        return False
+
+    def referenced_names(self) -> frozenset:
+        """Returns the names of namespace values the field definition refers to (in count expression and alike)."""
+        return self._count.names if isinstance(self._count, BE.Expression) else frozenset()
+
+FieldDef._ALL_SLOTS = FieldDef.__slots__
+
+
+def _intern_key_item(value: Any) -> Any:
+    return ("expression", value.source) if isinstance(value, BE.Expression) else value
+
 
 class NonStructuralTypeFieldDef(FieldDef, abc.ABC):
     """
@@ -125,12 +230,16 @@ class NonStructuralTypeFieldDef(FieldDef, abc.ABC):
 
     _CONFIG_KEYS = {"wrap_at","separator","size"} | FieldDef._CONFIG_KEYS
 
+    __slots__ = ("size", "separator", "wrap_at")
+
     def __init__(self, name: str):
         super().__init__(name)
         self.size = None                                # no default, needs to be set by subclass
         self.separator = self.DEFAULT_SEPARATOR
         self.wrap_at = 0x80000000
 
+    def intern_key(self) -> Union[tuple,None]:
+        return self.contents_key()
 
     def clone(self, name: str, parent_name: str, field_def: dict[str,Any]) -> FieldDef:
         r = super().clone(name, parent_name, field_def)
@@ -170,9 +279,12 @@ class NumericTypeFieldDef(NonStructuralTypeFieldDef):
     Number-based field definition (float,integer,timestamp): non-structural, non-union (but it may be an array).
     """
     DEFAULT_ENDIAN = sys.byteorder
+    STRUCT_CODES = {}               # size -> struct module format character; no entry means the value cannot be unpacked by struct module
 
     _CONFIG_KEYS = {"format","endian"} | NonStructuralTypeFieldDef._CONFIG_KEYS
 
+    __slots__ = ("print_format", "endian")
+
     def __init__(self, name: str):
         super().__init__(name)
         self.print_format = None                # python format string or python date/time formatter depending on data type
@@ -199,25 +311,169 @@ class NumericTypeFieldDef(NonStructuralTypeFieldDef):
 
         return r
 
+    def struct_code(self) -> str:
+        """
+        Returns struct module format character (without byte order prefix) for the field or None if not applicable.
+        """
+        return self.STRUCT_CODES.get(self.size)
+
+    def struct_byteorder(self) -> str:
+        return ">" if (self.endian == "big") else "<"
+
+    def unpack_array(self, raw_data: bytes, count: int) -> List[Union[int,float]]:
+        """
+        Unpacks count subsequent values at once (applicable only if struct_code() is not None). NumPy is used if available.
+        Unlike decode(), it does not store any value in the namespace.
+        """
+        if numpy is not None:
+            return numpy.frombuffer(raw_data, dtype=self.struct_byteorder()+self.struct_code(), count=count).tolist()
+        return list(struct.unpack_from("{:s}{:d}{:s}".format(self.struct_byteorder(), count, self.struct_code()), raw_data))
+
+
+# "{:spec}" templates (with optional literal text around) that may be replaced with equivalent, but cheaper %-formatting
+_PERCENT_FORMAT_REGEX = re.compile(r"([^{}%]*)\{:([+ ]?#?0?[0-9]*)(\.[0-9]+)?([a-zA-Z])\}([^{}%]*)\Z")
+_PERCENT_FORMAT_TYPES = {int: "dxXo", float: "feEgG"}
+
+
+@functools.lru_cache(maxsize=None)
+def create_value_formatter(print_format: str, value_type: type, table_range: range = None) -> Callable[[Any],str]:
+    """
+    Returns a function presenting numeric values of given type according to python format string (print_format.format()
+    equivalent), chosen once for all the values: a lookup table of texts of all the values in table_range (if given; 1-byte
+    fields), str() for plain "{:d}", %-formatting for "{:spec}" templates having it equivalent, print_format.format otherwise.
+    The same function is returned for the same arguments, so field definitions using them remain comparable.
+    """
+    formatter = print_format.format
+    m = _PERCENT_FORMAT_REGEX.match(print_format)
+    if (value_type is int) and (print_format == "{:d}"):
+        formatter = str
+    elif (m is not None) and (m.group(4) in _PERCENT_FORMAT_TYPES[value_type]) and ((m.group(3) is None) or (value_type is float)):
+        formatter = (m.group(1) + "%" + m.group(2) + (m.group(3) or "") + m.group(4) + m.group(5)).__mod__
+
+    if table_range is not None:
+        try:
+            n = len(table_range)            # negative values are at the end of the table, so indexing with them works too
+            table = tuple(formatter(v if (v in table_range) else (v - n)) for v in range(n))
+        except (ValueError, TypeError, IndexError, KeyError):
+            return formatter        # the format does not suit the values; the error is raised when a value is presented
+        formatter = table.__getitem__
+    return formatter
+
 
 class IntegerTypeFieldDef(NumericTypeFieldDef):
 
+    __slots__ = ("formatter",)
+
     DEFAULT_FORMAT = "{:d}"
     DEFAULT_SIZE = 4
+    TABLE_RANGES = {}               # size -> range of values presented with a lookup table of texts
 
     def __init__(self, name: str):
         super().__init__(name)
         self.print_format = self.DEFAULT_FORMAT
         self.size = self.DEFAULT_SIZE
+        self.formatter = create_value_formatter(self.print_format, int, self.TABLE_RANGES.get(self.size))
 
     def clone(self, name: str, parent_name: str, field_def: dict[str,Any]) -> FieldDef:
-        return super().clone(name, parent_name, field_def)
+        r = super().clone(name, parent_name, field_def)
+        r.formatter = create_value_formatter(r.print_format, int, r.TABLE_RANGES.get(r.size))
+        return r
 
 
 def is_tzoffs_valid(v: int):
     return not ((v is not None) and (not isinstance(v,int) or (v<-3600*12) or (v>3600*12) or (v%60!=0)))
 
 
+def split_unix_time(seconds: float) -> Tuple[int,int]:
+    """
+    Splits unix time into whole seconds and microseconds, rounded the way datetime.fromtimestamp() does it (half to even).
+    """
+    whole = int(seconds)
+    if whole == seconds:
+        return whole, 0
+    microsecond = round((seconds - whole) * 1000000)
+    if microsecond >= 1000000:
+        return whole + 1, microsecond - 1000000
+    if microsecond < 0:
+        return whole - 1, microsecond + 1000000
+    return whole, microsecond
+
+
+class TimestampFormatter:
+    """
+    Presents unix timestamps according to strftime() pattern in fixed time zone (tzoffs: offset in seconds) or in local one
+    (tzoffs: None). Formatters are shared by all the fields having the same pattern and time zone (see get()).
+
+    Patterns consisting only of %Y, %m, %d, %H, %M, %S, %f and %% directives are translated into str.format() templates filled
+    with calendar fields calculated with integer arithmetic (as long as the time zone is fixed); others are passed to strftime().
+    Unless the pattern contains %f, texts are cached by whole seconds: consecutive records often share their timestamps.
+    """
+    CACHE_SIZE = 1024
+    EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+    _DIRECTIVE_REGEX = re.compile(r"%(.?)|[^%]+", re.DOTALL)
+    _TEMPLATE_FIELDS = {"Y":"{0:d}", "m":"{1:02d}", "d":"{2:02d}", "H":"{3:02d}", "M":"{4:02d}", "S":"{5:02d}", "f":"{6:06d}"}
+
+    _shared_formatters = {}
+
+    __slots__ = ("pattern", "tzoffs", "tz", "template", "uses_microseconds", "format_seconds")
+
+    @classmethod
+    def get(cls, pattern: str, tzoffs: Union[int,None]) -> "TimestampFormatter":
+        key = (pattern, tzoffs)
+        formatter = cls._shared_formatters.get(key)
+        if formatter is None:
+            formatter = cls._shared_formatters.setdefault(key, cls(pattern, tzoffs))
+        return formatter
+
+    def __init__(self, pattern: str, tzoffs: Union[int,None]):
+        self.pattern = pattern
+        self.tzoffs = tzoffs
+        self.tz = None if (tzoffs is None) else datetime.timezone(datetime.timedelta(seconds=tzoffs))
+        self.template = None if (tzoffs is None) else self._translate_pattern(pattern)
+        self.uses_microseconds = "%f" in pattern.replace("%%", "")
+        self.format_seconds = functools.lru_cache(maxsize=self.CACHE_SIZE)(self._format)
+
+    def __reduce__(self):
+        return (TimestampFormatter.get, (self.pattern, self.tzoffs))
+
+    @classmethod
+    def _translate_pattern(cls, pattern: str) -> Union[str,None]:
+        """Returns str.format() template equivalent to given strftime() pattern, or None if it contains other directives."""
+        parts = []
+        for m in cls._DIRECTIVE_REGEX.finditer(pattern):
+            directive = m.group(1)
+            if directive is None:
+                parts.append(m.group(0).replace("{", "{{").replace("}", "}}"))
+            elif directive == "%":
+                parts.append("%")
+            elif directive in cls._TEMPLATE_FIELDS:
+                parts.append(cls._TEMPLATE_FIELDS[directive])
+            else:
+                return None
+        return "".join(parts)
+
+    def to_datetime(self, seconds: float) -> datetime.datetime:
+        if self.tz is None:
+            return datetime.datetime.fromtimestamp(seconds).astimezone()     # tzinfo properly set to local time zone (incl. DST)
+        return datetime.datetime.fromtimestamp(seconds, self.tz)
+
+    def _format(self, seconds: int, microsecond: int = 0) -> str:
+        if self.template is None:
+            return self.to_datetime(seconds).replace(microsecond=microsecond).strftime(self.pattern)
+        days, seconds = divmod(seconds + self.tzoffs, 86400)
+        date = datetime.date.fromordinal(self.EPOCH_ORDINAL + days)
+        hour, seconds = divmod(seconds, 3600)
+        minute, second = divmod(seconds, 60)
+        return self.template.format(date.year, date.month, date.day, hour, minute, second, microsecond)
+
+    def format(self, seconds: float) -> str:
+        seconds, microsecond = split_unix_time(seconds)
+        if self.uses_microseconds:
+            return self._format(seconds, microsecond)
+        return self.format_seconds(seconds)
+
+
 class TimestampTypeFieldDef(NumericTypeFieldDef):
     """
     Base class for unix timestamps represented by integer value or floating point.
@@ -228,11 +484,14 @@ class TimestampTypeFieldDef(NumericTypeFieldDef):
 
     _CONFIG_KEYS = {"tzoffs"} | NumericTypeFieldDef._CONFIG_KEYS
 
+    __slots__ = ("tzoffs", "formatter")
+
     def __init__(self, name):
         super().__init__(name)
         self.tzoffs = self.DEFAULT_TZOFFS
         self.print_format = self.DEFAULT_FORMAT
         self.size = self.DEFAULT_SIZE
+        self.formatter = TimestampFormatter.get(self.print_format, self.tzoffs)    # shared; compared by identity
 
     def clone(self, name: str, parent_name: str, field_def: dict[str,Any]) -> FieldDef:
         r = super().clone(name, parent_name, field_def)
@@ -247,30 +506,69 @@ class TimestampTypeFieldDef(NumericTypeFieldDef):
             raise_field_def_exception(parent_name, name,
                 "invalid value of \"size\" parameter: {!s}; at least 4 bytes required for unix timestamp".format(r.size))
 
+        r.formatter = TimestampFormatter.get(r.print_format, r.tzoffs)
         return r
 
+    def to_datetime(self, seconds: float) -> datetime.datetime:
+        return self.formatter.to_datetime(seconds)
+
+    def decode_datetime(self, raw_bytes: bytes) -> datetime.datetime:
+        return self.to_datetime(self.decode(raw_bytes))
+
+    def format_value(self, seconds: float) -> str:
+        return self.formatter.format(seconds)
+
     def format_unix_time(self, dest_stream: TextIO, seconds: float):
-        dt = datetime.datetime.fromtimestamp(seconds).astimezone()      # local timestamp with tzinfo properly set to local timezone
-        if self.tzoffs is not None:
-            dt = dt.astimezone(datetime.timezone(datetime.timedelta(seconds=self.tzoffs)))          # move to specified time zone
-        dest_stream.write(dt.strftime(self.print_format))
+        dest_stream.write(self.formatter.format(seconds))
 
 # ============================================================================================
 # Concrete (non-abstract) field classes:
 
 class SignedIntegerFieldDef(IntegerTypeFieldDef):
 
+    __slots__ = ()
+
+    STRUCT_CODES = {1:"b", 2:"h", 4:"i", 8:"q"}
+    TABLE_RANGES = {1:range(-128, 128)}
+
+    def decode(self, raw_bytes: bytes) -> int:
+        return int.from_bytes(raw_bytes, byteorder=self.endian, signed=True)
+
+    def format_value(self, value: int) -> str:
+        return self.formatter(value)
+
     def format_data(self, dest_stream: TextIO, raw_bytes: bytes):
-        value = int.from_bytes(raw_bytes, byteorder=self.endian, signed=True)
-        dest_stream.write(self.print_format.format(value))
+        dest_stream.write(self.formatter(self.decode(raw_bytes)))
 
 
 class UnsignedIntegerFieldDef(IntegerTypeFieldDef):
 
-    def format_data(self, dest_stream: TextIO, raw_bytes: bytes):
+    __slots__ = ("stored",)
+
+    STRUCT_CODES = {1:"B", 2:"H", 4:"I", 8:"Q"}
+    TABLE_RANGES = {1:range(256)}
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.stored = True          # put values into the namespace allowing future references; only referenced ones once analyzed
+
+    def is_stored(self) -> bool:
+        return self.stored
+
+    def store_value(self, value: int):
+        _current_namespace.get()[self.name] = value
+
+    def decode(self, raw_bytes: bytes) -> int:
         value = int.from_bytes(raw_bytes, byteorder=self.endian, signed=False)
-        self.namespace[self.name] = value               # put all unsigned integer values into common namespace allowing future references
-        dest_stream.write(self.print_format.format(value))
+        if self.stored:
+            _current_namespace.get()[self.name] = value
+        return value
+
+    def format_value(self, value: int) -> str:
+        return self.formatter(value)
+
+    def format_data(self, dest_stream: TextIO, raw_bytes: bytes):
+        dest_stream.write(self.formatter(self.decode(raw_bytes)))
 
 
 class IntegerTimestampFieldDef(TimestampTypeFieldDef):
@@ -280,6 +578,8 @@ class IntegerTimestampFieldDef(TimestampTypeFieldDef):
     DEFAULT_SIZE = 4
     _CONFIG_KEYS = {"multiplier"} | TimestampTypeFieldDef._CONFIG_KEYS
 
+    __slots__ = ("multiplier",)
+
     def __init__(self, name):
         super().__init__(name)
         self.multiplier = 1
@@ -296,9 +596,12 @@ class IntegerTimestampFieldDef(TimestampTypeFieldDef):
 
         return r
 
+    def decode(self, raw_bytes: bytes) -> float:
+        """Returns unix time in seconds."""
+        return int.from_bytes(raw_bytes, byteorder=self.endian, signed=False) / self.multiplier
+
     def format_data(self, dest_stream: TextIO, raw_bytes: bytes):
-        value = int.from_bytes(raw_bytes, byteorder=self.endian, signed=False)
-        self.format_unix_time(dest_stream, value/self.multiplier)
+        self.format_unix_time(dest_stream, self.decode(raw_bytes))
 
 
 class FloatTimestampFieldDef(TimestampTypeFieldDef):
@@ -307,6 +610,8 @@ class FloatTimestampFieldDef(TimestampTypeFieldDef):
     """
     DEFAULT_SIZE = 8    # NOTE: fixed value; only IEEE-754 double may be used
 
+    __slots__ = ()
+
     def __init__(self, name):
         super().__init__(name)
 
@@ -319,10 +624,13 @@ class FloatTimestampFieldDef(TimestampTypeFieldDef):
 
         return r
 
-    def format_data(self, dest_stream: TextIO, raw_bytes: bytes):
+    def decode(self, raw_bytes: bytes) -> float:
+        """Returns unix time in seconds."""
         spec = ">d" if (self.endian == "big") else "<d"
-        seconds = struct.unpack(spec, raw_bytes)[0]
-        self.format_unix_time(dest_stream, seconds)
+        return struct.unpack(spec, raw_bytes)[0]
+
+    def format_data(self, dest_stream: TextIO, raw_bytes: bytes):
+        self.format_unix_time(dest_stream, self.decode(raw_bytes))
 
 
 class FloatFieldDef(NumericTypeFieldDef):
@@ -331,11 +639,15 @@ class FloatFieldDef(NumericTypeFieldDef):
     """
     DEFAULT_FORMAT = "{:f}"
     DEFAULT_SIZE = 4
+    STRUCT_CODES = {4:"f", 8:"d"}
+
+    __slots__ = ("formatter",)
 
     def __init__(self, name):
         super().__init__(name)
         self.size = self.DEFAULT_SIZE
         self.print_format = self.DEFAULT_FORMAT
+        self.formatter = create_value_formatter(self.print_format, float)
 
     def clone(self, name: str, parent_name: str, field_def: dict[str,Any]) -> FieldDef:
         r = super().clone(name, parent_name, field_def)
@@ -344,13 +656,19 @@ class FloatFieldDef(NumericTypeFieldDef):
             raise_field_def_exception(parent_name, name,
                 "invalid value of \"size\" parameter: {!s}; only 4 and 8 values allowed for IEEE-754 float".format(r.size))
 
+        r.formatter = create_value_formatter(r.print_format, float)
         return r
 
-    def format_data(self, dest_stream: TextIO, raw_bytes: bytes):
+    def decode(self, raw_bytes: bytes) -> float:
         flag = "d" if (len(raw_bytes)==8) else "f"
         spec = (">"+flag) if (self.endian == "big") else ("<"+flag)
-        value = struct.unpack(spec,raw_bytes)[0]
-        dest_stream.write(self.print_format.format(value))
+        return struct.unpack(spec,raw_bytes)[0]
+
+    def format_value(self, value: float) -> str:
+        return self.formatter(value)
+
+    def format_data(self, dest_stream: TextIO, raw_bytes: bytes):
+        dest_stream.write(self.formatter(self.decode(raw_bytes)))
 
 
 class CharacterFieldDef(NonStructuralTypeFieldDef):
@@ -374,8 +692,7 @@ class CharacterFieldDef(NonStructuralTypeFieldDef):
 
     _CONFIG_KEYS = {"encoding", "length", "stop_on_zero"} | NonStructuralTypeFieldDef._CONFIG_KEYS
 
-    _length = None          # None or int or compiled code; if string is provided in format json, then it is compiled to code that
-                            # is supposed to evaluate to an unsigned integer specifying actual string length
+    __slots__ = ("stop_on_zero", "encoding", "_length")
 
     @classmethod
     def is_encoding_name_valid(self, s: str):
@@ -390,8 +707,9 @@ class CharacterFieldDef(NonStructuralTypeFieldDef):
         self.size = self.DEFAULT_SIZE
         self.stop_on_zero = self.DEFAULT_STOP_ON_ZERO
         self.encoding = self.DEFAULT_ENCODING
-        self._length = None         # None or int or compiled code; if string is provided in format json, then it is compiled to code that
-                                    # is supposed to evaluate to an unsigned integer specifying actual string length in characters
+        self._length = None         # None or int or compiled expression; if string is provided in format json, then it is compiled to
+                                    # an expression that is supposed to evaluate to an unsigned integer specifying actual string length
+                                    # in characters
 
     def clone(self, name: str, parent_name: str, field_def: dict[str,Any]) -> FieldDef:
         r = super().clone(name, parent_name, field_def)
@@ -416,7 +734,7 @@ class CharacterFieldDef(NonStructuralTypeFieldDef):
             elif isinstance(length, str):
                 specified_length = length
                 try:
-                    length = compile(specified_length, filename=self.qualified_name, mode="eval")
+                    length = BE.Expression(specified_length, filename=name)
                 except:
                     raise_field_def_exception(parent_name, name,
                                               "cannot compile \"length\" calculating expression: \"{!s}\"".format(specified_length))
@@ -430,22 +748,33 @@ class CharacterFieldDef(NonStructuralTypeFieldDef):
         if (self._length is None) or isinstance(self._length,int):
             return self._length
         else:
-            return eval(self._length,{},self.namespace)
+            return self._length.evaluate(_current_namespace.get())
 
     length = property(length_getter)
 
-    def format_data(self, dest_stream: TextIO, raw_bytes: bytes):
+    def referenced_names(self) -> frozenset:
+        names = super().referenced_names()
+        return (names | self._length.names) if isinstance(self._length, BE.Expression) else names
+
+    def decode(self, raw_bytes: bytes) -> str:
+        raw_bytes = bytes(raw_bytes)        # may be a memoryview slice
         end = len(raw_bytes)
         if self.stop_on_zero and (0 in raw_bytes):
             end = raw_bytes.index(0)
 
         decoded_str = raw_bytes[0:end].decode(self.encoding, errors='backslashreplace')
 
-        if self.length is not None:
-            if self.length < len(decoded_str):
-                decoded_str = decoded_str[:self.length]
+        length = self.length                # NOTE: this is property that may be calculated by compiled code chunk, so take it once
+        if (length is not None) and (length < len(decoded_str)):
+            decoded_str = decoded_str[:length]
+
+        return decoded_str
 
-        dest_stream.write("\"{}\"".format(decoded_str))
+    def format_value(self, value: str) -> str:
+        return "\"{}\"".format(value)
+
+    def format_data(self, dest_stream: TextIO, raw_bytes: bytes):
+        dest_stream.write(self.format_value(self.decode(raw_bytes)))
 
 
 class SkipFieldDef(FieldDef):
@@ -454,12 +783,17 @@ class SkipFieldDef(FieldDef):
     The count value is the exact number of bytes to skip.
     """
 
+    __slots__ = ()
+
     def __init__(self, name):
         super().__init__(name)
 
     def clone(self, name: str, parent_name: str, field_def: dict[str,Any]) -> FieldDef:
         return super().clone(name, parent_name, field_def)
 
+    def intern_key(self) -> Union[tuple,None]:
+        return self.contents_key()
+
     def format_data(self, dest_stream: TextIO, raw_bytes: bytes):
         pass
 
@@ -472,6 +806,8 @@ class StructuralFieldDef(FieldDef):
 
     _CONFIG_KEYS = set() | FieldDef._CONFIG_KEYS
 
+    __slots__ = ()
+
     top_level_fields = dict()       # a common dictionary containing top-level field definitions; initially it should be filled with
                                     # fundamental definitions used only as base typedefs for user field definitions
 
@@ -514,8 +850,11 @@ class StructFieldDef(StructuralFieldDef):
 
     _CONFIG_KEYS = {"placement","fields"} | StructuralFieldDef._CONFIG_KEYS
 
+    __slots__ = ("placement", "fields")
+
     STRUCT_FIELD_PLACEMENT_KEYS = ["normal","aligned","oneline"]
-    STRUCT_FIELD_PLACEMENT_ENUM = enum.Enum("STRUCT_FIELD_PLACEMENT_ENUM", STRUCT_FIELD_PLACEMENT_KEYS)
+    STRUCT_FIELD_PLACEMENT_ENUM = enum.Enum("STRUCT_FIELD_PLACEMENT_ENUM", STRUCT_FIELD_PLACEMENT_KEYS,
+                                            qualname="StructFieldDef.STRUCT_FIELD_PLACEMENT_ENUM")     # qualname makes it picklable
     DEFAULT_STRUCT_FIELD_PLACEMENT = STRUCT_FIELD_PLACEMENT_ENUM.normal
 
     @classmethod
@@ -590,7 +929,7 @@ class StructFieldDef(StructuralFieldDef):
                     field_def = field_def.copy()
                     field_def["base"] = "union"
 
-            field = self._create_field(field_name, field_parent_name, field_def, fields)
+            field = self._create_field(field_name, field_parent_name, field_def, fields).interned()
             fields[field_name] = field
             if add_fields_as_top_level_definitions:
                 self.add_top_level_field(field)
@@ -601,9 +940,12 @@ class UnionFieldDef(StructuralFieldDef):
     _CONFIG_KEYS = {"variants"} | StructuralFieldDef._CONFIG_KEYS
     _UNION_VARIANT_SPEC_DEF_KEYS = {"prefetch_size", "data_offset", "total_size", "trigger"}
 
+    __slots__ = ("variants", "variant_table")
+
     def __init__(self, name: str):
         super().__init__(name)
         self.variants = dict()
+        self.variant_table = None   # optional variant lookup table indexed with the first byte of data; see create_variant_table()
 
     def clone(self, name: str, parent_name: str, field_def: dict[str,Any]):
         """
@@ -623,6 +965,7 @@ class UnionFieldDef(StructuralFieldDef):
             if len(new_field_defs)>0:
                 r.variants = r.variants.copy()        # we need to add to the list, so a separate one is necessary
                 self.create_variants(name, parent_name, new_field_defs, r.variants)
+                r.variant_table = r.create_variant_table()
         return r
 
     @classmethod
@@ -683,7 +1026,7 @@ class UnionFieldDef(StructuralFieldDef):
                     raise_field_def_exception(variant_parent_name, last_variant.name,
                                               "trigger is not a string expression; got: \"{:s}\"".format(trigger))
                 try:
-                    compiled_trigger = compile(trigger, parent_name, "eval")
+                    compiled_trigger = BE.Expression(trigger, filename=variant_parent_name)
                 except:
                     raise_field_def_exception(parent_name, name,
                                               "cannot compile the trigger: \"{:s}\"".format(trigger))
@@ -702,32 +1045,131 @@ class UnionFieldDef(StructuralFieldDef):
             variants[variant_name] = variant
             last_variant = variant
 
+    def referenced_names(self) -> frozenset:
+        names = super().referenced_names()
+        for v in self.variants.values():
+            if v.trigger is not None:
+                names = names | v.trigger.names
+        return names
+
+    def create_variant_table(self) -> List[Tuple[FieldDef,int,List[FieldDef]]]:
+        """
+        Analyzes variant triggers in advance for each possible value of the first data byte. Variants with triggers depending only on
+        RAW[0] (like "RAW[0]==0xFD") are resolved at once. The result is a 256-entry table of (variant, prefetch size, remaining variants)
+        tuples: the first variant that is not excluded for given first byte (None if all of them are excluded), the prefetch size
+        required to get there, and None or - if the trigger of the variant depends on something else - the list of variants which
+        triggers need to be evaluated (starting from that one).
+        Returns None if the table would be useless (the first variant cannot be excluded) or cannot be created.
+        """
+        variants = list(self.variants.values())
+        if (len(variants) == 0) or (variants[0].prefetch_size < 1):
+            return None
+        analyzable = [(v.trigger is not None) and v.trigger.depends_only_on_item("RAW", 0) for v in variants]
+        if not analyzable[0]:
+            return None
+
+        table = []
+        for first_byte in range(256):
+            namespace = {"RAW": bytes((first_byte,))}
+            entry = (None, variants[-1].prefetch_size, None)     # no variant triggered
+            for i, v in enumerate(variants):
+                if v.trigger is None:
+                    entry = (v, v.prefetch_size, None)
+                    break
+                if not analyzable[i]:
+                    entry = (v, v.prefetch_size, variants[i:])
+                    break
+                try:
+                    triggered = v.trigger.evaluate(namespace)
+                except Exception:       # leave reporting any problems to choose_variant()
+                    return None
+                if triggered:
+                    entry = (v, v.prefetch_size, None)
+                    break
+            table.append(entry)
+        return table
+
     def choose_variant(self, input_stream: BinaryIO) -> FieldDef:
         """
         Return union variant definition that triggered by trigger code. If no variant triggered, returns None
-        May read bytes from stream in order to to determine its type but at the end moves the stream pointer back to its original location.
+        May peek bytes from stream in order to to determine its type; the stream position is not changed.
         NOTE: The returned value is one of the normal derivatives of base field definition decorated with union-variant specific fields:
         at least: data_offset and total_size that are required by outer client in order to handle data offsets correctly.
         """
-        prefetched_data = bytes()
+        variants = self.variants.values()
+
+        if self.variant_table is not None:
+            first_byte = peek_data(input_stream, 1)
+            if len(first_byte) < 1:
+                raise EOFError("unexpected end of data file")
+            variant, prefetch_size, remaining_variants = self.variant_table[first_byte[0]]
+            if (prefetch_size > 1) and (len(peek_data(input_stream, prefetch_size)) < prefetch_size):
+                raise EOFError("unexpected end of data file")       # the same data required as if triggers were evaluated one by one
+            if remaining_variants is None:
+                return variant
+            variants = remaining_variants
+
+        namespace = _current_namespace.get()
+        prefetched_size = 0
         result = None
 
-        for k,v in self.variants.items():
-            if v.prefetch_size > len(prefetched_data):
-                prefetched_data = prefetched_data + input_stream.read(v.prefetch_size - len(prefetched_data))
+        for v in variants:
+            if v.prefetch_size > prefetched_size:
+                prefetched_data = bytes(peek_data(input_stream, v.prefetch_size))
                 if len(prefetched_data) < v.prefetch_size:
                     raise EOFError("unexpected end of data file")
-                self.namespace["RAW"] = prefetched_data
-            if (v.trigger is None) or eval(v.trigger, {}, self.namespace):
+                prefetched_size = v.prefetch_size
+                namespace["RAW"] = prefetched_data
+            if (v.trigger is None) or v.trigger.evaluate(namespace):
                 result = v
                 break
 
-        self.namespace.pop("RAW",None)                  # remove prefetched data if any remained
-        input_stream.seek(-len(prefetched_data), 1)     # move back stream pointer (it may be trivial move by zero bytes)
+        namespace.pop("RAW",None)                       # remove prefetched data if any remained
         return result       # None if no variant triggered; leave decision to the caller
 
 
+def iter_field_defs(structure: StructuralFieldDef) -> Iterator[FieldDef]:
+    """
+    Yields the structure (or union) definition and all the definitions nested in it, each one once.
+    """
+    visited = set()
+    fields = [structure]
+    while fields:
+        field = fields.pop()
+        if id(field) in visited:
+            continue
+        visited.add(id(field))
+        yield field
+        if field.is_structure():
+            fields.extend(field.fields.values())
+        elif field.is_union():
+            fields.extend(field.variants.values())
+
+
+def referenced_names(structure: StructuralFieldDef) -> frozenset:
+    """
+    Returns the names of all the namespace values referred to by count, length and trigger expressions of the structure fields.
+    """
+    names = set()
+    for field in iter_field_defs(structure):
+        names.update(field.referenced_names())
+    return frozenset(names)
+
+
+def mark_stored_fields(structure: StructuralFieldDef) -> frozenset:
+    """
+    Static analysis of complete definitions of the data: only values of the fields referred to by some count, length or trigger
+    expression are stored in the namespace when decoded; storing the other ones would be a waste of time. Returns the referred names.
+    """
+    names = referenced_names(structure)
+    for field in iter_field_defs(structure):
+        if isinstance(field, UnsignedIntegerFieldDef):
+            field.stored = field.name in names      # NOTE: shared (interned) definitions have equal names, so the same decision
+    return names
+
+
 def create_base_types():
+    FieldDef._interned_fields.clear()       # the beginning of a new set of definitions; the ones built before are not shared anymore
     StructuralFieldDef.add_top_level_field(SignedIntegerFieldDef("int"))
     StructuralFieldDef.add_top_level_field(UnsignedIntegerFieldDef("uint"))
     StructuralFieldDef.add_top_level_field(IntegerTimestampFieldDef("ts"))
@@ -745,6 +1187,38 @@ def create_fields(name: str, add_fields_as_top_level_definitions: bool,
     StructFieldDef.create_fields(name, None, add_fields_as_top_level_definitions, structure_field_defs, fields)
 
 
+class DefinitionScope:
+    """
+    Builds a set of type definitions in a private registry: the top-level definitions, the shared (interned) ones and the default
+    values (see set_default_*()) are restored when the scope is exited, so the definitions built in the scope do not affect the ones
+    built before or after it (and vice versa). Complete definitions do not depend on the registry, so they may be used after the
+    scope is exited. The registry is global, so scopes entered by different threads are serialized.
+    """
+    __slots__ = ("_saved",)
+
+    _lock = threading.RLock()
+
+    def __init__(self):
+        self._saved = []
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._saved.append((dict(StructuralFieldDef.top_level_fields), dict(FieldDef._interned_fields),
+                            [getattr(cls, name) for cls, name in _DEFAULT_VALUE_ATTRIBUTES]))
+        StructuralFieldDef.top_level_fields.clear()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        top_level_fields, interned_fields, default_values = self._saved.pop()
+        StructuralFieldDef.top_level_fields.clear()
+        StructuralFieldDef.top_level_fields.update(top_level_fields)
+        FieldDef._interned_fields.clear()
+        FieldDef._interned_fields.update(interned_fields)
+        for (cls, name), value in zip(_DEFAULT_VALUE_ATTRIBUTES, default_values):
+            setattr(cls, name, value)
+        self._lock.release()
+
+
 def set_default_separator(s: str):
     if not isinstance(s,str):
         raise DefaultValueException("Invalid default field separator; expected string, got: {!s}".format(s))
@@ -820,3 +1294,12 @@ def set_default_structure_fields_placement(s: str):
         raise DefaultValueException("invalid default structure fields placement specifier: \"{!s}\"".format(s))
     StructFieldDef.DEFAULT_STRUCT_FIELD_PLACEMENT = placement
 
+
+# class attributes set by set_default_*() functions
+_DEFAULT_VALUE_ATTRIBUTES = ((NonStructuralTypeFieldDef, "DEFAULT_SEPARATOR"), (NumericTypeFieldDef, "DEFAULT_ENDIAN"),
+                             (IntegerTypeFieldDef, "DEFAULT_FORMAT"), (IntegerTypeFieldDef, "DEFAULT_SIZE"),
+                             (TimestampTypeFieldDef, "DEFAULT_FORMAT"), (TimestampTypeFieldDef, "DEFAULT_TZOFFS"),
+                             (IntegerTimestampFieldDef, "DEFAULT_SIZE"), (FloatFieldDef, "DEFAULT_FORMAT"),
+                             (FloatFieldDef, "DEFAULT_SIZE"), (CharacterFieldDef, "DEFAULT_STOP_ON_ZERO"),
+                             (CharacterFieldDef, "DEFAULT_ENCODING"), (StructFieldDef, "DEFAULT_STRUCT_FIELD_PLACEMENT"))
+
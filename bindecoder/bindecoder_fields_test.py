@@ -5,9 +5,11 @@
 from . import bindecoder_fields as BF
 
 import copy
+import datetime
 import importlib
 import io
 import json
+import pickle
 import sys
 import unittest
 
@@ -281,6 +283,42 @@ class Test(unittest.TestCase):
         self.assertEqual(dest.getvalue(), "ffffff")
 
 
+    def test__value_formatter(self):
+        self._prepare_base_types()
+
+        struct_def_json =   """
+                            {
+                                "i1":{"base":"int", "size":1, "format":"<{:+04d}>"},
+                                "i2":{"base":"int", "size":1, "format":"<{:+04d}>"},
+                                "u1":{"base":"uint", "size":1, "format":"0x{:02x}"},
+                                "u2":{"base":"uint", "size":2, "format":"{0:#06x} ({0:d})"},
+                                "u3":{"base":"uint", "size":1, "format":"{:s}"},
+                                "f1":{"base":"float", "size":8, "format":"{:08.3f}"}
+                            }
+                            """
+
+        struct_def = json.loads(struct_def_json)
+        fields = dict()
+        BF.create_fields(name="main", add_fields_as_top_level_definitions=True, structure_field_defs=struct_def, fields=fields)
+
+        # 1-byte values are presented with lookup tables (shared by equal definitions), others with %-formatting if possible
+        self.assertIs(fields["i1"].formatter, fields["i2"].formatter)
+        self.assertEqual(copy.copy(fields["i1"]), fields["i1"])
+        self.assertEqual([fields["i1"].format_value(v) for v in (-128, -1, 0, 5, 127)], ["<-128>", "<-001>", "<+000>", "<+005>", "<+127>"])
+        self.assertEqual([fields["u1"].format_value(v) for v in (0, 10, 255)], ["0x00", "0x0a", "0xff"])
+        self.assertEqual(fields["u2"].format_value(300), "0x012c (300)")
+        self.assertEqual(fields["f1"].format_value(-2.5), "-002.500")
+        self.assertIs(self.unsignedIntegerField.formatter, str)
+
+        dest = io.StringIO()
+        fields["i1"].process_data(dest, io.BytesIO(b"\xFE"))
+        self.assertEqual(dest.getvalue(), "<-002>")
+
+        # a format not suitable for the values still fails only when a value is presented
+        with self.assertRaises(ValueError):
+            fields["u3"].process_data(io.StringIO(), io.BytesIO(b"\x01"))
+
+
     def test__integer_timestamp_field_defaults(self):
         self._prepare_base_types()
 
@@ -509,6 +547,45 @@ class Test(unittest.TestCase):
         self.assertEqual(dest.getvalue(), "2022-12-10 22:36:28.123000")
 
 
+    def test__timestamp_formatter(self):
+        self._prepare_base_types()
+
+        struct_def_json =   """
+                            {
+                                "i1":{"base":"ts", "tzoffs":-7200},
+                                "i2":{"base":"ts", "tzoffs":-7200},
+                                "i3":{"base":"ts", "tzoffs":null, "format":"%a %b %d %H:%M:%S %Y"}
+                            }
+                            """
+
+        struct_def = json.loads(struct_def_json)
+        fields = dict()
+        BF.create_fields(name="main", add_fields_as_top_level_definitions=True, structure_field_defs=struct_def, fields=fields)
+
+        # formatters are shared by fields having the same pattern and time zone, also after unpickling
+        self.assertIs(fields["i1"].formatter, fields["i2"].formatter)
+        self.assertIsNot(fields["i1"].formatter, fields["i3"].formatter)
+        self.assertIsNot(fields["i1"].formatter, self.integerTimestampField.formatter)
+        self.assertEqual(copy.copy(fields["i1"]), fields["i1"])
+        self.assertIs(pickle.loads(pickle.dumps(fields["i1"])).formatter, fields["i1"].formatter)
+
+        dest = io.StringIO()
+        fields["i1"].process_data(dest, io.BytesIO(b"\x00\x00\x00\x00"))
+        self.assertEqual(dest.getvalue(), "1969-12-31 22:00:00")
+
+        # integer arithmetic (the first three patterns, fixed time zone), strftime() and the cache must give the same texts
+        patterns = ["%Y-%m-%d %H:%M:%S", "{%d.%m.%Y} %H:%M:%S.%f %%f", "%S", "%Y-%m-%dT%H:%M:%S%z", "%a %b %d %H:%M:%S.%f %Y"]
+        values = [0, 1, 59.9999996, 86399, 86400, 951782400, 1670711788.123, 1670711788.5, 2**31-1, 2**32-1, -1, -86401.25]
+        for tzoffs in [0, 3600, -9000, None]:
+            tz = None if (tzoffs is None) else datetime.timezone(datetime.timedelta(seconds=tzoffs))
+            for pattern in patterns:
+                formatter = BF.TimestampFormatter.get(pattern, tzoffs)
+                self.assertEqual(formatter.template is not None, (tzoffs is not None) and ("%z" not in pattern) and ("%a" not in pattern))
+                for seconds in values + values:
+                    expected = datetime.datetime.fromtimestamp(seconds).astimezone(tz).strftime(pattern)
+                    self.assertEqual(formatter.format(seconds), expected, (pattern, tzoffs, seconds))
+
+
     def test__float_field_defaults(self):
         self._prepare_base_types()
 
@@ -1797,6 +1874,79 @@ class Test(unittest.TestCase):
         self.assertIsNone(f,"No variant match, so None is expected")
 
 
+    def test__union_variant_table(self):
+        struct_def_json = \
+            """
+            {
+                "varint":
+                {
+                    "base":"union",
+                    "variants":
+                    {
+                        "v8": {"base":"uint", "size":1, "prefetch_size":1,                  "trigger":"RAW[0]<0xFD"},
+                        "v16":{"base":"uint", "size":2, "prefetch_size":1, "data_offset":1, "trigger":"RAW[0]==0xFD"},
+                        "v32":{"base":"uint", "size":4, "prefetch_size":1, "data_offset":1, "trigger":"RAW[0]==0xFE"},
+                        "v64":{"base":"uint", "size":8, "prefetch_size":1, "data_offset":1}
+                    }
+                },
+                "mixed":
+                {
+                    "base":"union",
+                    "variants":
+                    {
+                        "v0":{"base":"float", "prefetch_size":1, "trigger":"RAW[0]==0x12"},
+                        "v1":{"base":"int",   "prefetch_size":2, "trigger":"RAW[0]==0x34 and RAW[1]==0x56"},
+                        "v2":{"base":"uint",  "prefetch_size":3, "trigger":"(RAW[0]&0xF0)==0x70"}
+                    }
+                },
+                "dynamic":
+                {
+                    "base":"union",
+                    "variants":
+                    {
+                        "v0":{"base":"float", "prefetch_size":1, "trigger":"RAW[0]==i0"},
+                        "v1":{"base":"int",   "prefetch_size":1}
+                    }
+                }
+            }
+            """
+
+        struct_def = json.loads(struct_def_json)
+
+        self._prepare_base_types()
+
+        fields = {}
+        BF.create_fields(name="main", add_fields_as_top_level_definitions=True, structure_field_defs=struct_def, fields=fields)
+
+        varint = fields["varint"]
+        self.assertIsNotNone(varint.variant_table)
+        self.assertEqual(len(varint.variant_table), 256)
+        for first_byte, expected in ((0x00,"v8"), (0xFC,"v8"), (0xFD,"v16"), (0xFE,"v32"), (0xFF,"v64")):
+            variant, prefetch_size, remaining_variants = varint.variant_table[first_byte]
+            self.assertEqual(variant.name, expected)
+            self.assertIsNone(remaining_variants, "all the variants are resolved with the first byte")
+            data = io.BytesIO(bytes([first_byte, 1, 2]))
+            self.assertEqual(varint.choose_variant(data).name, expected)
+            self.assertEqual(data.read(), bytes([first_byte, 1, 2]))
+
+        mixed = fields["mixed"]
+        self.assertIsNotNone(mixed.variant_table)
+        self.assertEqual(mixed.choose_variant(io.BytesIO(b"\x12")).name, "v0")
+        self.assertEqual(mixed.choose_variant(io.BytesIO(b"\x34\x56\x00")).name, "v1")
+        self.assertEqual(mixed.choose_variant(io.BytesIO(b"\x7a\x00\x00")).name, "v2")
+        self.assertIsNone(mixed.choose_variant(io.BytesIO(b"\x34\x00\x00")))
+        with self.assertRaises(EOFError):
+            mixed.choose_variant(io.BytesIO(b"\x7a\x00"))     # like when triggers are evaluated one by one, 3 bytes are required
+        with self.assertRaises(EOFError):
+            mixed.choose_variant(io.BytesIO(b""))
+
+        dynamic = fields["dynamic"]
+        self.assertIsNone(dynamic.variant_table, "the first trigger depends on a decoded value")
+        dynamic.namespace["i0"] = 0x55
+        self.assertEqual(dynamic.choose_variant(io.BytesIO(b"\x55")).name, "v0")
+        self.assertEqual(dynamic.choose_variant(io.BytesIO(b"\x56")).name, "v1")
+
+
     def test__default_values(self):
 
         self.assertEqual(BF.StructFieldDef.DEFAULT_STRUCT_FIELD_PLACEMENT, BF.StructFieldDef.STRUCT_FIELD_PLACEMENT_ENUM.normal)
@@ -2009,4 +2159,33 @@ class Test(unittest.TestCase):
         self.assertIsInstance(u1, BF.UnionFieldDef)
 
 
+    def test_identical_fields_sharing(self):
+        self._prepare_base_types()
+
+        struct_def_json =   """
+                            {
+                                "s1":{"fields":{"len":"uint", "name":{"base":"char", "length":"len"}, "x":"int"}},
+                                "s2":{"fields":{"len":"uint", "name":{"base":"char", "length":"len"}, "x":{"base":"int", "size":2}}},
+                                "u1":{"variants":{"len":{"base":"uint", "trigger":"False"}, "x":{"base":"int"}}}
+                            }
+                            """
+
+        fields = dict()
+        BF.create_fields(name="main", add_fields_as_top_level_definitions=True, structure_field_defs=json.loads(struct_def_json),
+                         fields=fields)
+        s1 = fields["s1"].fields
+        s2 = fields["s2"].fields
+        self.assertIs(s1["len"], s2["len"])
+        self.assertIs(s1["name"], s2["name"], "fields with the same length expressions are identical")
+        self.assertIsNot(s1["x"], s2["x"])
+        self.assertEqual(s2["x"].size, 2)
+        self.assertIsNot(fields["u1"].variants["len"], s1["len"], "union variants are never shared")
+        self.assertIsNotNone(fields["u1"].variants["len"].trigger)
+        self.assertIsNone(s1["len"].trigger)
+        self.assertIs(fields["s1"], fields["s1"].interned(), "structures are never shared")
+
+        self.assertFalse(hasattr(s1["name"], "__dict__"))
+        self.assertEqual(copy.copy(s1["name"]), s1["name"])
+
+
 unittest.main()
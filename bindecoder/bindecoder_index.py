@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import array
+import struct
+import sys
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO,Iterator
+
+from . import bindecoder_fields as BF
+from . import bindecoder_input as BI
+from . import bindecoder_plan as BP
+from . import bindecoder_values as BV
+from .bindecoder_input import InputDataErrorException
+
+INDEX_FILE_EXTENSION = ".bdidx"
+INDEX_FILE_MAGIC = b"BDIDX\x00\x01\x00"     # file type and format version
+
+# magic, number of elements, stride, input offset, input data size (UNKNOWN_SIZE if not known), field name length
+_INDEX_HEADER = struct.Struct("<8sQQQQH")
+UNKNOWN_SIZE = 0xffffffffffffffff
+
+
+class RecordIndex:
+    """
+    Start offsets of elements (every stride-th one) of a top-level array of structures or unions. Offsets are relative to
+    the input offset decoding started at, like the offsets presented by the decoder. The index allows decoding any element without
+    decoding the ones before it, provided elements do not refer to values of preceding elements.
+    Index files contain a fixed-size header, the field name and the offsets as little endian 64-bit integers.
+    """
+
+    def __init__(self, field_name: str, count: int, stride: int, offsets: array.array, input_offset: int = 0, input_size: int = None):
+        self.field_name = field_name
+        self.count = count                  # the number of all the array elements
+        self.stride = stride                # offsets of elements 0, stride, 2*stride ... are kept
+        self.offsets = offsets              # array("Q")
+        self.input_offset = input_offset
+        self.input_size = input_size
+
+    def lookup(self, element: int) -> Tuple[int,int]:
+        """
+        Returns the index and the offset of the nearest indexed element not greater than given one.
+        """
+        entry = element // self.stride
+        return entry * self.stride, self.offsets[entry]
+
+    def check_input(self, input_offset: int, input_size: int):
+        if input_offset != self.input_offset:
+            raise InputDataErrorException("The index was built for input offset {:d}, not {:d}".format(self.input_offset, input_offset))
+        if (self.input_size is not None) and (input_size is not None) and (input_size != self.input_size):
+            raise InputDataErrorException("The index is stale: it was built for {:d} bytes of input data, now there are {:d}"
+                                          .format(self.input_size, input_size))
+
+    def save(self, file_name: str):
+        offsets = array.array("Q", self.offsets)
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        name = self.field_name.encode("utf-8")
+        input_size = self.input_size if (self.input_size is not None) else UNKNOWN_SIZE
+        with open(file_name, "wb") as f:
+            f.write(_INDEX_HEADER.pack(INDEX_FILE_MAGIC, self.count, self.stride, self.input_offset, input_size, len(name)))
+            f.write(name)
+            offsets.tofile(f)
+
+    @classmethod
+    def load(cls, file_name: str) -> "RecordIndex":
+        with open(file_name, "rb") as f:
+            header = f.read(_INDEX_HEADER.size)
+            if (len(header) < _INDEX_HEADER.size) or (header[:len(INDEX_FILE_MAGIC)] != INDEX_FILE_MAGIC):
+                raise InputDataErrorException("\"{:s}\" is not an index file".format(file_name))
+            magic, count, stride, input_offset, input_size, name_length = _INDEX_HEADER.unpack(header)
+            field_name = f.read(name_length).decode("utf-8")
+            offsets = array.array("Q")
+            num_of_offsets = (count + stride - 1) // stride
+            try:
+                offsets.fromfile(f, num_of_offsets)
+            except EOFError:
+                raise InputDataErrorException("Index file \"{:s}\" is truncated".format(file_name)) from None
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        return cls(field_name, count, stride, offsets, input_offset, None if (input_size == UNKNOWN_SIZE) else input_size)
+
+
+def select_array_op(plan: BP.DecodePlan, field_name: str = None) -> BP.DecodeOp:
+    """
+    Returns the op of given top-level array of structures or unions, or of the first one if the name is not specified.
+    """
+    for op in plan.root.ops:
+        if (op.opcode not in (BP.OP_STRUCT, BP.OP_UNION)) or ((op.static_count is not None) and (op.static_count <= 1)):
+            continue
+        if (field_name is None) or (op.name == field_name):
+            return op
+    if field_name is not None:
+        raise InputDataErrorException("Field \"{:s}\" is not a top-level array of structures or unions".format(field_name))
+    raise InputDataErrorException("There is no top-level array of structures or unions")
+
+
+def decode_prefix(decoder: BV.ValueDecoder, block: BP.DecodeBlock, target: BP.DecodeOp) -> int:
+    """
+    Decodes (without presenting them) the fields preceding the target one, so the values they store (e.g. the element count)
+    are available. Returns the target field count.
+    """
+    for op in block.ops:
+        if op is target:
+            return decoder.field_count(op)
+        if op.opcode == BP.OP_VALUE_RUN:
+            decoder.decode_value_run(op)
+        elif op.opcode == BP.OP_SKIP:
+            decoder.skip(decoder.field_count(op))
+        elif op.opcode == BP.OP_HIDDEN:
+            decoder.skip_fields(op)
+        else:
+            decoder.decode_op(op, decoder.field_count(op))
+    raise InputDataErrorException("Field \"{:s}\" not found".format(target.name))
+
+
+class OffsetScanner(BV.ValueDecoder):
+    """
+    Finds array element boundaries much faster than decoding: only the values referred to by count, length and trigger expressions
+    (see BF.referenced_names()) are decoded and stored in the namespace; other fields, and whole fixed-size structures that contain no
+    such values, are skipped. Nothing is returned for the scanned fields.
+    """
+
+    def __init__(self, input_stream: Union[BinaryIO,BI.InputSource], names: frozenset, input_offset: int = 0):
+        super().__init__(input_stream)
+        self.names = names
+        self.input_offset = input_offset
+        self.origin = self.input_stream.tell() - input_offset     # the input position of offset 0
+        size = getattr(self.input_stream, "size", None)
+        self.data_end = (size - self.origin) if (size is not None) else None     # None: not known in advance (see check_data_end())
+        self._skippable_sizes = {}      # id(block) -> size of the block data if it may be skipped as a whole, None otherwise
+
+    def seek(self, input_offset: int):
+        self.input_stream.seek(self.origin + input_offset)
+        self.input_offset = input_offset
+
+    def check_data_end(self):
+        """
+        Raises EOFError if the data skipped so far goes beyond the end of data. The end of non-seekable input (BI.PipeInput)
+        is known once it is reached.
+        """
+        data_end = self.data_end
+        if data_end is None:
+            end = getattr(self.input_stream, "end", None)
+            if end is None:
+                return
+            data_end = end - self.origin
+        if self.input_offset > data_end:
+            raise EOFError("unexpected end of data file")
+
+    def skippable_size(self, block: BP.DecodeBlock) -> Union[int,None]:
+        key = id(block)
+        if key not in self._skippable_sizes:
+            size = BP.static_block_size(block)
+            if (size is not None) and not self.names.isdisjoint(block_value_names(block)):
+                size = None
+            self._skippable_sizes[key] = size
+        return self._skippable_sizes[key]
+
+    def scan_value_run(self, run: BP.DecodeOp):
+        if self.names.isdisjoint(m.name for m in run.members):
+            self.skip(run.size)
+        else:
+            self.decode_value_run(run)
+
+    def skip_fields(self, op: BP.DecodeOp):
+        size = self.skippable_size(op.block)
+        if size is None:
+            self.decode_block(op.block)
+        else:
+            self.skip(size)
+        self.check_data_end()
+
+    def decode_block(self, block: BP.DecodeBlock):
+        for op in block.ops:
+            if op.opcode == BP.OP_VALUE_RUN:
+                self.scan_value_run(op)
+            elif op.opcode == BP.OP_SKIP:
+                self.skip(self.field_count(op))
+            elif op.opcode == BP.OP_HIDDEN:
+                self.skip_fields(op)
+            else:
+                self.decode_op(op, self.field_count(op))
+
+    def decode_op(self, op: BP.DecodeOp, field_count: int):
+        opcode = op.opcode
+        if opcode == BP.OP_VALUE:
+            if op.name in self.names:
+                self.decoder_of(op.field)(self.read(op.size))       # stores the value
+            else:
+                self.skip(op.size)
+        elif (opcode == BP.OP_ARRAY) and (field_count >= 0):
+            if (op.name in self.names) and (field_count > 0):
+                self.skip((field_count - 1) * op.size)              # only the last value stays in the namespace
+                self.decoder_of(op.field)(self.read(op.size))
+            else:
+                self.skip(field_count * op.size)
+        elif opcode == BP.OP_STRUCT:
+            size = self.skippable_size(op.element_block if (field_count > 1) else op.block)
+            if size is None:
+                super().decode_op(op, field_count)
+            else:
+                self.skip(max(field_count, 1) * size)                # a structure with count 0 is decoded once
+        else:
+            super().decode_op(op, field_count)
+
+    def scan_element(self, op: BP.DecodeOp, element: int):
+        if op.opcode == BP.OP_STRUCT:
+            self.decode_block(op.element_block)
+        else:
+            self.decode_union(op.field, op.element_variant_ops, element)
+        self.check_data_end()
+
+    def iter_chunks(self, op: BP.DecodeOp, field_count: int, chunk_elements: int) -> Iterator[Tuple[int,int,int,dict]]:
+        """
+        Scans array elements yielding chunks of subsequent complete elements: (first element, last element + 1, offset of the first
+        element, namespace contents before the first element). Scanning stops before the first element that cannot be decoded
+        (due to the end of data or invalid data); the number of complete elements is left in self.complete then, and the input
+        position and namespace are the same as before that element.
+        """
+        namespace = op.field.namespace
+        self.complete = 0
+        first = 0
+        while first < field_count:
+            last = min(first + chunk_elements, field_count)
+            chunk_offset = self.input_offset
+            chunk_namespace = namespace.copy()
+            i = first
+            try:
+                while i < last:
+                    self.scan_element(op, i)
+                    i += 1
+            except (EOFError, InputDataErrorException):
+                # go back to the beginning of the chunk, and scan it again up to the incomplete element
+                self.seek(chunk_offset)
+                namespace.clear()
+                namespace.update(chunk_namespace)
+                for j in range(first, i):
+                    self.scan_element(op, j)
+                if i > first:
+                    yield (first, i, chunk_offset, chunk_namespace)
+                self.complete = i
+                return
+            yield (first, last, chunk_offset, chunk_namespace)
+            self.complete = last
+            first = last
+
+
+def block_value_names(block: BP.DecodeBlock) -> set:
+    """
+    Returns the names of all the non-structural fields of the block, including the ones of nested structures (but not unions).
+    """
+    names = set()
+    for op in block.ops:
+        if op.opcode == BP.OP_VALUE_RUN:
+            names.update(m.name for m in op.members)
+        elif op.opcode in (BP.OP_VALUE, BP.OP_ARRAY):
+            names.add(op.name)
+        elif op.opcode == BP.OP_HIDDEN:
+            names.update(block_value_names(op.block))
+        elif op.opcode == BP.OP_STRUCT:
+            for b in (op.block, op.element_block):
+                if b is not None:
+                    names.update(block_value_names(b))
+    return names
+
+
+def build_index(input_stream: Union[BinaryIO,BI.InputSource], plan: BP.DecodePlan, field_name: str = None, stride: int = 1,
+                input_offset: int = 0, input_size: int = None) -> RecordIndex:
+    """
+    Scans the whole array recording the start offsets of its elements.
+    """
+    op = select_array_op(plan, field_name)
+    with BF.NamespaceScope():
+        scanner = OffsetScanner(input_stream, BF.referenced_names(plan.root.structure))
+        field_count = decode_prefix(scanner, plan.root, op)
+        offsets = array.array("Q")
+        for i in range(field_count):
+            if (i % stride) == 0:
+                offsets.append(scanner.input_offset)
+            scanner.scan_element(op, i)
+    return RecordIndex(op.name, max(field_count, 0), stride, offsets, input_offset, input_size)
+
+
+def seek_element(scanner: OffsetScanner, plan: BP.DecodePlan, op: BP.DecodeOp, element: int, index: RecordIndex = None) -> int:
+    """
+    Moves the scanner to the beginning of given array element: jumps to the nearest indexed one (or the first one if there is
+    no index), and scans the elements between them. Returns the array element count.
+    """
+    field_count = decode_prefix(scanner, plan.root, op)
+    if element >= field_count:
+        raise InputDataErrorException("Element {:d} of field \"{:s}\" requested, but there are only {:d}"
+                                      .format(element, op.name, max(field_count, 0)))
+    i = 0
+    if index is not None:
+        if index.count != field_count:
+            raise InputDataErrorException("The index is stale: it was built for {:d} elements of field \"{:s}\", now there are {:d}"
+                                          .format(index.count, op.name, field_count))
+        i, offset = index.lookup(element)
+        if offset < scanner.input_offset:
+            raise InputDataErrorException("The index is stale: element {:d} offset 0x{:x} precedes field \"{:s}\""
+                                          .format(i, offset, op.name))
+        scanner.skip(offset - scanner.input_offset)
+    while i < element:
+        scanner.scan_element(op, i)
+        i += 1
+    return field_count
+
+
+def parse_range(text: str) -> Tuple[int,Union[int,None]]:
+    """
+    Parses element range given as "A:B" (elements A..B-1), "A:" (elements from A to the end) or "A" (element A only).
+    """
+    first, colon, last = text.partition(":")
+    first = int(first) if first.strip() else 0
+    if colon:
+        last = int(last) if last.strip() else None
+    else:
+        last = first + 1
+    if (first < 0) or ((last is not None) and (last < first)):
+        raise ValueError("invalid element range: {:s}".format(text))
+    return first, last
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import abc
+import io
+import mmap
+import sys
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO
+
+STDIN_FILE_NAME = "-"                   # input file name meaning the standard input
+PIPE_READ_SIZE = 256*1024               # the minimum number of bytes read at once from non-seekable streams
+PIPE_LOOK_BACK_SIZE = 64*1024           # the number of already consumed bytes kept for going back in non-seekable streams
+
+
+class InputDataErrorException(ValueError):
+    pass
+
+
+class InputSource(abc.ABC):
+    """
+    Binary input data source used by the decoder. Besides sequential reading it allows peeking data without consuming it
+    and skipping data without reading it.
+    """
+
+    @abc.abstractmethod
+    def read(self, size: int):
+        """Returns up to size bytes (bytes-like object); less than size only if the end of data is reached."""
+        pass
+
+    @abc.abstractmethod
+    def peek(self, size: int):
+        """Same as read(), but does not move the current position."""
+        pass
+
+    @abc.abstractmethod
+    def skip(self, size: int):
+        """Moves the current position forward by size bytes."""
+        pass
+
+    @abc.abstractmethod
+    def tell(self) -> int:
+        pass
+
+    @abc.abstractmethod
+    def seek(self, position: int):
+        """Moves the current position to given absolute one (as returned by tell())."""
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class StreamInput(InputSource):
+    """
+    Input source reading data from seekable binary stream (file object, io.BytesIO).
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+
+    def read(self, size: int):
+        return self.stream.read(size)
+
+    def peek(self, size: int):
+        data = self.stream.read(size)
+        self.stream.seek(-len(data), io.SEEK_CUR)
+        return data
+
+    def skip(self, size: int):
+        self.stream.seek(size, io.SEEK_CUR)
+
+    def tell(self) -> int:
+        return self.stream.tell()
+
+    def seek(self, position: int):
+        self.stream.seek(position)
+
+
+class PipeInput(InputSource):
+    """
+    Input source reading data from non-seekable binary stream (a pipe, FIFO, the standard input). The data is read in large pieces
+    into a buffer that also keeps up to look_back_size bytes preceding the current position, so peeking never needs seek(),
+    and it is possible to go back a little. Skipping forward reads and discards the data; going back beyond the kept bytes
+    is not possible. The memory used is bounded by read_size, look_back_size and the largest peek size.
+    """
+
+    def __init__(self, stream: BinaryIO, offset: int = 0, read_size: int = PIPE_READ_SIZE, look_back_size: int = PIPE_LOOK_BACK_SIZE):
+        self.stream = stream
+        self.read_size = read_size
+        self.look_back_size = look_back_size
+        self._buffer = b""
+        self._position = 0      # the current position in the buffer
+        self._base = 0          # the stream position of the buffer beginning
+        self._eof = False
+        self.end = None         # the stream position of the end of data, once it is reached; skipping beyond it is not an error
+        if offset > 0:
+            self.skip(offset)
+
+    def _fill(self, size: int) -> int:
+        """
+        Reads data into the buffer until there are at least size bytes after the current position, or the end of data is reached.
+        Returns the number of bytes available after the current position.
+        """
+        available = len(self._buffer) - self._position
+        if self._eof:
+            return available
+        pieces = []
+        while (available < size) and not self._eof:
+            data = self.stream.read(max(size - available, self.read_size))
+            if not data:
+                self._eof = True
+            pieces.append(data)
+            available += len(data)
+        start = max(self._position - self.look_back_size, 0)       # the bytes before are no longer kept
+        self._buffer = self._buffer[start:] + b"".join(pieces)
+        self._base += start
+        self._position -= start
+        if self._eof:
+            self.end = self._base + len(self._buffer)
+        return available
+
+    def read(self, size: int):
+        position = self._position
+        end = position + size
+        if end > len(self._buffer):
+            size = min(size, self._fill(size))
+            position = self._position          # the buffer beginning might be dropped
+            end = position + size
+        self._position = end
+        return self._buffer[position:end]
+
+    def peek(self, size: int):
+        if self._position + size > len(self._buffer):
+            size = min(size, self._fill(size))
+        return self._buffer[self._position:self._position+size]
+
+    def skip(self, size: int):
+        available = len(self._buffer) - self._position
+        if size <= available:
+            self._position += size
+            return
+        remaining = size - available
+        while (remaining > 0) and not self._eof:       # like for files, it is legal to skip beyond the end of data
+            data = self.stream.read(min(remaining, self.read_size))
+            if not data:
+                self._eof = True
+                self.end = self._base + len(self._buffer) + (size - available - remaining)
+            remaining -= len(data)
+        self._base += len(self._buffer) + size - available
+        self._buffer = b""
+        self._position = 0
+
+    def tell(self) -> int:
+        return self._base + self._position
+
+    def seek(self, position: int):
+        if position >= self.tell():
+            self.skip(position - self.tell())
+        elif position >= self._base:
+            self._position = position - self._base
+        else:
+            raise InputDataErrorException("Cannot go back to position {:d} of non-seekable input; only {:d} preceding bytes are kept"
+                                          .format(position, self.look_back_size))
+
+    def read_remaining(self) -> bytes:
+        """Reads all the data up to the end of the stream."""
+        data = self._buffer[self._position:] + self.stream.read()
+        self._base += self._position + len(data)
+        self._buffer = b""
+        self._position = 0
+        self._eof = True
+        self.end = self._base
+        return data
+
+
+class MappedInput(InputSource):
+    """
+    Input source decoding data directly from memory mapped file. No system calls are necessary to read the data, and peeking returns
+    memoryview slices of the mapping, so large blocks may be decoded without copying them.
+    """
+
+    def __init__(self, file: BinaryIO, offset: int = 0):
+        self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self._mmap)
+        self.size = len(self.data)
+        file_name = getattr(file, "name", None)
+        self.file_name = file_name if isinstance(file_name, str) else None     # allows other processes to map the same file
+        self.start_offset = offset
+        self._mmap.seek(min(offset, self.size))
+        self.read = self._mmap.read         # the cursor is kept by mmap object; its read() is the fastest way to get small pieces of data
+        self.tell = self._mmap.tell
+
+    def read(self, size: int):
+        return self._mmap.read(size)
+
+    def peek(self, size: int):
+        position = self._mmap.tell()
+        return self.data[position:position+size]
+
+    def skip(self, size: int):
+        self._mmap.seek(min(self._mmap.tell() + size, self.size))     # like for files, it is legal to skip beyond the end of data
+
+    def tell(self) -> int:
+        return self._mmap.tell()
+
+    def seek(self, position: int):
+        self._mmap.seek(min(position, self.size))
+
+    def close(self):
+        self.read = None
+        self.tell = None
+        self.data.release()
+        try:
+            self._mmap.close()
+        except BufferError:         # some slices of the data are still referenced; the mapping will be closed when they are released
+            pass
+
+
+def open_input(file: BinaryIO, offset: int = 0) -> InputSource:
+    """
+    Creates the most efficient input source for given binary file opened for reading: memory mapped one if the file may be mapped,
+    otherwise the stream based one, or the buffered one if the file is not seekable. The file position is set to given offset.
+    """
+    try:
+        return MappedInput(file, offset)
+    except (OSError, ValueError, io.UnsupportedOperation):     # not a regular file (a pipe, a device), an empty file etc.
+        pass
+    if not file.seekable():
+        return PipeInput(file, offset)
+    if offset > 0:
+        file.seek(offset)
+    return StreamInput(file)
+
+
+def open_file(file_name: str) -> BinaryIO:
+    """
+    Opens given input file in binary mode; STDIN_FILE_NAME means the standard input (it is not closed with the returned file).
+    """
+    if file_name == STDIN_FILE_NAME:
+        return open(sys.stdin.fileno(), "rb", closefd=False)
+    return open(file_name, "rb")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import io
+import os
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO
+
+
+DEFAULT_BUFFER_SIZE = 256*1024     # in characters
+
+
+class BufferedOutput:
+    """
+    Text output collecting many small fragments in memory and passing them to the target stream in large chunks.
+    write() is the write method of underlying io.StringIO, so there is no per-fragment overhead; the buffer size is checked
+    by commit() calls which the writer is supposed to make at convenient points (e.g. after each record).
+    If the target is a text stream attached to a file or a pipe (not a terminal), encoded data is written directly to its binary buffer.
+    """
+
+    def __init__(self, target: TextIO, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.target = target
+        self.buffer_size = buffer_size
+        self._buffer = io.StringIO()
+        self.write = self._buffer.write
+        self._binary_target = None
+        self._encoding = None
+        self._errors = None
+
+        binary_target = getattr(target, "buffer", None)
+        if (binary_target is not None) and isinstance(getattr(target, "encoding", None), str):
+            try:
+                is_terminal = target.isatty()
+            except (ValueError, io.UnsupportedOperation):
+                is_terminal = True      # closed or strange stream; stay on the safe side
+            if not is_terminal:
+                self._binary_target = binary_target
+                self._encoding = target.encoding
+                self._errors = target.errors or "strict"
+
+    def write(self, s: str):
+        self._buffer.write(s)           # NOTE: replaced by the bound method of the buffer in __init__(); defined for documentation only
+
+    def commit(self):
+        """
+        Passes collected data to the target stream if the buffer is full.
+        """
+        if self._buffer.tell() >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        if len(data) == 0:
+            return
+        if self._binary_target is not None:
+            if os.linesep != "\n":
+                data = data.replace("\n", os.linesep)   # text stream would translate line breaks, so do it here
+            self.target.flush()                         # anything written to the text stream directly must go first
+            self._binary_target.write(data.encode(self._encoding, self._errors))
+        else:
+            self.target.write(data)
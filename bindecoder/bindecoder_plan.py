@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import fnmatch
+import struct
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO
+
+from . import bindecoder_fields as BF
+from .bindecoder_input import InputDataErrorException
+
+
+# Decode plan opcodes. Each field of every structure is translated (once, before processing starts) into one of them, so the type
+# dispatch, label width calculation and line prefix formatting do not need to be repeated for every decoded record.
+
+OP_SKIP = 0         # skip field; the count is the number of bytes to skip
+OP_VALUE = 1        # single non-structural value (count == 1 given explicitly)
+OP_ARRAY = 2        # an array of non-structural values (count given explicitly or calculated dynamically)
+OP_STRUCT = 3       # single structure or an array of structures
+OP_UNION = 4        # single union or an array of unions
+OP_VALUE_RUN = 5    # a run of subsequent single numeric values unpacked at once with precompiled struct.Struct
+OP_HIDDEN = 6       # subsequent fields excluded from presentation (see FieldSelection); skipped unless referred to by other fields
+
+
+class DecodeOp:
+    """
+    A single, precompiled decode plan instruction. Contains everything the interpreter needs to present one field.
+    """
+    __slots__ = ("opcode", "field", "name", "static_count", "joinable", "breaks_line", "label", "suffix", "size",
+                 "element_line_format", "block", "element_block", "variant_ops", "element_variant_ops",
+                 "members", "unpacker", "stores", "line_format", "bulk_array", "element_size")
+
+    def __init__(self, opcode: int, field: BF.FieldDef):
+        self.opcode = opcode
+        self.field = field
+        self.name = field.name
+        self.static_count = field.count if field.is_count_static() else None    # None: count calculated dynamically
+        self.joinable = False               # whether the field may be put in the same line as preceding one (oneline placement)
+        self.breaks_line = opcode in (OP_SKIP, OP_STRUCT, OP_UNION)     # whether the next field must start in a new line
+        self.label = None                   # "name: " label with precomputed width; single values only
+        self.suffix = ""                    # written after single value
+        self.size = getattr(field, "size", None)
+        self.element_line_format = None     # line header format for array elements (one nesting level deeper)
+        self.block = None                   # structure fields plan for single structure
+        self.element_block = None           # structure fields plan for structure array elements
+        self.variant_ops = None             # union variant ops (variant name -> op) for single union
+        self.element_variant_ops = None     # union variant ops (variant name -> op) for union array elements
+        self.members = None                 # OP_VALUE ops coalesced into OP_VALUE_RUN
+        self.unpacker = None                # struct.Struct unpacking all the values of OP_VALUE_RUN at once
+        self.stores = None                  # (index, store_value method) for OP_VALUE_RUN members referable by other fields
+        self.line_format = None             # line header format of the structure owning OP_VALUE_RUN
+        self.bulk_array = False             # whether OP_ARRAY elements are fixed-size numeric values that may be unpacked in bulk
+        self.element_size = None            # size of OP_STRUCT array element if it is known statically (no dynamic counts, no unions)
+
+
+def create_value_run_op(members: List[DecodeOp], line_format: str, padding: int = 0) -> DecodeOp:
+    """
+    Creates OP_VALUE_RUN op unpacking the values of given members, followed by given number of bytes that are skipped (the data of
+    subsequent fields excluded from presentation).
+    """
+    op = DecodeOp(OP_VALUE_RUN, members[0].field)
+    op.name = None
+    op.joinable = members[0].joinable
+    op.members = members
+    op.line_format = line_format
+
+    byteorder = "<"
+    for m in members:
+        if m.size > 1:
+            byteorder = m.field.struct_byteorder()
+            break
+    padding_code = "{:d}x".format(padding) if (padding > 0) else ""
+    op.unpacker = struct.Struct(byteorder + "".join(m.field.struct_code() for m in members) + padding_code)
+    op.size = op.unpacker.size
+    op.stores = tuple((i, m.field.store_value) for i,m in enumerate(members) if m.field.is_stored())
+    return op
+
+
+def stores_values(block: "DecodeBlock") -> bool:
+    """
+    Checks whether decoding the block may store values referred to by other fields.
+    """
+    for op in block.ops:
+        if op.opcode in (OP_VALUE, OP_ARRAY):
+            if op.field.is_stored():
+                return True
+        elif op.opcode == OP_VALUE_RUN:
+            if op.stores:
+                return True
+        elif op.opcode in (OP_STRUCT, OP_HIDDEN):
+            if any(stores_values(b) for b in (op.block, op.element_block) if b is not None):
+                return True
+        elif op.opcode == OP_UNION:
+            return True
+    return False
+
+
+def create_hidden_op(block: "DecodeBlock") -> DecodeOp:
+    op = DecodeOp(OP_HIDDEN, block.ops[0].field)
+    op.name = None
+    op.static_count = 1
+    op.block = block
+    op.size = static_block_size(block)     # None if it depends on decoded values
+    return op
+
+
+def static_block_size(block: "DecodeBlock") -> Union[int,None]:
+    """
+    Calculates the size of data described by the block, or returns None if it depends on decoded values.
+    """
+    size = 0
+    for op in block.ops:
+        if op.opcode in (OP_VALUE_RUN, OP_HIDDEN):
+            if op.size is None:
+                return None
+            size += op.size
+            continue
+        if (op.static_count is None) or (op.static_count < 0) or (op.opcode == OP_UNION):
+            return None
+        if op.opcode == OP_SKIP:
+            size += op.static_count
+        elif op.opcode == OP_STRUCT:
+            element_size = static_block_size(op.block if (op.static_count <= 1) else op.element_block)
+            if element_size is None:
+                return None
+            size += max(op.static_count, 1) * element_size      # a structure with count 0 is decoded once
+        elif op.opcode == OP_VALUE:
+            size += op.size
+        else:
+            size += op.static_count * op.size
+    return size
+
+
+class DecodeBlock:
+    """
+    Precompiled list of instructions for all fields of a structure presented at given nesting level.
+    """
+    __slots__ = ("structure", "level", "line_format", "ops", "single_run")
+
+    def __init__(self, structure: BF.StructFieldDef, level: int, line_format: str):
+        self.structure = structure
+        self.level = level
+        self.line_format = line_format      # "%" format of the standard line beginning: <line break> + <offset value> + <indent>
+        self.ops = []
+        self.single_run = None              # OP_VALUE_RUN op if it is the only one; such structures arrays are unpacked in bulk
+
+
+class DecodePlan:
+
+    def __init__(self, root: DecodeBlock, num_of_blocks: int):
+        self.root = root
+        self.num_of_blocks = num_of_blocks
+
+
+class FieldSelection:
+    """
+    Fields selected for presentation with dotted path patterns, e.g. "header.num_of_records" or "points.x". Path components are
+    names of fields (and union variants) starting from the root structure fields; array indices are not part of the path,
+    so "points.x" selects x of every points element. Each component may contain shell-style wildcards ("*", "?", "[...]").
+    A selected field is presented with all its contents, and structures on the path to it are presented with the selected fields
+    only. Unions are presented as a whole if any pattern refers to them or their contents.
+    """
+
+    EXCLUDED = 0
+    PARTIAL = 1             # some contents of the field are selected
+    SELECTED = 2
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = [tuple(p.strip().split(".")) for p in patterns if p.strip()]
+        self.matched = set()        # indices of patterns that selected some field (see unmatched_patterns())
+
+    @classmethod
+    def parse(cls, text: str) -> "FieldSelection":
+        """Creates selection of comma separated patterns."""
+        return cls(text.split(","))
+
+    def match(self, path: Tuple[str,...], whole: bool = False) -> int:
+        """
+        Checks whether the field of given path is selected, excluded, or only some of its contents are selected (unless
+        whole is set, then such field is treated as selected). The path is expected not to belong to already selected field.
+        """
+        state = self.EXCLUDED
+        for i, pattern in enumerate(self.patterns):
+            if (len(pattern) < len(path)) or not all(fnmatch.fnmatchcase(name, p) for name, p in zip(path, pattern)):
+                continue
+            if whole or (len(pattern) == len(path)):
+                self.matched.add(i)
+                state = self.SELECTED
+            elif state == self.EXCLUDED:
+                state = self.PARTIAL
+        return state
+
+    def unmatched_patterns(self) -> List[str]:
+        return [".".join(p) for i, p in enumerate(self.patterns) if i not in self.matched]
+
+
+def determine_field_label_width(structure: BF.StructFieldDef, fields: List[BF.FieldDef] = None) -> int:
+    """
+    Calculates common field width for all non-structural field types according to the field placement specified for the structure.
+    Only given fields (by default: all the structure fields) are taken into account.
+    """
+    field_label_width = 1   # 1 as field with passed to str.format() is always legal, and has no effect for non-empty strings
+    if structure.placement == BF.StructFieldDef.STRUCT_FIELD_PLACEMENT_ENUM.aligned:
+        for f in (fields if (fields is not None) else structure.fields.values()):
+            if (not f.is_structure()) and ((not f.is_union())) and (f.is_count_trivial_one()):
+                field_label_width = max(len(f.name), field_label_width)
+    return field_label_width
+
+
+def determine_trivial_field_suffix(structure: BF.StructFieldDef) -> str:
+    if structure.placement == BF.StructFieldDef.STRUCT_FIELD_PLACEMENT_ENUM.oneline:
+        return ";"
+    return ""
+
+
+class DecodePlanCompiler:
+    """
+    Translates the tree of field definitions into a decode plan: a set of flat instruction lists (one per structure and nesting level).
+    Blocks are shared, so a structure appearing many times at the same nesting level is compiled only once.
+    If field selection is given, each run of subsequent fields it excludes is compiled into a single OP_HIDDEN op.
+    """
+
+    def __init__(self, offset_width: int, initial_indent: int, indent_step: int, selection: FieldSelection = None):
+        self.offset_width = offset_width
+        self.initial_indent = initial_indent
+        self.indent_step = indent_step
+        self.selection = selection
+        self._blocks = {}
+
+    def line_format(self, level: int) -> str:
+        return "\n%0{:d}x{:s}".format(self.offset_width, " " * (self.initial_indent + (level * self.indent_step)))
+
+    def compile(self, root: BF.StructFieldDef) -> DecodePlan:
+        self._blocks = {}
+        if self.selection is None:
+            root_block = self.compile_block(root, 0)
+        else:
+            self.selection.matched.clear()
+            root_block = self.compile_block(root, 0, ())
+            unmatched = self.selection.unmatched_patterns()
+            if unmatched:
+                raise InputDataErrorException("No field matches selection pattern(s): {:s}".format(", ".join(unmatched)))
+        return DecodePlan(root_block, len(self._blocks))
+
+    def compile_block(self, structure: BF.StructFieldDef, level: int, path: Tuple[str,...] = None) -> DecodeBlock:
+        """
+        Compiles the structure fields; if the structure path is given, only the fields selected by field selection are presented.
+        """
+        key = (id(structure), level, path)
+        block = self._blocks.get(key)
+        if block is not None:
+            return block
+
+        block = DecodeBlock(structure, level, self.line_format(level))
+
+        fields = list(structure.fields.values())
+        field_paths = [None] * len(fields)          # path of each partially selected field, None for presented ones as a whole
+        hidden = [False] * len(fields)
+        if path is not None:
+            for i, f in enumerate(fields):
+                state = self.selection.match(path + (f.name,), whole=f.is_union())
+                if (state == FieldSelection.PARTIAL) and f.is_structure():
+                    field_paths[i] = path + (f.name,)
+                else:
+                    hidden[i] = state != FieldSelection.SELECTED
+
+        label_width = determine_field_label_width(structure, [f for f, h in zip(fields, hidden) if not h])
+        suffix = determine_trivial_field_suffix(structure)
+        oneline = structure.placement == BF.StructFieldDef.STRUCT_FIELD_PLACEMENT_ENUM.oneline
+
+        hidden_ops = []
+        for f, field_path, is_hidden in zip(fields, field_paths, hidden):
+            op = self.compile_field(f, level, label_width, suffix, field_path)
+            if is_hidden:
+                hidden_ops.append(op)
+                continue
+            if hidden_ops:
+                block.ops.append(self.compile_hidden_fields(structure, level, hidden_ops))
+                hidden_ops = []
+            # if one-line field placement is set then do not start a new line for subsequent field if it is a simple, single value
+            op.joinable = oneline and (op.opcode == OP_VALUE)
+            block.ops.append(op)
+        if hidden_ops:
+            block.ops.append(self.compile_hidden_fields(structure, level, hidden_ops))
+
+        block.ops = self.coalesce_value_runs(block.ops, block.line_format)
+        if (len(block.ops) == 1) and (block.ops[0].opcode == OP_VALUE_RUN):
+            block.single_run = block.ops[0]
+
+        self._blocks[key] = block
+        return block
+
+    def compile_hidden_fields(self, structure: BF.StructFieldDef, level: int, ops: List[DecodeOp]) -> DecodeOp:
+        block = DecodeBlock(structure, level, self.line_format(level))
+        block.ops = self.coalesce_value_runs(ops, block.line_format)
+        return create_hidden_op(block)
+
+    def compile_field(self, field: BF.FieldDef, level: int, label_width: int, suffix: str, path: Tuple[str,...] = None) -> DecodeOp:
+        """
+        Compiles a field presented at given nesting level (the level of the line the field starts in). The path is given only for
+        structures presented partially (see compile_block()).
+        """
+        if isinstance(field, BF.SkipFieldDef):
+            return DecodeOp(OP_SKIP, field)
+
+        if field.is_union():
+            op = DecodeOp(OP_UNION, field)
+            op.element_line_format = self.line_format(level+1)
+            if (op.static_count is None) or (op.static_count <= 1):
+                op.variant_ops = self.compile_variants(field, level, suffix)
+            if (op.static_count is None) or (op.static_count > 1):
+                op.element_variant_ops = self.compile_variants(field, level+1, suffix)
+            return op
+
+        if field.is_structure():
+            op = DecodeOp(OP_STRUCT, field)
+            op.element_line_format = self.line_format(level+1)
+            if (op.static_count is None) or (op.static_count <= 1):
+                op.block = self.compile_block(field, level+1, path)
+            if (op.static_count is None) or (op.static_count > 1):
+                op.element_block = self.compile_block(field, level+2, path)
+                op.element_size = static_block_size(op.element_block)
+            return op
+
+        if field.is_count_trivial_one():
+            op = DecodeOp(OP_VALUE, field)
+            op.label = "{:{}s} ".format(field.name+":", label_width+1)
+            op.suffix = suffix
+            return op
+
+        op = DecodeOp(OP_ARRAY, field)
+        op.element_line_format = self.line_format(level+1)
+        op.bulk_array = isinstance(field, BF.NumericTypeFieldDef) and (field.struct_code() is not None)
+        return op
+
+    @staticmethod
+    def is_value_packable(op: DecodeOp, byteorder: str) -> bool:
+        """
+        Checks whether single value may be unpacked together with other values of given byte order (None: any byte order).
+        """
+        if (op.opcode != OP_VALUE) or (not isinstance(op.field, BF.NumericTypeFieldDef)) or (op.field.struct_code() is None):
+            return False
+        return (byteorder is None) or (op.size == 1) or (op.field.struct_byteorder() == byteorder)
+
+    def coalesce_value_runs(self, ops: List[DecodeOp], line_format: str) -> List[DecodeOp]:
+        """
+        Replaces each run of subsequent fixed-size numeric single values having common byte order with a single OP_VALUE_RUN op.
+        Fixed-size fields excluded from presentation that follow such values (and store nothing) are skipped by the run as well.
+        """
+        result = []
+        run = []
+        byteorder = None
+
+        def flush_run(padding: int = 0):
+            if (len(run) > 1) or (run and padding):
+                result.append(create_value_run_op(list(run), line_format, padding))
+            else:
+                result.extend(run)
+            run.clear()
+
+        for op in ops:
+            if run and (op.opcode == OP_HIDDEN) and (op.size is not None) and not stores_values(op.block):
+                flush_run(op.size)
+                byteorder = None
+                continue
+            if not self.is_value_packable(op, byteorder):
+                flush_run()
+                byteorder = None
+                if not self.is_value_packable(op, None):
+                    result.append(op)
+                    continue
+            run.append(op)
+            if (byteorder is None) and (op.size > 1):
+                byteorder = op.field.struct_byteorder()
+        flush_run()
+        return result
+
+    def compile_variants(self, union: BF.UnionFieldDef, level: int, suffix: str) -> Dict[str,DecodeOp]:
+        # no name alignment for union fields; trivial field suffix is inherited from enclosing structure
+        return {name: self.compile_field(variant, level, 1, suffix) for name, variant in union.variants.items()}
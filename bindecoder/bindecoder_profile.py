@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import time
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO
+
+from . import bindecoder_input as BI
+from . import bindecoder_plan as BP
+
+# Statistics gathered in profiling mode (see ProfilingCore in the main program) per qualified field path, e.g. "lists.data" or
+# "values.VINT16" (union variant). Array indices are not a part of paths: all the elements of an array share the statistics.
+
+_OPCODE_KINDS = {BP.OP_SKIP: "skip", BP.OP_VALUE: "value", BP.OP_ARRAY: "array", BP.OP_STRUCT: "struct", BP.OP_UNION: "union",
+                 BP.OP_VALUE_RUN: "run", BP.OP_HIDDEN: "hidden"}
+
+
+class FieldProfile:
+    """
+    Statistics of a field; times in seconds:
+    - total_time:   time of presenting the field, including nested fields (structure members, union variants);
+    - self time:    total time less the time of nested fields; it is split into:
+      - read_time:      getting the data from the input source,
+      - decode_time:    converting the data into values (numbers, strings); for the elements of arrays presented one by one
+                        (not unpacked in bulk) it is not measured separately, but included in format time,
+      - trigger_time:   choosing union variants (evaluating triggers),
+      - format time:    the rest: presenting the values as text and writing it into the output buffer.
+    Count is the number of values or elements processed by all the calls; bytes include nested fields too.
+    """
+    __slots__ = ("path", "kind", "calls", "count", "bytes", "total_time", "child_time", "read_time", "decode_time", "trigger_time",
+                 "choices", "variant_hits")
+
+    def __init__(self, path: str, kind: str):
+        self.path = path
+        self.kind = kind
+        self.calls = 0
+        self.count = 0
+        self.bytes = 0
+        self.total_time = 0.0
+        self.child_time = 0.0
+        self.read_time = 0.0
+        self.decode_time = 0.0
+        self.trigger_time = 0.0
+        self.choices = 0                # union variants chosen
+        self.variant_hits = {}          # variant name -> the number of times it was chosen
+
+    def self_time(self) -> float:
+        return self.total_time - self.child_time
+
+    def format_time(self) -> float:
+        return max(0.0, self.self_time() - self.read_time - self.decode_time - self.trigger_time)
+
+    def to_dict(self) -> Dict[str,Any]:
+        d = {"path": self.path, "kind": self.kind, "calls": self.calls, "count": self.count, "bytes": self.bytes,
+             "total_s": round(self.total_time, 6), "self_s": round(self.self_time(), 6), "read_s": round(self.read_time, 6),
+             "decode_s": round(self.decode_time, 6), "format_s": round(self.format_time(), 6)}
+        if self.kind == "union":
+            d["trigger_s"] = round(self.trigger_time, 6)
+            d["choices"] = self.choices
+            d["variants"] = {name: {"hits": hits, "rate": round(hits / self.choices, 4)} for name, hits in self.variant_hits.items()}
+        return d
+
+
+class Profile:
+    """
+    Statistics of all the fields of decode plans (see add_block()). The statistics of the field being processed (the innermost one)
+    is the current one; the root one collects the time not attributed to any field.
+    """
+
+    def __init__(self):
+        self.root = FieldProfile("", "root")
+        self.current = self.root
+        self.entries = {}               # path -> FieldProfile
+        self.op_entries = {}            # id(op) -> FieldProfile; ops of different plan blocks (e.g. single and array element) may share it
+
+    def add_block(self, block: BP.DecodeBlock, prefix: str = ""):
+        """Adds the statistics of the fields of given decode plan block (e.g. the root one) and all the nested ones."""
+        for op in block.ops:
+            self.add_op(op, prefix)
+
+    def add_op(self, op: BP.DecodeOp, prefix: str):
+        if id(op) in self.op_entries:
+            return
+        path = prefix + op_label(op)
+        entry = self.entries.get(path)
+        if entry is None:
+            entry = self.entries[path] = FieldProfile(path, _OPCODE_KINDS[op.opcode])
+        self.op_entries[id(op)] = entry
+        if op.opcode == BP.OP_HIDDEN:
+            return                      # hidden fields are skipped as a whole
+        for block in (op.block, op.element_block):
+            if block is not None:
+                self.add_block(block, path + ".")
+        for variant_ops in (op.variant_ops, op.element_variant_ops):
+            for variant_op in (variant_ops or {}).values():
+                self.add_op(variant_op, path + ".")
+        for member in (op.members or ()):
+            self.add_op(member, prefix)     # run members are processed one by one at the end of data
+
+    def entry(self, op: BP.DecodeOp) -> FieldProfile:
+        return self.op_entries[id(op)]
+
+    def sorted_entries(self) -> List[FieldProfile]:
+        return sorted((e for e in self.entries.values() if e.calls > 0), key=lambda e: e.self_time(), reverse=True)
+
+    def to_dict(self) -> Dict[str,Any]:
+        return {"total_s": round(self.root.total_time, 6), "fields": [e.to_dict() for e in self.sorted_entries()]}
+
+    def write_report(self, dest_stream: TextIO):
+        """
+        Writes human readable report: fields sorted by self time, and union variants hit rates.
+        """
+        entries = self.sorted_entries()
+        width = max([len(e.path) for e in entries] + [len("field")])
+        dest_stream.write("\nPROFILE: {:.3f} s in total; self time of fields (total time less nested fields) is split into read, "
+                          "decode, trigger and format times\n".format(self.root.total_time))
+        header = "{:<{w}s}  {:>6s}  {:>10s}  {:>10s}  {:>12s}  {:>9s}  {:>9s}  {:>9s}  {:>9s}  {:>9s}  {:>9s}\n"
+        row = "{:<{w}s}  {:>6s}  {:>10d}  {:>10d}  {:>12d}  {:>9.3f}  {:>9.3f}  {:>9.3f}  {:>9.3f}  {:>9.3f}  {:>9.3f}\n"
+        dest_stream.write(header.format("field", "kind", "calls", "count", "bytes", "total", "self", "read", "decode", "trigger",
+                                        "format", w=width))
+        for e in entries:
+            dest_stream.write(row.format(e.path, e.kind, e.calls, e.count, e.bytes, e.total_time, e.self_time(), e.read_time,
+                                         e.decode_time, e.trigger_time, e.format_time(), w=width))
+
+        unions = [e for e in entries if e.choices > 0]
+        if unions:
+            dest_stream.write("\nunion variants (hits and hit rates of {:d} trigger evaluations):\n".format(sum(e.choices for e in unions)))
+        for e in unions:
+            dest_stream.write("{:s}: {:d} choices\n".format(e.path, e.choices))
+            for name, hits in sorted(e.variant_hits.items(), key=lambda item: item[1], reverse=True):
+                dest_stream.write("    {:<{w}s}  {:>10d}  {:>6.1%}\n".format(name, hits, hits / e.choices, w=width))
+
+
+def op_label(op: BP.DecodeOp) -> str:
+    """
+    Returns the name of the field of given op; runs of values and hidden fields are labelled with the names of all their fields.
+    """
+    if op.opcode == BP.OP_VALUE_RUN:
+        return "{" + ",".join(member.name for member in op.members) + "}"
+    if op.opcode == BP.OP_HIDDEN:
+        return "(hidden: " + ",".join(op_label(hidden_op) for hidden_op in op.block.ops) + ")"
+    return op.name
+
+
+class TimedInput(BI.InputSource):
+    """
+    Input source measuring the time spent in reading (peeking, skipping) the data of underlying one; the time is added to the read
+    time of the current field statistics. Other attributes (e.g. size) are the ones of the underlying source.
+    """
+
+    def __init__(self, source: BI.InputSource, profile: Profile):
+        self.source = source
+        self.profile = profile
+
+    def __getattr__(self, name: str):
+        return getattr(self.source, name)
+
+    def read(self, size: int):
+        start = time.perf_counter()
+        data = self.source.read(size)
+        self.profile.current.read_time += time.perf_counter() - start
+        return data
+
+    def peek(self, size: int):
+        start = time.perf_counter()
+        data = self.source.peek(size)
+        self.profile.current.read_time += time.perf_counter() - start
+        return data
+
+    def skip(self, size: int):
+        start = time.perf_counter()
+        self.source.skip(size)
+        self.profile.current.read_time += time.perf_counter() - start
+
+    def tell(self) -> int:
+        return self.source.tell()
+
+    def seek(self, position: int):
+        self.source.seek(position)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import json
+import os
+import sys
+import threading
+import time
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO,Callable
+
+# Progress of long-running decoding: the numbers of bytes and records processed so far, throughput and estimated time left.
+# It is reported periodically by a background thread sampling the position of decoding core (see BindecoderCore.progress()),
+# so decoding itself does not do anything for it.
+
+DEFAULT_INTERVAL = 1.0              # seconds between subsequent reports
+
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_INCOMPLETE = "incomplete"     # unexpected end of input data
+STATE_FAILED = "failed"
+
+
+class ProgressReporter:
+    """
+    Calls get_progress() (returning the numbers of bytes and records processed so far) every interval seconds and reports
+    the progress:
+    - as a human readable line (text_stream, e.g. the standard error); on a terminal the line is rewritten in place,
+    - as JSON status lines for job schedulers and other programs (json_stream),
+    - in JSON status file (status_file) replaced atomically with every report, so readers never see partially written one;
+      if it cannot be written, a warning is written to the standard error, and the status file is not used anymore.
+    Rates are average ones since start(). Percentage and ETA are reported only if the total size of data is known (not for pipes).
+    The last report is made by stop(), with the final state of processing.
+    """
+
+    def __init__(self, get_progress: Callable[[],Tuple[int,int]], total_size: int = None, text_stream: TextIO = None,
+                 json_stream: TextIO = None, status_file: str = None, interval: float = DEFAULT_INTERVAL):
+        self.get_progress = get_progress
+        self.total_size = total_size
+        self.text_stream = text_stream
+        self.json_stream = json_stream
+        self.status_file = status_file
+        self.interval = interval
+        self.start_time = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._line_length = 0           # the length of the last line written to a terminal
+        try:
+            self._terminal = (text_stream is not None) and text_stream.isatty()
+        except (ValueError, AttributeError):
+            self._terminal = False
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="bindecoder-progress", daemon=True)
+        self._thread.start()
+
+    def stop(self, state: str = STATE_DONE):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.report(state)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.report(STATE_RUNNING)
+
+    def status(self, state: str = STATE_RUNNING) -> Dict[str,Any]:
+        position, records = self.get_progress()
+        elapsed = time.monotonic() - self.start_time
+        bytes_per_s = position / elapsed if (elapsed > 0) else 0.0
+        status = {"state": state, "time": round(time.time(), 3), "elapsed_s": round(elapsed, 3), "bytes": position,
+                  "total_bytes": self.total_size, "percent": None, "records": records, "bytes_per_s": round(bytes_per_s, 1),
+                  "records_per_s": round(records / elapsed, 1) if (elapsed > 0) else 0.0, "eta_s": None}
+        if self.total_size:
+            status["percent"] = round(min(100.0, 100.0 * position / self.total_size), 2)
+            if state == STATE_RUNNING:
+                status["eta_s"] = round(max(0, self.total_size - position) / bytes_per_s, 1) if (bytes_per_s > 0) else None
+            else:
+                status["eta_s"] = 0.0
+        return status
+
+    def report(self, state: str = STATE_RUNNING):
+        status = self.status(state)
+        if self.text_stream is not None:
+            line = format_status(status)
+            if self._terminal:
+                self.text_stream.write("\r" + line.ljust(self._line_length) + ("\n" if (state != STATE_RUNNING) else ""))
+                self._line_length = len(line)
+            else:
+                self.text_stream.write(line + "\n")
+            self.text_stream.flush()
+        if self.json_stream is not None:
+            self.json_stream.write(json.dumps(status) + "\n")
+            self.json_stream.flush()
+        if self.status_file is not None:
+            temp_name = self.status_file + ".tmp"
+            try:
+                with open(temp_name, "w") as f:
+                    json.dump(status, f)
+                    f.write("\n")
+                os.replace(temp_name, self.status_file)
+            except OSError as e:
+                sys.stderr.write("warning: cannot write progress status file \"{:s}\" ({!s}); no more status updates\n"
+                                 .format(self.status_file, e))
+                self.status_file = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.stop(STATE_DONE)
+        else:
+            self.stop(STATE_INCOMPLETE if issubclass(exc_type, EOFError) else STATE_FAILED)
+
+
+def format_status(status: Dict[str,Any]) -> str:
+    """
+    Returns human readable progress line, e.g.:
+    "progress:  45.2%  1229.3 of 2720.0 MB  85.31 MB/s  120345 records/s  ETA 0:00:17"
+    """
+    line = "progress: "
+    if status["percent"] is not None:
+        line += "{:5.1f}%  {:.1f} of {:.1f} MB".format(status["percent"], status["bytes"] / 1e6, status["total_bytes"] / 1e6)
+    else:
+        line += "{:.1f} MB".format(status["bytes"] / 1e6)
+    line += "  {:.2f} MB/s  {:.0f} records/s".format(status["bytes_per_s"] / 1e6, status["records_per_s"])
+    if status["state"] != STATE_RUNNING:
+        line += "  {:s} in {:s}".format(status["state"], format_duration(status["elapsed_s"]))
+    elif status["eta_s"] is not None:
+        line += "  ETA {:s}".format(format_duration(status["eta_s"]))
+    return line
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    return "{:d}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
@@ -0,0 +1,939 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+from . import bindecoder as BD
+from . import bindecoder_api as BAPI
+from . import bindecoder_bench as BB
+from . import bindecoder_cache as BC
+from . import bindecoder_columnar as BCOL
+from . import bindecoder_expr as BE
+from . import bindecoder_fields as BF
+from . import bindecoder_index as BX
+from . import bindecoder_input as BI
+from . import bindecoder_output as BO
+from . import bindecoder_plan as BP
+from . import bindecoder_profile as BPR
+from . import bindecoder_progress as BPG
+from .generate_test_bin_files import DATASETS
+
+import argparse
+import contextlib
+import importlib
+import itertools
+import concurrent.futures
+import csv
+import io
+import json
+import os
+import pickle
+import sys
+import tempfile
+import unittest
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO
+
+MIN_PYTHON = (3,7)
+assert sys.version_info >= MIN_PYTHON, f"requires Python {'.'.join([str(n) for n in MIN_PYTHON])} or newer"
+assert __name__ == "__main__", "This script is intended to be run directly"
+
+TEST_FORMAT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_structures_format.json")
+
+
+# Expected outputs of processing test datasets (see generate_test_bin_files.py) with test_structures_format.json;
+# a line break is added at the end of each to keep the text readable
+
+EXPECTED_HEADER_AND_POINTS = """
+00000000  eyecatcher:    "EYECATCHER"
+0000000a  num_of_points: 6
+0000000e  points (count == 6):
+0000000e      points[0]:
+0000000e          x: 0x0101
+00000010          y: 0x1111
+00000012      points[1]:
+00000012          x: 0x0202
+00000014          y: 0x2222
+00000016      points[2]:
+00000016          x: 0x0303
+00000018          y: 0x3333
+0000001a      points[3]:
+0000001a          x: 0x0404
+0000001c          y: 0x4444
+0000001e      points[4]:
+0000001e          x: 0x0505
+00000020          y: 0x5555
+00000022      points[5]:
+00000022          x: 0x0606
+00000024          y: 0x6666
+00000026  footer:        "FOOTER"
+"""
+
+EXPECTED_LIST_OF_LISTS = """
+00000000  num_of_lists: 5
+00000002  lists (count == 5):
+00000002      lists[0]:
+00000002          length: 03;  eyecatcher: "AAAA1";  checksum: 0xaaaa;  timestamp: 2002-08-10 00:46:41;
+0000000e          data (count == 3):
+0000000e              00 01 02
+00000011      lists[1]:
+00000011          length: 00;  eyecatcher: "BBBB2";  checksum: 0xbbbb;  timestamp: 2002-08-10 00:46:42;
+0000001d          data (count == 0)
+0000001d      lists[2]:
+0000001d          length: 01;  eyecatcher: "CCCC3";  checksum: 0xcccc;  timestamp: 2002-08-10 00:46:43;
+00000029          data (count == 1):
+00000029              10
+0000002a      lists[3]:
+0000002a          length: 13;  eyecatcher: "DDDD4";  checksum: 0xdddd;  timestamp: 2002-08-10 00:46:44;
+00000036          data (count == 13):
+00000036              data[ 0]: 20 21 22 23 24 25
+0000003c              data[ 6]: 26 27 28 29 30 31
+00000042              data[12]: 32
+00000043      lists[4]:
+00000043          length: 06;  eyecatcher: "EEEE5";  checksum: 0xeeee;  timestamp: 2002-08-10 00:46:45;
+0000004f          data (count == 6):
+0000004f              30 31 32 33 34 35
+00000055  footer:       "FOOTER"
+"""
+
+EXPECTED_UNION_IN_UNION_NIGHTMARE = """
+00000000  num_of_values: 3
+00000001  values (count == 3):
+00000001      values[0].CHAMELEON.XY:
+00000003          x: 10
+00000004          y: 11
+0000000e      values[1].CHAMELEON.INT_ARR (count == 3):
+00000010          -0001; -32768; +0001;
+0000001b      values[2].VARINT3 (count == 3):
+0000001c          VARINT3[0].VINT16: 1111
+0000001f          VARINT3[1].VINT64: 2222222222222222
+00000028          VARINT3[2].VINT32: 33333333
+0000002f  footer:        "FOOTER"
+"""
+
+EXPECTED_VAR_INTEGERS_WITH_EXTENDED_SIZES = """
+00000000  num_of_values: 8
+00000001  values (count == 8):
+00000001      values[0].VINT8: 00
+00000005      values[1].VINT8: fc
+00000009      values[2].VINT16: 00fd
+0000000d      values[3].VINT16: ffff
+00000011      values[4].VINT32: 00010000
+00000019      values[5].VINT32: ffffffff
+00000021      values[6].VINT64: 0000000100000000
+0000002a      values[7].VINT64: ffffffffffffffff
+00000033  footer:        "FOOTER"
+"""
+
+# the last element is incomplete, so the processing stops after writing a separator preceding it
+EXPECTED_HEADER_AND_POINTS_WORD_DUMP = (
+    "\n00000000  data (count == 500000000000):"
+    "\n00000000      data[           0]: 0x5945 0x4345 0x5441 0x4843 0x5245 0x0006 0x0000 0x0101 0x1111 0x0202 0x2222 0x0303 0x3333 0x0404"
+    " 0x4444 0x0505"
+    "\n00000020      data[          16]: 0x5555 0x0606 0x6666 0x4f46 0x544f 0x5245 ")
+
+
+class Test(unittest.TestCase):
+
+    def _create_root_structure(self, struct_name: str) -> BF.StructFieldDef:
+        importlib.reload(BF)            # type definitions are global, so start from scratch each time
+        with open(TEST_FORMAT_FILE) as f:
+            fmt = BD.load_json_with_comments(f)
+        cfg_data = BD.load_json_with_comments(io.StringIO(BD.STANDARD_CONFIG))
+        return BD.create_root_structure(cfg_data, fmt, struct_name, use_config_typedefs=True)
+
+
+    def _decode(self, struct_name: str, data: bytes) -> str:
+        dest = io.StringIO()
+        BD.BindecoderCore().process(input_stream=io.BytesIO(data), output_stream=dest, dataset=self._create_root_structure(struct_name))
+        return dest.getvalue()
+
+
+    def _decode_ndjson(self, struct_name: str, data: bytes) -> str:
+        dest = io.StringIO()
+        BD.NdjsonCore().process(input_stream=io.BytesIO(data), output_stream=dest, dataset=self._create_root_structure(struct_name))
+        return dest.getvalue()
+
+
+    def test__decode_header_and_points(self):
+        self.assertEqual(self._decode("header_and_points", DATASETS["header_and_points"]) + "\n", EXPECTED_HEADER_AND_POINTS)
+
+
+    def test__decode_list_of_lists(self):
+        self.assertEqual(self._decode("list_of_lists", DATASETS["list_of_lists"]) + "\n", EXPECTED_LIST_OF_LISTS)
+
+
+    def test__decode_unions(self):
+        self.assertEqual(self._decode("union_in_union_nightmare", DATASETS["union_in_union_nightmare"]) + "\n",
+                         EXPECTED_UNION_IN_UNION_NIGHTMARE)
+        self.assertEqual(self._decode("var_integers_with_extended_sizes", DATASETS["var_integers_with_extended_sizes"]) + "\n",
+                         EXPECTED_VAR_INTEGERS_WITH_EXTENDED_SIZES)
+
+
+    def test__decode_unexpected_end_of_data(self):
+        root_struct = self._create_root_structure("uint16_dump")
+        dest = io.StringIO()
+        with self.assertRaises(EOFError):
+            BD.BindecoderCore().process(input_stream=io.BytesIO(DATASETS["header_and_points"]), output_stream=dest, dataset=root_struct)
+        self.assertEqual(dest.getvalue(), EXPECTED_HEADER_AND_POINTS_WORD_DUMP)
+
+
+    def test__decode_value_runs(self):
+        root_struct = self._create_root_structure("endian_test")
+        plan = BD.BindecoderCore.compile_plan(root_struct)
+
+        # timestamps break the runs
+        self.assertEqual([op.opcode for op in plan.root.ops],
+                         [BP.OP_VALUE_RUN, BP.OP_VALUE, BP.OP_VALUE, BP.OP_VALUE_RUN, BP.OP_VALUE, BP.OP_VALUE])
+        self.assertEqual(plan.root.ops[0].unpacker.format, "<QqIiHhfd")
+        self.assertEqual(plan.root.ops[3].unpacker.format, "<QqIiHhfd")
+
+        # the end of data in the middle of the run is reported after the last complete value
+        dest = io.StringIO()
+        with self.assertRaises(EOFError):
+            BD.BindecoderCore().process(input_stream=io.BytesIO(DATASETS["endian_test"][:20]), output_stream=dest, dataset=root_struct)
+        self.assertEqual(dest.getvalue(),
+                         "\n00000000  uint64_le:   0807060504030201"
+                         "\n00000008  int64_le:   -7fffffffffffffff"
+                         "\n00000010  uint32_le:   04030201"
+                         "\n00000014  int32_le:   ")
+
+        # values of different byte order are unpacked separately; single bytes fit everywhere
+        fields = {}
+        BF.create_fields(name="mixed", add_fields_as_top_level_definitions=False, fields=fields, structure_field_defs=
+                         {
+                             "a":{"base":"uint16", "endian":"little"},
+                             "b":{"base":"uint8"},
+                             "c":{"base":"int16", "endian":"little"},
+                             "d":{"base":"int32", "endian":"big"},
+                             "e":{"base":"int8"},
+                             "f":{"base":"float64", "endian":"big"},
+                             "g":{"base":"uint8"}
+                         })
+        mixed = BF.StructFieldDef("mixed")
+        mixed.fields = fields
+        plan = BD.BindecoderCore.compile_plan(mixed)
+        self.assertEqual([op.unpacker.format for op in plan.root.ops], ["<HBh", ">ibdB"])
+
+        dest = io.StringIO()
+        BD.BindecoderCore().process(input_stream=io.BytesIO(bytes.fromhex("0100 02 feff 00000003 fc 3ff0000000000000 05")),
+                                    output_stream=dest, dataset=mixed)
+        self.assertEqual(dest.getvalue(),
+                         "\n00000000  a: 0x0001"
+                         "\n00000002  b: 0x02"
+                         "\n00000003  c:     -2"
+                         "\n00000005  d:          +3"
+                         "\n00000009  e:   -4"
+                         "\n0000000a  f: 1.000000"
+                         "\n00000012  g: 0x05")
+
+        # the end of data inside structure array elements unpacked in bulk
+        root_struct = self._create_root_structure("header_and_points")
+        dest = io.StringIO()
+        with self.assertRaises(EOFError):
+            BD.BindecoderCore().process(input_stream=io.BytesIO(DATASETS["header_and_points"][:20]), output_stream=dest, dataset=root_struct)
+        self.assertEqual(dest.getvalue() + "\n", EXPECTED_HEADER_AND_POINTS[:EXPECTED_HEADER_AND_POINTS.index("00000014")] +
+                         "00000014          y: \n")
+
+
+    def test__decode_numeric_arrays_in_bulk(self):
+        self._create_root_structure("header_and_points")
+        fields = {}
+        BF.create_fields(name="arrays", add_fields_as_top_level_definitions=False, fields=fields, structure_field_defs=
+                         {
+                             "n":{"base":"uint8"},
+                             "w":{"base":"uint16", "endian":"big", "count":"n", "wrap_at":4, "separator":","},
+                             "f":{"base":"float32", "endian":"little", "count":2}
+                         })
+        arrays = BF.StructFieldDef("arrays")
+        arrays.fields = fields
+        plan = BD.BindecoderCore.compile_plan(arrays)
+        self.assertEqual([op.bulk_array for op in plan.root.ops], [False, True, True])
+
+        data = bytes.fromhex("06 0001 0002 0003 0004 0005 fffe 0000803f 000000c0")
+        expected = ("\n00000000  n: 0x06"
+                    "\n00000001  w (count == 6):"
+                    "\n00000001      w[0]: 0x0001,0x0002,0x0003,0x0004"
+                    "\n00000009      w[4]: 0x0005,0xfffe"
+                    "\n0000000d  f (count == 2):"
+                    "\n0000000d      1.000000 -2.000000")
+        default_bulk_read_size = BD.BULK_READ_SIZE
+        try:
+            for bulk_read_size in (default_bulk_read_size, 6, 1):       # chunks of whole lines, parts of lines, single elements
+                BD.BULK_READ_SIZE = bulk_read_size
+                dest = io.StringIO()
+                core = BD.BindecoderCore()
+                core.process(input_stream=io.BytesIO(data), output_stream=dest, dataset=arrays)
+                self.assertEqual(dest.getvalue(), expected)
+                self.assertEqual(core.namespace["n"], 6)
+
+                # the end of data in the middle of the line is reported exactly where it is detected
+                dest = io.StringIO()
+                with self.assertRaises(EOFError):
+                    BD.BindecoderCore().process(input_stream=io.BytesIO(data[:12]), output_stream=dest, dataset=arrays)
+                self.assertEqual(dest.getvalue(), expected[:expected.index("0xfffe")])
+        finally:
+            BD.BULK_READ_SIZE = default_bulk_read_size
+
+        self.assertEqual(fields["w"].unpack_array(data[1:5], 2), [1, 2])
+        self.assertEqual(fields["f"].unpack_array(memoryview(data)[13:], 2), [1.0, -2.0])
+
+
+    def test__expressions(self):
+        namespace = {"n":5, "m":2, "RAW":b"\xfd\x01"}
+        for source, expected in (("n", 5), ("7", 7), ("n*m+1", 11), ("-n", -5), ("n//m if m else 0", 2), ("RAW[0]==0xFD", True),
+                                 ("RAW[0]==0xFD and RAW[1]<1", False), ("RAW[0]!=0xFD or RAW[1]", 1), ("1<=n<10", True)):
+            expression = BE.Expression(source)
+            self.assertTrue(expression.is_lowered, source)
+            self.assertEqual(expression(namespace), expected, source)
+            self.assertEqual(expression.evaluate(namespace), eval(source, {}, namespace), source)
+
+        expression = BE.Expression("max(n,m)*len(RAW)")      # builtins are not resolved by lowered code
+        self.assertFalse(expression.is_lowered)
+        self.assertEqual(expression.evaluate(namespace), 10)
+        self.assertEqual(expression.names, {"max", "n", "m", "len", "RAW"})
+
+        self.assertFalse(BE.Expression("[x for x in RAW][0]").is_lowered)
+
+        expression = BE.Expression("n + missing")
+        with self.assertRaises(NameError):
+            expression.evaluate(namespace)
+
+        with self.assertRaises(SyntaxError):
+            BE.Expression("n +")
+
+        expression = pickle.loads(pickle.dumps(BE.Expression("RAW[1]*n", "test")))
+        self.assertEqual(expression, BE.Expression("RAW[1]*n"))
+        self.assertEqual(expression.evaluate(namespace), 5)
+
+
+    def test__format_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = BC.FormatCache(os.path.join(tmp_dir, "cache"))
+            key = cache.make_key(BD.STANDARD_CONFIG, "{}", "union_in_union_nightmare")
+            self.assertNotEqual(key, cache.make_key(BD.STANDARD_CONFIG, "{}", "header_and_points"))
+            self.assertNotEqual(cache.make_key("ab", "c"), cache.make_key("a", "bc"))
+            self.assertIsNone(cache.load(key))
+
+            root_struct = self._create_root_structure("union_in_union_nightmare")
+            self.assertTrue(cache.store(key, root_struct))
+            importlib.reload(BF)        # cached definitions must not depend on the global state of fields module
+            cached_root_struct = cache.load(key)
+            self.assertIsInstance(cached_root_struct, BF.StructFieldDef)
+
+            dest = io.StringIO()
+            BD.BindecoderCore().process(input_stream=io.BytesIO(DATASETS["union_in_union_nightmare"]), output_stream=dest,
+                                        dataset=cached_root_struct)
+            self.assertEqual(dest.getvalue() + "\n", EXPECTED_UNION_IN_UNION_NIGHTMARE)
+
+            with open(cache.entry_path(key), "wb") as f:
+                f.write(b"garbage")
+            self.assertIsNone(cache.load(key), "corrupted entry is ignored")
+
+
+    def test__ndjson_output(self):
+        root_struct = self._create_root_structure("header_and_points")
+        dest = io.StringIO()
+        BD.NdjsonCore().process(input_stream=io.BytesIO(DATASETS["header_and_points"]), output_stream=dest, dataset=root_struct)
+        lines = dest.getvalue().splitlines()
+        self.assertEqual(len(lines), 9)
+        self.assertEqual(lines[0], '{"offset":0,"field":"eyecatcher","value":"EYECATCHER"}')
+        self.assertEqual(json.loads(lines[1]), {"offset":10, "field":"num_of_points", "value":6})
+        self.assertEqual(json.loads(lines[7]), {"offset":34, "field":"points", "index":5, "value":{"x":1542, "y":26214}})
+        self.assertEqual(json.loads(lines[8]), {"offset":38, "field":"footer", "value":"FOOTER"})
+
+        records = [json.loads(line) for line in self._decode_ndjson("list_of_lists", DATASETS["list_of_lists"]).splitlines()]
+        self.assertEqual(records[4], {"offset":42, "field":"lists", "index":3, "value":
+                                      {"length":13, "eyecatcher":"DDDD4", "checksum":56797, "timestamp":"2002-08-10T00:46:44+01:00",
+                                       "data":[32,33,34,35,36,37,38,39,40,41,48,49,50]}})
+
+        records = [json.loads(line) for line in self._decode_ndjson("union_in_union_nightmare",
+                                                                    DATASETS["union_in_union_nightmare"]).splitlines()]
+        self.assertEqual([r["value"] for r in records[1:4]],
+                         [{"CHAMELEON":{"XY":{"x":16, "y":17}}},
+                          {"CHAMELEON":{"INT_ARR":[-1, -32768, 1]}},
+                          {"VARINT3":[{"VINT16":4369}, {"VINT64":2459565876494606882}, {"VINT32":858993459}]}])
+
+        # complete records are written before the end of data is detected; dumps are presented up to the last value
+        root_struct = self._create_root_structure("header_and_points")
+        dest = io.StringIO()
+        with self.assertRaises(EOFError):
+            BD.NdjsonCore().process(input_stream=io.BytesIO(DATASETS["header_and_points"][:20]), output_stream=dest, dataset=root_struct)
+        self.assertEqual(len(dest.getvalue().splitlines()), 3)
+
+        dest = io.StringIO()
+        with self.assertRaises(EOFError):
+            BD.NdjsonCore().process(input_stream=io.BytesIO(bytes(range(40))), output_stream=dest,
+                                    dataset=self._create_root_structure("uint8_dump"))
+        self.assertEqual([json.loads(line) for line in dest.getvalue().splitlines()],
+                         [{"offset":0, "field":"data", "index":0, "value":list(range(32))},
+                          {"offset":32, "field":"data", "index":32, "value":list(range(32, 40))}])
+
+
+    def test__columnar_export(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, "lists.csv")
+            dest = io.StringIO()
+            BD.ColumnarExportCore(file_name).process(input_stream=io.BytesIO(DATASETS["list_of_lists"]), output_stream=dest,
+                                                      dataset=self._create_root_structure("list_of_lists"))
+            self.assertEqual(dest.getvalue(), "5 rows exported to \"{:s}\"\n".format(file_name))
+            with open(file_name, newline="", encoding="utf-8") as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(rows[0], ["length", "eyecatcher", "checksum", "timestamp", "data"])
+            self.assertEqual(rows[4], ["13", "DDDD4", "56797", "2002-08-10T00:46:44+01:00", "[32,33,34,35,36,37,38,39,40,41,48,49,50]"])
+            self.assertEqual(len(rows), 6)
+
+            # rows are written in batches; those decoded before the end of data is detected are not lost
+            plan = BD.BindecoderCore.compile_plan(self._create_root_structure("header_and_points"))
+            exporter = BCOL.ColumnarExporter(file_name, "points", batch_size=4)
+            with self.assertRaises(EOFError):
+                exporter.process(io.BytesIO(DATASETS["header_and_points"][:32]), plan)
+            self.assertEqual(exporter.num_of_rows, 4)
+            with open(file_name, newline="", encoding="utf-8") as f:
+                self.assertEqual(list(csv.reader(f)), [["x", "y"], ["257", "4369"], ["514", "8738"], ["771", "13107"], ["1028", "17476"]])
+
+            with self.assertRaises(BD.InputDataErrorException):
+                BCOL.ColumnarExporter(file_name, "footer").select_op(plan)
+            with self.assertRaises(BD.InputDataErrorException):
+                BCOL.ColumnarExporter(os.path.join(tmp_dir, "points.xlsx"))
+            if BCOL.pyarrow is None:
+                with self.assertRaises(BD.InputDataErrorException):
+                    BCOL.ColumnarExporter(os.path.join(tmp_dir, "points.parquet"))
+
+
+    def test__record_index(self):
+        data = DATASETS["list_of_lists"]
+        plan = BD.BindecoderCore.compile_plan(self._create_root_structure("list_of_lists"))
+        index = BX.build_index(io.BytesIO(data), plan, stride=2, input_size=len(data))
+        self.assertEqual((index.field_name, index.count, list(index.offsets)), ("lists", 5, [0x02, 0x1d, 0x43]))
+        self.assertEqual(index.lookup(3), (2, 0x1d))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, "list_of_lists.bin" + BX.INDEX_FILE_EXTENSION)
+            index.save(file_name)
+            index = BX.RecordIndex.load(file_name)
+        self.assertEqual((index.field_name, index.count, index.stride, list(index.offsets), index.input_size),
+                         ("lists", 5, 2, [0x02, 0x1d, 0x43], len(data)))
+        with self.assertRaises(BD.InputDataErrorException):
+            index.check_input(0, len(data) + 1)
+
+        # truncated input: the warning instead of an index
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, "trunc_lists.bin")
+            with open(file_name, "wb") as f:
+                f.write(data[:0x50])
+            with open(file_name, "rb") as f, BI.open_input(f) as input_source:
+                with self.assertRaises(EOFError):
+                    BX.build_index(input_source, plan)
+            args = argparse.Namespace(input_file=file_name, input_offset=0, index=None, build_index=True, index_field=None,
+                                      index_stride=1)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+                BD.process_indexed_array(args, self._create_root_structure("list_of_lists"))
+            self.assertEqual(output.getvalue(), "\nWARNING: Unexpected end of input data.\n")
+            self.assertFalse(os.path.exists(file_name + BX.INDEX_FILE_EXTENSION))
+
+        # the elements presented alone look exactly like in the whole structure presentation
+        expected_lines = EXPECTED_LIST_OF_LISTS.splitlines()
+        element_lines = [i for i, line in enumerate(expected_lines) if line.endswith("]:") and "  lists[" in line]
+        for first, last, use_index in ((3, 4, True), (1, 5, True), (3, None, False), (0, 2, False)):
+            dest = io.StringIO()
+            BD.BindecoderCore().process_elements(input_stream=io.BytesIO(data), output_stream=dest,
+                                                 dataset=self._create_root_structure("list_of_lists"), first=first, last=last,
+                                                 index=index if use_index else None)
+            start = element_lines[first]
+            end = element_lines[last] if (last is not None) and (last < 5) else len(expected_lines) - 1    # without the footer
+            self.assertEqual(dest.getvalue().splitlines()[1:], expected_lines[start:end])
+
+        with self.assertRaises(BD.InputDataErrorException):
+            BD.BindecoderCore().process_elements(input_stream=io.BytesIO(data), output_stream=io.StringIO(),
+                                                 dataset=self._create_root_structure("list_of_lists"), first=5)
+        self.assertEqual(BX.parse_range("2:7"), (2, 7))
+        self.assertEqual(BX.parse_range("2:"), (2, None))
+        self.assertEqual(BX.parse_range("4"), (4, 5))
+        with self.assertRaises(ValueError):
+            BX.parse_range("7:2")
+
+
+    def test__decode_mapped_input(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, "data.bin")
+            with open(file_name, "wb") as f:
+                f.write(b"\xAA\xBB" + DATASETS["var_integers_with_extended_sizes"])
+
+            root_struct = self._create_root_structure("var_integers_with_extended_sizes")
+            with open(file_name, "rb") as f, BI.open_input(f, offset=2) as input_source:
+                self.assertIsInstance(input_source, BI.MappedInput)
+                self.assertEqual(bytes(input_source.peek(2)), b"\x08\x00")
+                dest = io.StringIO()
+                BD.BindecoderCore().process(input_stream=input_source, output_stream=dest, dataset=root_struct)
+                self.assertEqual(dest.getvalue() + "\n", EXPECTED_VAR_INTEGERS_WITH_EXTENDED_SIZES)
+                self.assertEqual(input_source.read(1), b"")
+
+                input_source.skip(1000)     # skipping beyond the end of data is legal, but nothing can be read then
+                self.assertEqual(input_source.read(1), b"")
+
+            with open(file_name, "wb") as f:
+                pass
+            with open(file_name, "rb") as f, BI.open_input(f) as input_source:
+                self.assertIsInstance(input_source, BI.StreamInput, "empty file cannot be mapped")
+
+        self.assertIsInstance(BI.open_input(io.BytesIO(b"")), BI.StreamInput)
+
+
+    def test__decode_pipe_input(self):
+        class Pipe(io.RawIOBase):       # a non-seekable stream returning data in small pieces
+            def __init__(self, data: bytes):
+                self.data = data
+            def readable(self):
+                return True
+            def readinto(self, buffer):
+                n = min(len(buffer), 3, len(self.data))
+                buffer[:n] = self.data[:n]
+                self.data = self.data[n:]
+                return n
+
+        for struct_name, expected in (("list_of_lists", EXPECTED_LIST_OF_LISTS),
+                                      ("union_in_union_nightmare", EXPECTED_UNION_IN_UNION_NIGHTMARE)):
+            input_source = BI.open_input(io.BufferedReader(Pipe(DATASETS[struct_name]), 4), offset=0)
+            self.assertIsInstance(input_source, BI.PipeInput)
+            input_source.read_size = 7      # union variants and arrays are peeked across the buffer boundaries
+            input_source.look_back_size = 5
+            dest = io.StringIO()
+            BD.BindecoderCore().process(input_stream=input_source, output_stream=dest, dataset=self._create_root_structure(struct_name))
+            self.assertEqual(dest.getvalue() + "\n", expected)
+
+        input_source = BI.PipeInput(Pipe(bytes(range(100))), offset=10, read_size=16, look_back_size=8)
+        self.assertEqual((input_source.read(4), input_source.peek(20)), (bytes(range(10, 14)), bytes(range(14, 34))))
+        input_source.skip(30)
+        self.assertEqual(input_source.read(2), bytes([44, 45]))
+        input_source.seek(44)                               # going back within the kept bytes
+        self.assertEqual(input_source.read(1), bytes([44]))
+        with self.assertRaises(BD.InputDataErrorException):
+            input_source.seek(20)
+        self.assertEqual(input_source.read_remaining(), bytes(range(45, 100)))
+        input_source.skip(10)                               # skipping beyond the end of data is legal, but nothing can be read then
+        self.assertEqual((input_source.tell(), input_source.read(1)), (110, b""))
+        self.assertEqual(input_source.end, 100)
+        input_source = BI.PipeInput(Pipe(bytes(50)), offset=10, read_size=16)
+        input_source.skip(70)
+        self.assertEqual((input_source.tell(), input_source.end), (80, 50))
+
+        # the pre-scan detects skipping beyond the end of data although the size of the data is not known in advance
+        plan = BD.BindecoderCore.compile_plan(self._create_root_structure("list_of_lists"))
+        with self.assertRaises(EOFError):
+            BX.build_index(BI.PipeInput(Pipe(DATASETS["list_of_lists"][:0x50])), plan)
+        scanner = BX.OffsetScanner(BI.PipeInput(Pipe(DATASETS["list_of_lists"][:0x50])), BF.referenced_names(plan.root.structure))
+        lists = plan.root.ops[1]
+        self.assertEqual(BX.decode_prefix(scanner, plan.root, lists), 5)
+        for i in range(4):
+            scanner.scan_element(lists, i)
+        with self.assertRaises(EOFError):
+            scanner.scan_element(lists, 4)
+
+
+    def test__namespace_scopes(self):
+        root_struct = self._create_root_structure("list_of_lists")
+        self.assertEqual(BF.referenced_names(root_struct), {"num_of_lists", "length"})
+        core = BD.BindecoderCore()
+        core.process(input_stream=io.BytesIO(DATASETS["list_of_lists"]), output_stream=io.StringIO(), dataset=root_struct)
+        self.assertEqual(core.namespace, {"num_of_lists":5, "length":6}, "only referenced values are stored")
+        self.assertNotIn("length", root_struct.namespace, "decoding sessions do not use the default namespace")
+
+        # sessions running concurrently in many threads do not interfere, even if they share the definitions
+        datasets = []
+        for k in range(4):
+            data = bytearray((1000).to_bytes(2, "little"))
+            for i in range(1000):
+                length = (i * 7 + k) % 23
+                data += bytes([length]) + b"E%04d" % i + bytes(6) + bytes(range(length))
+            datasets.append(bytes(data) + b"FOOTER")
+
+        def decode(data: bytes) -> str:
+            dest = io.StringIO()
+            BD.BindecoderCore().process(input_stream=io.BytesIO(data), output_stream=dest, dataset=root_struct)
+            return dest.getvalue()
+
+        expected = [decode(data) for data in datasets]
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(datasets)) as executor:
+                self.assertEqual(list(executor.map(decode, datasets)), expected)
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+
+    def test__field_selection(self):
+        def decode(struct_name: str, patterns: str, core_class: type = BD.BindecoderCore) -> str:
+            dest = io.StringIO()
+            core_class(selection=BP.FieldSelection.parse(patterns)).process(
+                input_stream=io.BytesIO(DATASETS[struct_name]), output_stream=dest, dataset=self._create_root_structure(struct_name))
+            return dest.getvalue()
+
+        # the lengths are not presented, but still used to find the lists data
+        lines = decode("list_of_lists", "lists.eyecatcher,lists.data").splitlines()
+        expected_lines = EXPECTED_LIST_OF_LISTS.splitlines()
+        self.assertEqual(lines[1:3], expected_lines[2:4])
+        self.assertEqual(lines[3], '00000003          eyecatcher: "AAAA1";')
+        self.assertEqual(lines[-4:], expected_lines[-5:-4] + ['00000044          eyecatcher: "EEEE5";'] + expected_lines[-3:-1])
+        self.assertNotIn("length", "".join(lines))
+
+        # hidden fixed-size fields are skipped by value runs, so arrays of such structures are still unpacked in bulk
+        root_struct = self._create_root_structure("header_and_points")
+        plan = BD.BindecoderCore.compile_plan(root_struct, BP.FieldSelection.parse("points.x"))
+        self.assertEqual([op.opcode for op in plan.root.ops], [BP.OP_HIDDEN, BP.OP_STRUCT, BP.OP_HIDDEN])
+        self.assertEqual(plan.root.ops[0].size, 14)
+        points = plan.root.ops[1]
+        self.assertEqual(points.element_block.single_run.unpacker.format, "<H2x")
+        self.assertEqual(decode("header_and_points", "points.x").splitlines()[1:],
+                         [line for line in EXPECTED_HEADER_AND_POINTS.splitlines() if (" points" in line) or (" x: " in line)])
+
+        records = [json.loads(line) for line in decode("list_of_lists", "num*,lists.*sum", BD.NdjsonCore).splitlines()]
+        self.assertEqual(records[0], {"offset":0, "field":"num_of_lists", "value":5})
+        self.assertEqual(records[4], {"offset":42, "field":"lists", "index":3, "value":{"checksum":56797}})
+        self.assertEqual(len(records), 6)
+
+        with self.assertRaises(BD.InputDataErrorException):
+            decode("list_of_lists", "lists.checksum,lists.nothing")
+
+
+    def test__profiling(self):
+        def profile(struct_name: str, patterns: str = None) -> Dict[str,BPR.FieldProfile]:
+            dest = io.StringIO()
+            core = BD.ProfilingCore(selection=patterns and BP.FieldSelection.parse(patterns))
+            core.process(input_stream=io.BytesIO(DATASETS[struct_name]), output_stream=dest, dataset=self._create_root_structure(struct_name))
+            self.assertEqual(dest.getvalue(), decode(struct_name, patterns), "profiling does not change the output")
+            return core.profile
+
+        def decode(struct_name: str, patterns: str = None) -> str:
+            dest = io.StringIO()
+            BD.BindecoderCore(selection=patterns and BP.FieldSelection.parse(patterns)).process(
+                input_stream=io.BytesIO(DATASETS[struct_name]), output_stream=dest, dataset=self._create_root_structure(struct_name))
+            return dest.getvalue()
+
+        entries = profile("list_of_lists").entries
+        self.assertEqual([(entries[path].calls, entries[path].count, entries[path].bytes) for path in ("lists", "lists.length", "lists.data")],
+                         [(1, 5, 0x53), (5, 5, 5), (5, 23, 23)])
+        self.assertGreater(entries["lists.data"].decode_time, 0.0, "unpacked in bulk")
+
+        result = profile("var_integers_with_extended_sizes")
+        values = result.entries["values"]
+        self.assertEqual((values.calls, values.count, values.choices), (1, 8, 8))
+        self.assertEqual(values.variant_hits, {"VINT8": 2, "VINT16": 2, "VINT32": 2, "VINT64": 2})
+        self.assertEqual(result.entries["values.VINT64"].bytes, 2 * 8, "prefix bytes (0xFF) are skipped by the union")
+        self.assertGreaterEqual(values.total_time, values.child_time)
+        self.assertEqual(result.to_dict()["fields"][0]["path"], result.sorted_entries()[0].path)
+        self.assertEqual(json.loads(json.dumps(result.to_dict()))["total_s"], round(result.root.total_time, 6))
+        report = io.StringIO()
+        result.write_report(report)
+        self.assertIn("values: 8 choices", report.getvalue())
+
+        # value runs and the fields skipped as a whole
+        entries = profile("header_and_points", "points.x").entries
+        self.assertEqual((entries["points.{x}"].count, entries["points.{x}"].bytes), (6, 24))
+        self.assertEqual(entries["(hidden: eyecatcher,num_of_points)"].bytes, 14)
+
+
+    def test__progress_reporting(self):
+        # records are the elements of top-level arrays of structures and unions (NDJSON: objects)
+        for struct_name, core_class, expected in (("list_of_lists", BD.BindecoderCore, (0x5b, 5)),
+                                                  ("header_and_points", BD.BindecoderCore, (0x2c, 6)),
+                                                  ("union_in_union_nightmare", BD.BindecoderCore, (0x35, 3)),
+                                                  ("list_of_lists", BD.NdjsonCore, (0x5b, 7))):
+            core = core_class()
+            self.assertEqual(core.progress(), (0, 0))
+            core.process(input_stream=io.BytesIO(DATASETS[struct_name]), output_stream=io.StringIO(),
+                         dataset=self._create_root_structure(struct_name))
+            self.assertEqual(core.progress(), expected)
+
+        progress = [0, 0]
+        text_stream = io.StringIO()
+        json_stream = io.StringIO()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            status_file = os.path.join(tmp_dir, "status.json")
+            reporter = BPG.ProgressReporter(lambda: tuple(progress), 1000, text_stream=text_stream, json_stream=json_stream,
+                                            status_file=status_file, interval=3600)
+            with self.assertRaises(EOFError):
+                with reporter:
+                    progress[:] = [250, 10]
+                    reporter.report()
+                    with open(status_file) as f:
+                        status = json.load(f)
+                    raise EOFError()
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ["status.json"])
+        self.assertEqual((status["state"], status["bytes"], status["records"], status["percent"]), ("running", 250, 10, 25.0))
+        self.assertIsNotNone(status["eta_s"])
+        statuses = [json.loads(line) for line in json_stream.getvalue().splitlines()]
+        self.assertEqual(statuses[0], status)
+        self.assertEqual((len(statuses), statuses[1]["state"], statuses[1]["eta_s"]), (2, BPG.STATE_INCOMPLETE, 0.0))
+        lines = text_stream.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("progress:  25.0%  0.0 of 0.0 MB  "))
+        self.assertIn("  ETA ", lines[0])
+        self.assertIn("  incomplete in 0:00:00", lines[1])
+
+        # unwritable status file: a warning, and no more attempts
+        reporter = BPG.ProgressReporter(lambda: tuple(progress), 1000, status_file=os.path.join(os.devnull, "no_dir", "status.json"))
+        warnings = io.StringIO()
+        with contextlib.redirect_stderr(warnings):
+            with reporter:
+                reporter.report()
+        self.assertIsNone(reporter.status_file)
+        self.assertEqual(len(warnings.getvalue().splitlines()), 1)
+        self.assertTrue(warnings.getvalue().startswith("warning: cannot write progress status file "))
+
+        status = {"state": BPG.STATE_RUNNING, "bytes": 1229300000, "total_bytes": None, "percent": None, "records_per_s": 120345,
+                  "bytes_per_s": 85310000, "eta_s": None}
+        self.assertEqual(BPG.format_status(status), "progress: 1229.3 MB  85.31 MB/s  120345 records/s")
+        self.assertEqual(BPG.format_duration(3725.4), "1:02:05")
+
+
+    def test__parallel_decoding(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, "data.bin")
+            parallel_min_elements = BD.PARALLEL_MIN_ELEMENTS
+            BD.PARALLEL_MIN_ELEMENTS = 2
+            try:
+                # fixed-size elements, and ones which sizes are found by pre-scan; complete data and truncated data
+                for struct_name, size, last_line in (("header_and_points", None, "00000026  footer:        \"FOOTER\""),
+                                                     ("header_and_points", 32, "00000020          y: "),
+                                                     ("list_of_lists", None, "00000055  footer:       \"FOOTER\""),
+                                                     ("list_of_lists", 0x40, "0000003c              data[ 6]: 26 27 28 29 ")):
+                    with open(file_name, "wb") as f:
+                        f.write(DATASETS[struct_name][:size])
+                    outputs = []
+                    progresses = []
+                    for jobs in (1, 2):
+                        dest = io.StringIO()
+                        root_struct = self._create_root_structure(struct_name)
+                        core = BD.BindecoderCore(jobs=jobs)
+                        with open(file_name, "rb") as f, BI.open_input(f) as input_source:
+                            try:
+                                core.process(input_stream=input_source, output_stream=dest, dataset=root_struct)
+                            except EOFError:
+                                self.assertIsNotNone(size)
+                        outputs.append(dest.getvalue())
+                        progresses.append(core.progress())
+                    self.assertEqual(outputs[1], outputs[0])
+                    self.assertEqual(progresses[1], progresses[0])
+                    self.assertEqual(outputs[0].splitlines()[-1], last_line)
+
+                # fixed-size elements referring to a value stored by the previous element: the chunks need namespace snapshots
+                fmt = {"TYPEDEFS": {"back_refs": {"base":"struct", "fields": {
+                    "n": {"base":"uint", "size":1, "format":"{:d}"},
+                    "cnt": {"base":"uint", "size":4, "format":"{:d}"},
+                    "recs": {"base":"struct", "count":"cnt", "fields": {"s": {"base":"char", "size":4, "length":"n"},
+                                                                        "n": {"base":"uint", "size":1, "format":"{:d}"}}}}}}}
+                with open(file_name, "wb") as f:
+                    f.write(bytes([4]) + (40).to_bytes(4, "little") + b"".join(b"ABCD" + bytes([i % 4 + 1]) for i in range(40)))
+                outputs = []
+                for jobs in (1, 2):
+                    dest = io.StringIO()
+                    importlib.reload(BF)
+                    cfg_data = BD.load_json_with_comments(io.StringIO(BD.STANDARD_CONFIG))
+                    root_struct = BD.create_root_structure(cfg_data, fmt, "back_refs", use_config_typedefs=True)
+                    with open(file_name, "rb") as f, BI.open_input(f) as input_source:
+                        BD.BindecoderCore(jobs=jobs).process(input_stream=input_source, output_stream=dest, dataset=root_struct)
+                    outputs.append(dest.getvalue())
+                self.assertEqual(outputs[1], outputs[0])
+                self.assertEqual(outputs[0].splitlines()[-2:], ['000000c8          s: "ABC"', '000000cc          n: 4'])
+            finally:
+                BD.PARALLEL_MIN_ELEMENTS = parallel_min_elements
+
+        plan = BD.BindecoderCore.compile_plan(self._create_root_structure("list_of_lists"))
+        names = BF.referenced_names(plan.root.structure)
+        self.assertEqual(names, {"num_of_lists", "length"})
+        scanner = BX.OffsetScanner(io.BytesIO(DATASETS["list_of_lists"]), names)
+        lists = plan.root.ops[1]
+        self.assertEqual(BX.decode_prefix(scanner, plan.root, lists), 5)
+        chunks = list(scanner.iter_chunks(lists, 5, 2))
+        self.assertEqual([chunk[:3] for chunk in chunks], [(0, 2, 0x02), (2, 4, 0x1d), (4, 5, 0x43)])
+        self.assertEqual(chunks[1][3]["length"], 0, "the value stored by the last element of the previous chunk")
+        self.assertEqual((scanner.complete, scanner.input_offset), (5, 0x55))
+
+
+    def test__batch_mode(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for path, data in (("a/1.bin", DATASETS["header_and_points"]), ("b/1.bin", DATASETS["header_and_points"][:20]),
+                               ("b/2.bin", DATASETS["header_and_points"])):
+                os.makedirs(os.path.join(tmp_dir, os.path.dirname(path)), exist_ok=True)
+                with open(os.path.join(tmp_dir, path), "wb") as f:
+                    f.write(data)
+            input_paths = BD.expand_batch_inputs([os.path.join(tmp_dir, "**", "*.bin"), os.path.join(tmp_dir, "a", "1.bin")])
+            self.assertEqual(input_paths, [os.path.join(tmp_dir, p) for p in ("a/1.bin", "b/1.bin", "b/2.bin")])
+            output_dir = os.path.join(tmp_dir, "out")
+            output_paths = BD.batch_output_paths(input_paths, output_dir, ".txt")
+            self.assertEqual(output_paths, [os.path.join(output_dir, p) for p in ("a/1.bin.txt", "b/1.bin.txt", "b/2.bin.txt")])
+
+            # the same definitions are used for all the files
+            root_struct = self._create_root_structure("header_and_points")
+            settings = {"output_format": "text", "output_buffer_size": 1024, "input_offset": 0}
+            statuses = [BD.decode_batch_file(root_struct, settings, i, o)[1] for i, o in zip(input_paths, output_paths)]
+            self.assertEqual(statuses, ["SUCCESS", "WARNING: Unexpected end of input data.", "SUCCESS"])
+            with open(output_paths[2]) as f:
+                self.assertEqual(f.read(), EXPECTED_HEADER_AND_POINTS + "SUCCESS\n")
+
+            settings["output_format"] = "ndjson"
+            input_path, status, text = BD.decode_batch_file(root_struct, settings, input_paths[0])
+            self.assertEqual(json.loads(text.splitlines()[1]), {"source":input_path, "offset":10, "field":"num_of_points", "value":6})
+
+            input_path, status, text = BD.decode_batch_file(root_struct, settings, os.path.join(tmp_dir, "missing.bin"))
+            self.assertTrue(status.startswith("ERROR"))
+            self.assertIsNone(text)
+
+
+    def test__benchmark(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = []
+            for name, dataset in BB.DATASETS.items():
+                file_name = dataset.create_file(tmp_dir, 1000)
+                self.assertEqual(dataset.create_file(tmp_dir, 1000), file_name, "existing data files are reused")
+                result = BB.run_case(name, file_name, 1000, repeat=1)
+                self.assertEqual((result["dataset"], result["records"], result["input_bytes"]), (name, 1000, os.path.getsize(file_name)))
+                self.assertEqual(list(result["phases"]), ["schema_build", "plan", "decode", "format", "write"])
+                self.assertGreater(result["records_per_s"], 0)
+                results.append(result)
+
+        report = {"version": BB.RESULTS_VERSION, "results": results}
+        baseline = json.loads(json.dumps(report))
+        baseline["results"][0]["records_per_s"] *= 2
+        baseline["results"][1]["records_per_s"] *= 1.05
+        del baseline["results"][2]
+        regressions = BB.compare_results(report, baseline, tolerance=10.0)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("points (1000 records)"))
+        self.assertEqual(results[0]["change_pct"], -50.0)
+        self.assertNotIn("change_pct", results[2], "not in the baseline")
+        with self.assertRaises(BD.InputDataErrorException):
+            BB.compare_results(report, {"version": 0, "results": []})
+
+
+    def test__library_api(self):
+        root = BAPI.decode(DATASETS["list_of_lists"], self._create_root_structure("list_of_lists"))
+        lists = root.lists
+        self.assertEqual(len(lists), 5)
+        self.assertEqual(lists[3].eyecatcher, "DDDD4", "elements are located by scanning preceding ones")
+        self.assertEqual(lists[3].data.to_list(), list(range(0x20, 0x2a)) + [0x30, 0x31, 0x32])
+        self.assertEqual(lists[-1].data[5], 0x35)
+        self.assertEqual(lists[1].data.to_list(), [])
+        self.assertEqual(lists[0]["checksum"], 0xaaaa, "already located elements are accessed again")
+        self.assertEqual([l.length for l in lists], [3, 0, 1, 13, 6])
+        self.assertEqual(root.footer, "FOOTER")
+        self.assertEqual(root.offset("footer"), 0x55)
+        self.assertEqual(lists[2].to_dict(), {"length":1, "eyecatcher":"CCCC3", "checksum":0xcccc, "timestamp":1028936803.0,
+                                              "data":[0x10]})
+        with self.assertRaises(IndexError):
+            lists[5]
+        with self.assertRaises(AttributeError):
+            root.no_such_field
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, "header_and_points.bin")
+            with open(file_name, "wb") as f:
+                f.write(DATASETS["header_and_points"])
+            root = BAPI.decode(file_name, TEST_FORMAT_FILE, root="header_and_points")
+            self.assertEqual(list(root), ["eyecatcher", "num_of_points", "points", "footer"])
+            self.assertEqual(root.points[4].offset(), 0x1e, "fixed-size elements are located by arithmetic")
+            self.assertEqual(root.points[-1].to_dict(), {"x":0x0606, "y":0x6666})
+            del root                            # release the mapping before the file is removed
+
+        root = BAPI.decode(DATASETS["union_in_union_nightmare"], TEST_FORMAT_FILE, root="union_in_union_nightmare")
+        self.assertEqual(root.values[1], {"CHAMELEON": {"INT_ARR": [-1, -32768, 1]}})
+        self.assertEqual(root.values[0], {"CHAMELEON": {"XY": {"x": 16, "y": 17}}})
+        self.assertEqual(root.footer, "FOOTER")
+
+        # formats are built in a private registry, so loading one affects neither the global definitions nor the formats loaded before
+        top_level_fields = dict(BF.StructuralFieldDef.top_level_fields)
+        default_size = BF.IntegerTypeFieldDef.DEFAULT_SIZE
+        fmt = {"DEFAULTS": {"default_integer_size": 2},
+               "TYPEDEFS": {"pair": {"base":"struct", "fields": {"a": {"base":"uint"}, "b": {"base":"uint"}}}}}
+        pair16 = BAPI.load_format(fmt, root="pair")
+        fmt["DEFAULTS"]["default_integer_size"] = 1
+        pair8 = BAPI.load_format(fmt, root="pair")
+        self.assertEqual(BAPI.decode(b"\x01\x02\x03\x04", pair16).to_dict(), {"a": 0x0201, "b": 0x0403})
+        self.assertEqual(BAPI.decode(b"\x01\x02", pair8).to_dict(), {"a": 1, "b": 2})
+        self.assertEqual(BF.StructuralFieldDef.top_level_fields, top_level_fields)
+        self.assertEqual(BF.IntegerTypeFieldDef.DEFAULT_SIZE, default_size)
+
+
+    def test__record_iterator(self):
+        data = DATASETS["list_of_lists"]
+        records = BAPI.iter_records(data, TEST_FORMAT_FILE, "lists", root="list_of_lists", record_type=BAPI.RECORD_TUPLE)
+        self.assertEqual([r[:2] for r in records], [(3, "AAAA1"), (0, "BBBB2"), (1, "CCCC3"), (13, "DDDD4"), (6, "EEEE5")],
+                         "each element count refers to the value decoded in the same element")
+
+        # early termination: the data following the requested elements is not read
+        records = BAPI.iter_records(data[:0x2a], TEST_FORMAT_FILE, root="list_of_lists", record_type=BAPI.RECORD_OBJECT)
+        first, second, third = itertools.islice(records, 3)
+        self.assertEqual((third.eyecatcher, third.data), ("CCCC3", [0x10]))
+        self.assertEqual(first._asdict(), {"length":3, "eyecatcher":"AAAA1", "checksum":0xaaaa, "timestamp":1028936801.0,
+                                           "data":[0, 1, 2]})
+        with self.assertRaises(EOFError):
+            next(records)
+
+        records = list(BAPI.iter_records(DATASETS["header_and_points"], TEST_FORMAT_FILE, "points", root="header_and_points"))
+        self.assertEqual(records[-1], {"x":0x0606, "y":0x6666})
+        records = list(BAPI.iter_records(DATASETS["union_in_union_nightmare"], TEST_FORMAT_FILE, root="union_in_union_nightmare"))
+        self.assertEqual(records[1], {"CHAMELEON": {"INT_ARR": [-1, -32768, 1]}})
+        with self.assertRaises(BD.InputDataErrorException):
+            next(BAPI.iter_records(data, TEST_FORMAT_FILE, "footer", root="list_of_lists"))
+
+
+    def test__buffered_output(self):
+        dest = io.StringIO()
+        output = BO.BufferedOutput(dest, buffer_size=4)
+        output.write("ab")
+        output.commit()
+        self.assertEqual(dest.getvalue(), "", "buffer not full yet")
+        output.write("cd")
+        output.commit()
+        self.assertEqual(dest.getvalue(), "abcd")
+        output.write("e")
+        output.flush()
+        self.assertEqual(dest.getvalue(), "abcde")
+
+        binary_dest = io.BytesIO()
+        text_dest = io.TextIOWrapper(binary_dest, encoding="utf-8", newline="\n")
+        text_dest.write("head ")
+        output = BO.BufferedOutput(text_dest)
+        output.write("za\u017c\u00f3\u0142\u0107")
+        output.flush()
+        self.assertEqual(binary_dest.getvalue(), "head za\u017c\u00f3\u0142\u0107".encode("utf-8"),
+                         "text written directly to the stream must go first")
+
+        # whole output is passed to the target even if decoding fails
+        root_struct = self._create_root_structure("header_and_points")
+        data = DATASETS["header_and_points"]
+        dest = io.StringIO()
+        with self.assertRaises(EOFError):
+            BD.BindecoderCore(output_buffer_size=1).process(input_stream=io.BytesIO(data[:-3]), output_stream=dest, dataset=root_struct)
+        expected_head = EXPECTED_HEADER_AND_POINTS[:EXPECTED_HEADER_AND_POINTS.rindex("footer:")]
+        self.assertEqual(dest.getvalue()[:len(expected_head)], expected_head)
+        self.assertTrue(dest.getvalue().rstrip().endswith("footer:"))
+
+
+    def test__decode_plan(self):
+        root_struct = self._create_root_structure("header_and_points")
+        plan = BD.BindecoderCore.compile_plan(root_struct)
+
+        self.assertEqual([op.opcode for op in plan.root.ops], [BP.OP_VALUE, BP.OP_VALUE, BP.OP_STRUCT, BP.OP_VALUE])
+        self.assertEqual(plan.root.ops[0].label, "eyecatcher:    ")
+        self.assertIsNone(plan.root.ops[2].static_count, "dynamic count expected")
+
+        points = plan.root.ops[2]
+        self.assertEqual(points.block.level, 1)
+        self.assertEqual(points.element_block.level, 2)
+        self.assertEqual(points.element_block.line_format % 0x1234, "\n00001234          ")
+
+        # x and y are unpacked at once
+        run = points.element_block.single_run
+        self.assertEqual([op.opcode for op in points.element_block.ops], [BP.OP_VALUE_RUN])
+        self.assertEqual([op.name for op in run.members], ["x","y"])
+        self.assertEqual(run.unpacker.format, "<HH")
+        self.assertEqual(run.size, 4)
+        self.assertEqual(points.element_size, 4)
+
+        lists = BD.BindecoderCore.compile_plan(self._create_root_structure("list_of_lists")).root.ops[1]
+        self.assertIsNone(lists.element_size, "element size depends on the length field")
+
+
+unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# _*_ coding,utf-8 _*_
+############################################################################################################################################
+
+import datetime
+
+from typing import Dict,List,Tuple,Union,Any,TextIO,BinaryIO,Iterator,NamedTuple,Optional
+
+from . import bindecoder_fields as BF
+from . import bindecoder_input as BI
+from . import bindecoder_plan as BP
+from .bindecoder_input import InputDataErrorException
+
+
+def json_default(value: Any) -> Any:
+    """
+    Converts decoded values that json module cannot handle itself (timestamps as datetime) into JSON serializable ones.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError("Object of type {:s} is not JSON serializable".format(type(value).__name__))
+
+
+class Record(NamedTuple):
+    """
+    A piece of decoded data: a top-level field of the root structure, a single element of top-level structure or union array,
+    or a line (see wrap_at) of top-level array of values.
+    """
+    offset: int             # the offset of the data (relative to the input offset decoding started at)
+    name: str               # top-level field name
+    index: Optional[int]    # array element index (the first one for a line of values), None if the field is not split
+    value: Any
+
+
+class ValueDecoder:
+    """
+    Decodes input data according to the decode plan into plain Python values instead of text:
+    - numbers (int, float) for integers and floats, str for character fields,
+    - seconds (float) or timezone aware datetime.datetime (if timestamps_as_datetime is set) for timestamps,
+    - dict (field name -> value) for structures; skipped fields and fields excluded from presentation are not included,
+    - dict with a single item (variant name -> value) for unions,
+    - list for arrays (count > 1, or any count of non-structural fields not given as explicit 1).
+    Side effects (values stored in the namespace, union variant selection) are the same as during text presentation.
+    """
+
+    def __init__(self, input_stream: Union[BinaryIO,BI.InputSource], timestamps_as_datetime: bool = False):
+        if not isinstance(input_stream, BI.InputSource):
+            input_stream = BI.StreamInput(input_stream)
+        self.input_stream = input_stream
+        self.input_offset = 0
+        self.timestamps_as_datetime = timestamps_as_datetime
+        self.scanner = None                 # BX.OffsetScanner skipping fields excluded from presentation; optional
+
+    def decoder_of(self, field: BF.NonStructuralTypeFieldDef):
+        if self.timestamps_as_datetime and isinstance(field, BF.TimestampTypeFieldDef):
+            return field.decode_datetime
+        return field.decode
+
+    def read(self, size: int) -> bytes:
+        raw_data = self.input_stream.read(size)
+        if len(raw_data) < size:
+            raise EOFError("unexpected end of data file")
+        self.input_offset += size
+        return raw_data
+
+    def skip(self, size: int):
+        self.input_stream.skip(size)
+        self.input_offset += size
+
+    def skip_fields(self, op: BP.DecodeOp):
+        """
+        Skips fields excluded from presentation (OP_HIDDEN op). Without the scanner they are decoded, but their values are dropped.
+        """
+        if self.scanner is None:
+            self.decode_block(op.block)
+            return
+        self.scanner.input_offset = self.input_offset
+        self.scanner.skip_fields(op)
+        self.input_offset = self.scanner.input_offset
+
+    @staticmethod
+    def field_count(op: BP.DecodeOp) -> int:
+        field_count = op.static_count
+        if field_count is None:
+            field_count = op.field.count    # NOTE: this is property that may be calculated by compiled code chunk, so take it once
+        return field_count
+
+    def decode_block(self, block: BP.DecodeBlock) -> Dict[str,Any]:
+        values = {}
+        for op in block.ops:
+            if op.opcode == BP.OP_VALUE_RUN:
+                values.update(self.decode_value_run(op))
+            elif op.opcode == BP.OP_SKIP:
+                self.skip(self.field_count(op))
+            elif op.opcode == BP.OP_HIDDEN:
+                self.skip_fields(op)
+            else:
+                values[op.name] = self.decode_op(op, self.field_count(op))
+        return values
+
+    def decode_value_run(self, run: BP.DecodeOp) -> List[Tuple[str,Any]]:
+        values = run.unpacker.unpack(self.read(run.size))
+        for i, store_value in run.stores:
+            store_value(values[i])
+        return [(member.name, value) for member, value in zip(run.members, values)]
+
+    def decode_values(self, op: BP.DecodeOp, field_count: int) -> List[Any]:
+        field = op.field
+        if op.bulk_array:
+            values = field.unpack_array(self.read(field_count * op.size), field_count)
+            if (field_count > 0) and field.is_stored():
+                field.store_value(values[-1])
+            return values
+        decode = self.decoder_of(field)
+        return [decode(self.read(op.size)) for i in range(field_count)]
+
+    def decode_op(self, op: BP.DecodeOp, field_count: int) -> Any:
+        opcode = op.opcode
+        if opcode == BP.OP_VALUE:
+            return self.decoder_of(op.field)(self.read(op.size))
+        if opcode == BP.OP_ARRAY:
+            if field_count < 0:
+                raise InputDataErrorException("Field \"{:s}\" count is negative: {:d}".format(op.name, field_count))
+            return self.decode_values(op, field_count)
+        if opcode == BP.OP_STRUCT:
+            if field_count > 1:
+                return [self.decode_block(op.element_block) for i in range(field_count)]
+            return self.decode_block(op.block)
+        if opcode == BP.OP_UNION:
+            if field_count > 1:
+                return [self.decode_union(op.field, op.element_variant_ops, i) for i in range(field_count)]
+            return self.decode_union(op.field, op.variant_ops, None)
+        self.skip(field_count)
+        return None
+
+    def decode_union(self, field: BF.UnionFieldDef, variant_ops: Dict[str,BP.DecodeOp], index: int) -> Dict[str,Any]:
+        start_offset = self.input_offset
+        variant = field.choose_variant(self.input_stream)
+        if variant is None:
+            full_name = field.name if index is None else "{:s}[{:d}]".format(field.name, index)
+            raise InputDataErrorException("No variant of union {:s} triggered at offset 0x{:x}".format(full_name, self.input_offset))
+
+        if variant.data_offset > 0:
+            self.skip(variant.data_offset)
+        variant_op = variant_ops[variant.name]
+        value = self.decode_op(variant_op, self.field_count(variant_op))
+
+        if variant.total_size is not None:
+            remaining = variant.total_size - (self.input_offset - start_offset)
+            if remaining < 0:
+                full_name = field.name + "." + variant.name
+                if index is not None:
+                    full_name = "{:s}[{:d}]".format(full_name, index)
+                raise InputDataErrorException(
+                    "Total size ({:d}) specified for field variant {:s} is smaller than the actual number of bytes consumed ({:d})"
+                    .format(variant.total_size, full_name, self.input_offset - start_offset))
+            self.skip(remaining)
+        return {variant.name: value}
+
+    def iter_records(self, block: BP.DecodeBlock) -> Iterator[Record]:
+        """
+        Decodes fields of the (root) structure one by one. Arrays of structures and unions are split into single elements,
+        and arrays of values into lines of wrap_at elements, so even huge arrays are decoded in small pieces.
+        """
+        for op in block.ops:
+            field_count = self.field_count(op)
+            opcode = op.opcode
+
+            if opcode == BP.OP_SKIP:
+                self.skip(field_count)
+
+            elif opcode == BP.OP_HIDDEN:
+                self.skip_fields(op)
+
+            elif opcode == BP.OP_VALUE_RUN:
+                offset = self.input_offset
+                for member, (name, value) in zip(op.members, self.decode_value_run(op)):
+                    yield Record(offset, name, None, value)
+                    offset += member.size
+
+            elif (opcode == BP.OP_STRUCT) and (field_count > 1):
+                for i in range(field_count):
+                    offset = self.input_offset
+                    yield Record(offset, op.name, i, self.decode_block(op.element_block))
+
+            elif (opcode == BP.OP_UNION) and (field_count > 1):
+                for i in range(field_count):
+                    offset = self.input_offset
+                    yield Record(offset, op.name, i, self.decode_union(op.field, op.element_variant_ops, i))
+
+            elif (opcode == BP.OP_ARRAY) and (field_count > op.field.wrap_at):
+                wrap_at = op.field.wrap_at
+                for i in range(0, field_count, wrap_at):
+                    offset = self.input_offset
+                    n = min(wrap_at, field_count - i)
+                    available = len(self.input_stream.peek(n * op.size)) // op.size
+                    if available < n:       # the end of data; like text presentation, present the values that are there (e.g. dumps)
+                        if available > 0:
+                            yield Record(offset, op.name, i, self.decode_values(op, available))
+                        raise EOFError("unexpected end of data file")
+                    yield Record(offset, op.name, i, self.decode_values(op, n))
+
+            else:
+                offset = self.input_offset
+                yield Record(offset, op.name, None, self.decode_op(op, field_count))